@@ -0,0 +1,518 @@
+# Ast.py
+# Slotted AST nodes kept in an arena
+# The parser builds every node through a builder. DictBuilder gives the
+# plain dicts the parser has always returned; AstArena stores slotted node
+# objects in one list and hands back their index, with child nodes and
+# tokens held as indices too, into the arena and the TokenTable.
+from collections.abc import Mapping
+from enum import IntEnum
+
+
+class NodeKind(IntEnum):
+    PROGRAM              = 1
+    FUNCTION_DEFINITION  = 2
+    FUNCTION_DECLARATION = 3
+    FUNCTION_CALL        = 4
+    PARAMETER            = 5
+    IF_STATEMENT         = 6
+    WHILE_STATEMENT      = 7
+    RETURN_STATEMENT     = 8
+    STRUCT_DECLARATION   = 9
+    BLOCK_STATEMENT      = 10
+    EXPRESSION_STATEMENT = 11
+    ASSIGNMENT           = 12
+    DECLARATION          = 13
+    TARGET               = 14   # A bare name being assigned to, a dict of type "Assignment"
+    IDENTIFIER           = 15
+    LITERAL              = 16
+    BINARY_OPERATION     = 17
+    UNARY_OPERATION      = 18
+    POSTFIX_OPERATION    = 19
+    TERNARY_OPERATION    = 20
+    INDEX                = 21
+    MEMBER_ACCESS        = 22
+    TYPEDEF_DECLARATION  = 23
+    LAZY_BLOCK           = 24   # A function body outline mode stepped over
+
+
+# What a field holds, and what it turns into in a dict
+CHILD    = 0  # A node, or None
+CHILDREN = 1  # A sequence of nodes
+TOKEN    = 2  # A token index, a token in the dict, or None
+VALUE    = 3  # A token index, the token's text in the dict
+TEXT     = 4  # A string, kept as it is
+
+
+class Node:
+    """
+    Base of the slotted node classes.
+
+    Each subclass lists its fields as (attribute, dict key, field kind) in
+    the order the parser passes them; the attribute differs from the key
+    only where the key is a Python keyword.
+    """
+    __slots__ = ()
+    kind = None
+    type_name = None
+    fields = ()
+
+    def __repr__(self):
+        values = ', '.join(f'{attribute}={getattr(self, attribute)!r}' for attribute, _, _ in self.fields)
+        return f'{type(self).__name__}({values})'
+
+
+class Program(Node):
+    __slots__ = ('body',)
+    kind, type_name = NodeKind.PROGRAM, 'Program'
+    fields = (('body', 'body', CHILDREN),)
+
+    def __init__(self, body):
+        self.body = tuple(body)
+
+
+class FunctionDefinition(Node):
+    __slots__ = ('returnType', 'name', 'parameters', 'body')
+    kind, type_name = NodeKind.FUNCTION_DEFINITION, 'FunctionDefinition'
+    fields = (('returnType', 'returnType', VALUE), ('name', 'name', VALUE),
+              ('parameters', 'parameters', CHILDREN), ('body', 'body', CHILD))
+
+    def __init__(self, returnType, name, parameters, body):
+        self.returnType = returnType
+        self.name = name
+        self.parameters = tuple(parameters)
+        self.body = body
+
+
+class FunctionDeclaration(Node):
+    __slots__ = ('returnType', 'name', 'parameters')
+    kind, type_name = NodeKind.FUNCTION_DECLARATION, 'FunctionDeclaration'
+    fields = (('returnType', 'returnType', VALUE), ('name', 'name', VALUE),
+              ('parameters', 'parameters', CHILDREN))
+
+    def __init__(self, returnType, name, parameters):
+        self.returnType = returnType
+        self.name = name
+        self.parameters = tuple(parameters)
+
+
+class FunctionCall(Node):
+    __slots__ = ('name', 'callee', 'parameters')
+    kind, type_name = NodeKind.FUNCTION_CALL, 'FunctionCall'
+    fields = (('name', 'name', TEXT), ('callee', 'callee', CHILD), ('parameters', 'parameters', CHILDREN))
+
+    def __init__(self, name, callee, parameters):
+        self.name = name
+        self.callee = callee
+        self.parameters = tuple(parameters)
+
+
+class Parameter(Node):
+    __slots__ = ('paramType', 'name')
+    kind, type_name = NodeKind.PARAMETER, 'Parameter'
+    fields = (('paramType', 'paramType', VALUE), ('name', 'name', VALUE))
+
+    def __init__(self, paramType, name):
+        self.paramType = paramType
+        self.name = name
+
+
+class IfStatement(Node):
+    __slots__ = ('condition', 'then', 'otherwise')
+    kind, type_name = NodeKind.IF_STATEMENT, 'IfStatement'
+    fields = (('condition', 'condition', CHILD), ('then', 'then', CHILD), ('otherwise', 'else', CHILD))
+
+    def __init__(self, condition, then, otherwise):
+        self.condition = condition
+        self.then = then
+        self.otherwise = otherwise
+
+
+class WhileStatement(Node):
+    __slots__ = ('condition', 'body')
+    kind, type_name = NodeKind.WHILE_STATEMENT, 'WhileStatement'
+    fields = (('condition', 'condition', CHILD), ('body', 'body', CHILD))
+
+    def __init__(self, condition, body):
+        self.condition = condition
+        self.body = body
+
+
+class ReturnStatement(Node):
+    __slots__ = ('expression',)
+    kind, type_name = NodeKind.RETURN_STATEMENT, 'ReturnStatement'
+    fields = (('expression', 'expression', CHILD),)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+
+class StructDeclaration(Node):
+    __slots__ = ('name', 'fields_')
+    kind, type_name = NodeKind.STRUCT_DECLARATION, 'StructDeclaration'
+    fields = (('name', 'name', VALUE), ('fields_', 'fields', CHILDREN))
+
+    def __init__(self, name, fields_):
+        self.name = name
+        self.fields_ = tuple(fields_)
+
+
+class TypedefDeclaration(Node):
+    __slots__ = ('varType', 'name')
+    kind, type_name = NodeKind.TYPEDEF_DECLARATION, 'TypedefDeclaration'
+    fields = (('varType', 'varType', VALUE), ('name', 'name', VALUE))
+
+    def __init__(self, varType, name):
+        self.varType = varType
+        self.name = name
+
+
+class LazyBlock(Node):
+    __slots__ = ('start', 'stop')
+    kind, type_name = NodeKind.LAZY_BLOCK, 'BlockStatement'
+    fields = (('start', 'start', TOKEN), ('stop', 'stop', TOKEN))
+
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+
+
+class BlockStatement(Node):
+    __slots__ = ('body',)
+    kind, type_name = NodeKind.BLOCK_STATEMENT, 'BlockStatement'
+    fields = (('body', 'body', CHILDREN),)
+
+    def __init__(self, body):
+        self.body = tuple(body)
+
+
+class ExpressionStatement(Node):
+    __slots__ = ('expression',)
+    kind, type_name = NodeKind.EXPRESSION_STATEMENT, 'ExpressionStatement'
+    fields = (('expression', 'expression', CHILD),)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+
+class Assignment(Node):
+    __slots__ = ('variable', 'operator', 'value')
+    kind, type_name = NodeKind.ASSIGNMENT, 'Assignment'
+    fields = (('variable', 'variable', CHILD), ('operator', 'operator', TEXT), ('value', 'value', CHILD))
+
+    def __init__(self, variable, operator, value):
+        self.variable = variable
+        self.operator = operator
+        self.value = value
+
+
+class Declaration(Node):
+    __slots__ = ('varType', 'name')
+    kind, type_name = NodeKind.DECLARATION, 'Declaration'
+    fields = (('varType', 'varType', TOKEN), ('name', 'name', TOKEN))
+
+    def __init__(self, varType, name):
+        self.varType = varType
+        self.name = name
+
+
+class Target(Node):
+    __slots__ = ('varType', 'name')
+    kind, type_name = NodeKind.TARGET, 'Assignment'
+    fields = (('varType', 'varType', TOKEN), ('name', 'name', TOKEN))
+
+    def __init__(self, varType, name):
+        self.varType = varType
+        self.name = name
+
+
+class Identifier(Node):
+    __slots__ = ('value',)
+    kind, type_name = NodeKind.IDENTIFIER, 'Identifier'
+    fields = (('value', 'value', VALUE),)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Literal(Node):
+    __slots__ = ('value',)
+    kind, type_name = NodeKind.LITERAL, 'Literal'
+    fields = (('value', 'value', VALUE),)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class BinaryOperation(Node):
+    __slots__ = ('left', 'operator', 'right')
+    kind, type_name = NodeKind.BINARY_OPERATION, 'BinaryOperation'
+    fields = (('left', 'left', CHILD), ('operator', 'operator', TEXT), ('right', 'right', CHILD))
+
+    def __init__(self, left, operator, right):
+        self.left = left
+        self.operator = operator
+        self.right = right
+
+
+class UnaryOperation(Node):
+    __slots__ = ('operator', 'operand')
+    kind, type_name = NodeKind.UNARY_OPERATION, 'UnaryOperation'
+    fields = (('operator', 'operator', TEXT), ('operand', 'operand', CHILD))
+
+    def __init__(self, operator, operand):
+        self.operator = operator
+        self.operand = operand
+
+
+class PostfixOperation(Node):
+    __slots__ = ('operator', 'operand')
+    kind, type_name = NodeKind.POSTFIX_OPERATION, 'PostfixOperation'
+    fields = (('operator', 'operator', TEXT), ('operand', 'operand', CHILD))
+
+    def __init__(self, operator, operand):
+        self.operator = operator
+        self.operand = operand
+
+
+class TernaryOperation(Node):
+    __slots__ = ('condition', 'then', 'otherwise')
+    kind, type_name = NodeKind.TERNARY_OPERATION, 'TernaryOperation'
+    fields = (('condition', 'condition', CHILD), ('then', 'then', CHILD), ('otherwise', 'else', CHILD))
+
+    def __init__(self, condition, then, otherwise):
+        self.condition = condition
+        self.then = then
+        self.otherwise = otherwise
+
+
+class Index(Node):
+    __slots__ = ('object', 'index')
+    kind, type_name = NodeKind.INDEX, 'Index'
+    fields = (('object', 'object', CHILD), ('index', 'index', CHILD))
+
+    def __init__(self, object, index):
+        self.object = object
+        self.index = index
+
+
+class MemberAccess(Node):
+    __slots__ = ('object', 'operator', 'member')
+    kind, type_name = NodeKind.MEMBER_ACCESS, 'MemberAccess'
+    fields = (('object', 'object', CHILD), ('operator', 'operator', TEXT), ('member', 'member', VALUE))
+
+    def __init__(self, object, operator, member):
+        self.object = object
+        self.operator = operator
+        self.member = member
+
+
+NODE_CLASSES = {cls.kind: cls for cls in Node.__subclasses__()}
+
+
+class LazyBody(Mapping):
+    """
+    A function body outline mode stepped over, standing in for its
+    BlockStatement dict.
+
+    start and stop are the token indices of its { and }. Reading anything
+    else parses the body, once, through parse(start).
+    """
+    __slots__ = ('start', 'stop', '_parse', '_node')
+
+    def __init__(self, parse, start, stop):
+        self.start = start
+        self.stop = stop
+        self._parse = parse
+        self._node = None
+
+    @property
+    def parsed(self):
+        return self._node is not None
+
+    @property
+    def node(self):
+        if self._node is None:
+            if self._parse is None:
+                raise ValueError(f'No parser to read the body at token {self.start} with')
+            self._node = self._parse(self.start)
+            self._parse = None
+        return self._node
+
+    def __getitem__(self, key):
+        return self.node[key]
+
+    def __iter__(self):
+        return iter(self.node)
+
+    def __len__(self):
+        return len(self.node)
+
+    def __repr__(self):
+        if self._node is not None:
+            return repr(self._node)
+        return f'LazyBody({self.start}, {self.stop})'
+
+
+class DictBuilder:
+    """
+    Builds nodes as plain dicts, {"type": ..., field: value, ...}.
+
+    makers[kind] makes one node of that kind from its field values; the
+    expression loop looks its makers up once rather than per node.
+    """
+    def __init__(self, tokens, parse_body=None):
+        self.tokens = tokens
+        self.parse_body = parse_body    # start token -> BlockStatement, for LazyBody
+        value = tokens.value
+        def token(index):
+            return None if index is None else tokens[index]
+
+        makers = [None] * (max(NodeKind) + 1)
+        makers[NodeKind.PROGRAM] = lambda body: {"type": "Program", "body": body}
+        makers[NodeKind.FUNCTION_DEFINITION] = lambda returnType, name, parameters, body: {
+            "type": "FunctionDefinition", "returnType": value(returnType), "name": value(name),
+            "parameters": parameters, "body": body}
+        makers[NodeKind.FUNCTION_DECLARATION] = lambda returnType, name, parameters: {
+            "type": "FunctionDeclaration", "returnType": value(returnType), "name": value(name),
+            "parameters": parameters}
+        makers[NodeKind.FUNCTION_CALL] = lambda name, callee, parameters: {
+            "type": "FunctionCall", "name": name, "callee": callee, "parameters": parameters}
+        makers[NodeKind.PARAMETER] = lambda paramType, name: {
+            "type": "Parameter", "paramType": value(paramType), "name": value(name)}
+        makers[NodeKind.IF_STATEMENT] = lambda condition, then, otherwise: {
+            "type": "IfStatement", "condition": condition, "then": then, "else": otherwise}
+        makers[NodeKind.WHILE_STATEMENT] = lambda condition, body: {
+            "type": "WhileStatement", "condition": condition, "body": body}
+        makers[NodeKind.RETURN_STATEMENT] = lambda expression: {"type": "ReturnStatement", "expression": expression}
+        makers[NodeKind.STRUCT_DECLARATION] = lambda name, fields: {
+            "type": "StructDeclaration", "name": value(name), "fields": fields}
+        makers[NodeKind.TYPEDEF_DECLARATION] = lambda varType, name: {
+            "type": "TypedefDeclaration", "varType": value(varType), "name": value(name)}
+        makers[NodeKind.LAZY_BLOCK] = lambda start, stop: LazyBody(self.parse_body, start, stop)
+        makers[NodeKind.BLOCK_STATEMENT] = lambda body: {"type": "BlockStatement", "body": body}
+        makers[NodeKind.EXPRESSION_STATEMENT] = lambda expression: {"type": "ExpressionStatement", "expression": expression}
+        makers[NodeKind.ASSIGNMENT] = lambda variable, operator, right: {
+            "type": "Assignment", "variable": variable, "operator": operator, "value": right}
+        makers[NodeKind.DECLARATION] = lambda varType, name: {
+            "type": "Declaration", "varType": token(varType), "name": token(name)}
+        makers[NodeKind.TARGET] = lambda varType, name: {
+            "type": "Assignment", "varType": token(varType), "name": token(name)}
+        makers[NodeKind.IDENTIFIER] = lambda index: {"type": "Identifier", "value": value(index)}
+        makers[NodeKind.LITERAL] = lambda index: {"type": "Literal", "value": value(index)}
+        makers[NodeKind.BINARY_OPERATION] = lambda left, operator, right: {
+            "type": "BinaryOperation", "left": left, "operator": operator, "right": right}
+        makers[NodeKind.UNARY_OPERATION] = lambda operator, operand: {
+            "type": "UnaryOperation", "operator": operator, "operand": operand}
+        makers[NodeKind.POSTFIX_OPERATION] = lambda operator, operand: {
+            "type": "PostfixOperation", "operator": operator, "operand": operand}
+        makers[NodeKind.TERNARY_OPERATION] = lambda condition, then, otherwise: {
+            "type": "TernaryOperation", "condition": condition, "then": then, "else": otherwise}
+        makers[NodeKind.INDEX] = lambda target, index: {"type": "Index", "object": target, "index": index}
+        makers[NodeKind.MEMBER_ACCESS] = lambda target, operator, member: {
+            "type": "MemberAccess", "object": target, "operator": operator, "member": value(member)}
+        self.makers = makers
+
+    def build(self, kind, *values):
+        return self.makers[kind](*values)
+
+
+def _arena_maker(cls, nodes):
+    append = nodes.append
+    def make(*values):
+        append(cls(*values))
+        return len(nodes) - 1
+    return make
+
+
+class AstArena:
+    """
+    Slotted nodes for one TokenTable, stored in a list.
+
+    build returns the new node's index, and makers[kind] is build for one
+    kind, as in DictBuilder. Node fields that refer to other nodes hold
+    their indices, and token fields hold token indices. A child is always
+    built before its parent, so it has the smaller index; the one exception
+    is a body expand parses out of a LazyBlock, which comes after it.
+    """
+    def __init__(self, tokens, parse_body=None):
+        self.tokens = tokens
+        self.parse_body = parse_body    # start token -> BlockStatement index, for expand
+        self._bodies = {}               # start token -> index of the body parsed there
+        self.nodes = []
+        self.makers = [None] * (max(NodeKind) + 1)
+        for kind, cls in NODE_CLASSES.items():
+            self.makers[kind] = _arena_maker(cls, self.nodes)
+
+    def build(self, kind, *values):
+        return self.makers[kind](*values)
+
+    def __getitem__(self, index):
+        return self.nodes[index]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def expand(self, index):
+        """
+        Index of the BlockStatement a LazyBlock at index stands for, parsed
+        into the arena the first time; any other node's own index.
+        """
+        node = self.nodes[index]
+        if node.kind != NodeKind.LAZY_BLOCK:
+            return index
+        return self._body_at(node.start)
+
+    def _body_at(self, start):
+        body = self._bodies.get(start)
+        if body is None:
+            if self.parse_body is None:
+                raise ValueError(f'No parser to read the body at token {start} with')
+            body = self._bodies[start] = self.parse_body(start)
+        return body
+
+    def children(self, index):
+        """
+        Indices of the direct children of node index, in field order.
+        """
+        node = self.nodes[index]
+        result = []
+        for attribute, _, field in node.fields:
+            value = getattr(node, attribute)
+            if field == CHILD:
+                if value is not None:
+                    result.append(value)
+            elif field == CHILDREN:
+                result.extend(child for child in value if child is not None)
+        return result
+
+    def walk(self, root):
+        """
+        Yield the indices of root and everything under it, parents first.
+        """
+        stack = [root]
+        while stack:
+            index = stack.pop()
+            yield index
+            stack.extend(reversed(self.children(index)))
+
+    def to_dict(self, root):
+        """
+        The dict form of node root and its subtree, as DictBuilder would have built it.
+        """
+        # Children have smaller indices, so building in index order always
+        # finds them done; no recursion however deep the tree
+        reachable = sorted(self.walk(root))
+        done = {}
+        makers = DictBuilder(self.tokens, lambda start: self.to_dict(self._body_at(start))).makers
+        for index in reachable:
+            node = self.nodes[index]
+            values = []
+            for attribute, _, field in node.fields:
+                value = getattr(node, attribute)
+                if field == CHILD:
+                    value = None if value is None else done[value]
+                elif field == CHILDREN:
+                    value = [None if child is None else done[child] for child in value]
+                values.append(value)
+            done[index] = makers[node.kind](*values)
+        return done[root]
@@ -0,0 +1,201 @@
+# Batch.py
+# Tokenize and parse whole source trees on a process pool
+# Run directly: python Batch.py src/ 'include/**/*.h' -j 8
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+from dataclasses import dataclass
+import functools
+import glob
+import os
+import sys
+import time
+
+from Tokenizer import load_code, tokenize
+from Parser import Parser
+from Cache import TokenCache
+
+
+# File extensions picked up when a directory is given
+SOURCE_EXTENSIONS = ('.c', '.h')
+
+# Each worker gets about this many chunks of the file list over a run, so
+# slow files even out without paying the pool overhead per file
+CHUNKS_PER_WORKER = 4
+
+
+@dataclass
+class FileResult:
+    path: str = None        # Source file
+    size: int = 0           # Size in bytes
+    tokens: int = 0         # Number of tokens
+    ast: dict = None        # parse_program output, None if not parsed
+    error: str = None       # Why the file failed, None on success
+    cached: bool = False    # Served from the token cache
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def collect_files(patterns, extensions=SOURCE_EXTENSIONS):
+    """
+    Expand directories and glob patterns into a list of source files.
+
+    Directories are walked recursively for files with one of extensions,
+    patterns are expanded with glob (** included). Each file is listed once,
+    in the order first found.
+    """
+    files = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.endswith(extensions):
+                        files.setdefault(os.path.join(root, name))
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    files.setdefault(path)
+    return list(files)
+
+
+# One TokenCache per directory per worker process
+_caches = {}
+
+
+def _parse_quietly(tokens):
+    # parse_program reports its progress on stdout, which would only
+    # interleave between workers
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return Parser(tokens).parse_program()
+
+
+def process_file(path, parse=True, cache_dir=None):
+    """
+    load_code, tokenize and optionally parse one file.
+
+    With cache_dir the file is read as bytes and looked up in a TokenCache
+    there first. Never raises, a failure is recorded on the returned
+    FileResult so one bad file doesn't stop the rest of a batch.
+    """
+    result = FileResult(path)
+    try:
+        result.size = os.path.getsize(path)
+        if cache_dir is None:
+            tokens = tokenize(load_code(path))
+            result.tokens = len(tokens)
+            if parse:
+                result.ast = _parse_quietly(tokens)
+        else:
+            cache = _caches.get(cache_dir)
+            if cache is None:
+                # The parent trims the directory once the batch is done
+                cache = _caches[cache_dir] = TokenCache(cache_dir, max_bytes=None)
+            with open(path, 'rb') as file:
+                content = file.read()
+            hits = cache.hits
+            tokens, ast = cache.tokenize(content)
+            result.cached = cache.hits > hits
+            result.tokens = len(tokens)
+            if parse and ast is None:
+                ast = _parse_quietly(tokens)
+                cache.put(content, tokens, ast)
+            result.ast = ast if parse else None
+    except Exception as error:
+        result.error = f'{type(error).__name__}: {error}'
+    return result
+
+
+def process_source(path, content, parse=True):
+    """
+    tokenize and optionally parse content already read from path, as text or bytes.
+
+    Never raises, as process_file.
+    """
+    result = FileResult(path, len(content))
+    try:
+        tokens = tokenize(content)
+        result.tokens = len(tokens)
+        if parse:
+            result.ast = _parse_quietly(tokens)
+    except Exception as error:
+        result.error = f'{type(error).__name__}: {error}'
+    return result
+
+
+def default_chunksize(count, workers):
+    return max(1, count // (workers * CHUNKS_PER_WORKER))
+
+
+def run_batch(paths, workers=None, chunksize=None, parse=True, cache_dir=None):
+    """
+    Process paths on a pool of worker processes.
+
+    Returns a FileResult per path, in the same order as paths. chunksize is
+    how many files are handed to a worker at once; by default the list is
+    split into about CHUNKS_PER_WORKER chunks per worker. cache_dir turns on
+    the token cache, trimmed to its default size once the batch is done.
+    """
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = default_chunksize(len(paths), workers)
+    func = functools.partial(process_file, parse=parse, cache_dir=cache_dir)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(func, paths, chunksize=chunksize))
+    if cache_dir is not None:
+        TokenCache(cache_dir).trim()
+    return results
+
+
+def summarize(results, elapsed):
+    """
+    Aggregate counts and throughput for a batch that took elapsed seconds.
+    """
+    size = sum(result.size for result in results)
+    tokens = sum(result.tokens for result in results)
+    elapsed = elapsed or 1e-9
+    return {
+        'files': len(results),
+        'failed': sum(1 for result in results if not result.ok),
+        'cached': sum(1 for result in results if result.cached),
+        'bytes': size,
+        'tokens': tokens,
+        'seconds': elapsed,
+        'files_per_s': len(results) / elapsed,
+        'mb_per_s': size / elapsed / 1e6,
+        'tokens_per_s': tokens / elapsed,
+    }
+
+
+def print_summary(summary, file=None):
+    print(f"{summary['files']} files, {summary['failed']} failed, {summary['cached']} cached, "
+          f"{summary['bytes'] / 1e6:.2f} MB, {summary['tokens']} tokens in {summary['seconds']:.2f}s", file=file)
+    print(f"{summary['files_per_s']:.1f} files/s  {summary['mb_per_s']:.2f} MB/s  "
+          f"{summary['tokens_per_s']:.0f} tokens/s", file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tokenize and parse c sources in parallel.')
+    parser.add_argument('patterns', nargs='+', help='directories or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: cpu count)')
+    parser.add_argument('--chunksize', type=int, default=None, help='files handed to a worker at once')
+    parser.add_argument('--no-parse', action='store_true', help='only tokenize')
+    parser.add_argument('--cache', default=None, help='token cache directory')
+    args = parser.parse_args(argv)
+
+    paths = collect_files(args.patterns)
+    start = time.perf_counter()
+    results = run_batch(paths, args.workers, args.chunksize, parse=not args.no_parse, cache_dir=args.cache)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        if not result.ok:
+            print(f'{result.path}: {result.error}')
+    print_summary(summarize(results, elapsed))
+    return 1 if any(not result.ok for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,907 @@
+# Benchmark.py
+# Timing and cross checks for the lexer backends
+# Run directly: python Benchmark.py
+import asyncio
+from collections.abc import Mapping
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from Tokenizer import tokenize, tokenize_stream, BACKEND_REGEX, BACKEND_DFA
+from JumpIndex import JumpIndex, NONE
+from Incremental import relex, reparse
+from Parser import Parser
+from TokenTable import TokenTable, TokenView
+from Includes import IncludeProcessor
+from Macros import MacroExpander
+from Symbols import SymbolKind
+from Pipeline import DelayedReader, run_pipeline
+from Batch import process_source
+from Packed import pack, PackedFile
+from Index import SymbolIndex
+from Corpus import CORPORA, generate, sized
+from Ast import AstArena, NodeKind
+
+
+# Fragments the backend fuzzer strings together, weighted towards the places
+# where the two backends could disagree: comment, string and directive edges
+FUZZ_FRAGMENTS = list("/*#\"'\\ \t\n\r\f.{}()[],;0123456789bxtrueflsaAZ_+-%=!<>&|^~?:@$é٣") + [
+    'true', 'false', '/*', '*/', '**/', '//', '#define ', '#include <x>\n', '\n#',
+    '0b1', '1.5', '"a\\"b"', "'\\''"]
+
+
+# Inputs that drive a backtracking lexer super-linear, each built to about n characters
+ADVERSARIAL_CORPUS = {
+    'unterminated_comment':   lambda n: '/*' + 'a' * n,
+    'unterminated_stars':     lambda n: '/*' + '*a' * (n // 2),
+    'star_flood':             lambda n: '/' + '*' * n,
+    'comment_opener_flood':   lambda n: '/*' * (n // 2),
+    'unterminated_string':    lambda n: '"' + 'a' * n,
+    'escaped_quote_flood':    lambda n: '"\\' * (n // 2),
+    'unterminated_char_flood': lambda n: "'\\" * (n // 2),
+    'escaped_newline_strings': lambda n: '"a\\\n' * (n // 4),
+    'blanks_before_hash':     lambda n: ' ' * n + '#',
+    'newlines_before_hash':   lambda n: '\n' * n + '#include<x>',
+    'hash_flood':             lambda n: '# ' * (n // 2),
+    'long_directive_line':    lambda n: '#define X ' + 'a' * n,
+    'long_code_line':         lambda n: 'x = y + 1; ' * (n // 11),
+    'operator_flood':         lambda n: '+' * n,
+    'identifier_flood':       lambda n: 'a' * n,
+    'binary_prefix_flood':    lambda n: '0b' * (n // 2),
+    # Closers none of the openers match, for the jump index's bracket pass
+    'bracket_imbalance':      lambda n: '(' * (n // 2) + ']' * (n // 2),
+}
+
+# Lexers timed by check_linear, and the jump index every Parser builds on their tokens
+LEXERS = {
+    BACKEND_REGEX: lambda code: tokenize(code, BACKEND_REGEX),
+    BACKEND_DFA:   lambda code: tokenize(code, BACKEND_DFA),
+    'stream':      lambda code: sum(1 for _ in tokenize_stream(io.StringIO(code))),
+    'jumps':       lambda code: JumpIndex(tokenize(code).types),
+}
+
+
+def token_rows(table):
+    return [(token.base, token.ofType, token.start, token.end) for token in table]
+
+
+def compare_backends(code):
+    """
+    Lex code with both backends, return None if they agree, else the first differing index.
+    """
+    regex_rows = token_rows(tokenize(code, BACKEND_REGEX))
+    dfa_rows = token_rows(tokenize(code, BACKEND_DFA))
+    for index, (a, b) in enumerate(zip(regex_rows, dfa_rows)):
+        if a != b:
+            return index
+    if len(regex_rows) != len(dfa_rows):
+        return min(len(regex_rows), len(dfa_rows))
+    return None
+
+
+def fuzz_backends(trials=2000, seed=0, max_fragments=60):
+    """
+    Differential check of the backends over random text and bytes.
+
+    Returns the list of inputs the backends disagreed on.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(trials):
+        code = ''.join(rng.choice(FUZZ_FRAGMENTS) for _ in range(rng.randint(0, max_fragments)))
+        for source in (code, code.encode('utf-8')):
+            if compare_backends(source) is not None:
+                failures.append(source)
+    return failures
+
+
+def identifier_heavy_source(lines=20000, seed=0):
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz_'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 14))) for _ in range(500)]
+    return '\n'.join(' '.join(rng.choice(words) for _ in range(10)) + ';' for _ in range(lines))
+
+
+def time_backend(code, backend, repeat=3):
+    """
+    Best of repeat wall clock seconds for tokenize(code, backend).
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokenize(code, backend)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _best_time(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_linear(size=64 * 1024, doublings=3, repeat=3, lexers=LEXERS):
+    """
+    Time every lexer on every ADVERSARIAL_CORPUS input, doubling the size each step.
+
+    Returns (name, lexer, growth) for each pair, where growth is the smallest
+    slowdown seen over one doubling: about 2 for linear time and 4 for
+    quadratic, which is 4 at every step. Taking the smallest step rides out
+    the one-off jumps when the input outgrows a cpu cache, which a single
+    large/small ratio would take for super-linearity.
+    """
+    results = []
+    for name, build in ADVERSARIAL_CORPUS.items():
+        inputs = [build(size << step) for step in range(doublings + 1)]
+        for lexer, func in lexers.items():
+            times = [_best_time(func, code, repeat) for code in inputs]
+            results.append((name, lexer, min(large / small for small, large in zip(times, times[1:]))))
+    return results
+
+
+def _nested_source(rng, depth=0):
+    # Random well bracketed token soup, with ; between the pieces
+    parts = []
+    for _ in range(rng.randint(0, 4)):
+        choice = rng.random()
+        if choice < 0.3 and depth < 6:
+            opener, closer = rng.choice(('()', '[]', '{}'))
+            parts.append(opener + ' ' + _nested_source(rng, depth + 1) + ' ' + closer)
+        elif choice < 0.5:
+            parts.append(';')
+        elif choice < 0.6:
+            parts.append('/* c */')
+        else:
+            parts.append(rng.choice(('a', '1', '+', 'b')))
+    return ' '.join(parts)
+
+
+def check_jump_index(trials=500, seed=0):
+    """
+    Check JumpIndex against plain forward scans over random bracketed sources.
+
+    Returns the list of sources where a table disagreed.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(trials):
+        code = _nested_source(rng)
+        table = tokenize(code)
+        values = [token.value for token in table]
+        jumps = JumpIndex(table.types)
+
+        matching = [NONE] * len(values)
+        open_positions = []
+        for position, value in enumerate(values):
+            if value in '([{':
+                open_positions.append(position)
+            elif value in ')]}':
+                start = open_positions.pop()
+                matching[start], matching[position] = position, start
+
+        next_semicolon = [next((i for i in range(position, len(values)) if values[i] == ';'), NONE)
+                          for position in range(len(values))]
+
+        # Items cover every non comment token, in order
+        item_ends = [jumps.item_end[i] for i, value in enumerate(values) if not value.startswith('/*')]
+
+        if (list(jumps.matching) != matching
+                or list(jumps.next_semicolon[:len(values)]) != next_semicolon
+                or item_ends != sorted(item_ends) or NONE in item_ends):
+            failures.append(code)
+    return failures
+
+
+def check_relex(trials=3000, seed=0, max_fragments=80, edits=3):
+    """
+    Check relex against a full tokenize after random edits, over text and bytes.
+
+    Each source takes a few edits in a row, every one applied to the
+    previous relex result. Returns the list of (source, offset, deleted,
+    inserted) edits that came out different.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(trials):
+        code = ''.join(rng.choice(FUZZ_FRAGMENTS) for _ in range(rng.randint(0, max_fragments)))
+        if rng.random() < 0.5:
+            code = code.encode('utf-8')
+        table = tokenize(code)
+        for _ in range(edits):
+            source = table.source
+            offset = rng.randint(0, len(source))
+            deleted = rng.randint(0, min(5, len(source) - offset))
+            inserted = ''.join(rng.choice(FUZZ_FRAGMENTS) for _ in range(rng.randint(0, 3)))
+            if isinstance(source, bytes):
+                inserted = inserted.encode('utf-8')
+            table = relex(table, offset, deleted, inserted).table
+            if token_rows(table) != token_rows(tokenize(table.source)):
+                failures.append((source, offset, deleted, inserted))
+                break
+    return failures
+
+
+def check_locations(trials=1000, seed=0, max_fragments=80):
+    """
+    Check TokenTable.location against counting newlines before each token,
+    over text and bytes, for the tokens and for the end of the source, and
+    a table of tokenize_stream's tokens against tokenize's.
+
+    Returns the list of sources that came out different.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(trials):
+        code = ''.join(rng.choice(FUZZ_FRAGMENTS + ['\n', '\n\n']) for _ in range(rng.randint(0, max_fragments)))
+        for source in (code, code.encode('utf-8')):
+            table = tokenize(source)
+            newline = '\n' if isinstance(source, str) else b'\n'
+            offsets = list(table.starts) + [len(source)]
+            expected = [(source.count(newline, 0, offset) + 1, offset - source.rfind(newline, 0, offset))
+                        for offset in offsets]
+            if [table.location(index) for index in range(len(offsets))] != expected:
+                failures.append(source)
+        # Small chunks, so tokens straddle them
+        streamed = TokenTable.from_tokens(tokenize_stream(io.StringIO(code), 16), code)
+        if token_rows(streamed) != token_rows(tokenize(code)):
+            failures.append(code)
+    return failures
+
+
+def time_locations(code):
+    """
+    Seconds to tokenize code, and to then find the line and column of every token.
+    """
+    start = time.perf_counter()
+    table = tokenize(code)
+    tokenize_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for index in range(len(table)):
+        table.location(index)
+    return tokenize_s, time.perf_counter() - start
+
+
+def time_relex(code, repeat=3):
+    """
+    Best of repeat seconds for relexing a one character edit in the middle of code.
+    """
+    table = tokenize(code)
+    offset = len(code) // 2
+    return _best_time(lambda _: relex(table, offset, 1, 'x'), None, repeat)
+
+
+# Statements and edits for check_reparse, in the subset of C the parser takes
+REPARSE_STATEMENTS = ['x = y;', 'foo();', 'return a;', 'z = w;']
+REPARSE_EDITS = REPARSE_STATEMENTS + [';', '{', '}', '(', ')', '=', 'q', ' ', '/*', '*/', 'myint h(myint q);', '']
+
+
+def function_source(rng, functions):
+    items = []
+    for index in range(functions):
+        if rng.random() < 0.3:
+            items.append(f'myint f{index}(myint a);')
+        else:
+            body = ' '.join(rng.choice(REPARSE_STATEMENTS) for _ in range(rng.randint(0, 4)))
+            items.append(f'myint g{index}(myint a, myint b) {{ {body} }}')
+    return '\n'.join(items) + '\n'
+
+
+def _plain(node):
+    # AST with tokens replaced by their values, to compare parses of different tables
+    if isinstance(node, TokenView):
+        return node.value
+    if isinstance(node, Mapping):   # a dict, or a LazyBody parsed here
+        return {key: _plain(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_plain(value) for value in node]
+    return node
+
+
+def _parse_quietly(table, arena=None, recover=False):
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser = Parser(table, arena=arena, recover=recover)
+        program = parser.parse_program()
+    if recover:
+        return program, parser.spans, parser.diagnostics
+    return program, parser.spans
+
+
+def check_reparse(trials=300, seed=0, edits=4):
+    """
+    Check reparse against a full parse_program after random edits.
+
+    An edit the full parse rejects must be rejected by reparse too, which
+    ends that trial. Returns the list of (source, offset, deleted, inserted)
+    edits that came out different.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(trials):
+        table = tokenize(function_source(rng, rng.randint(1, 8)))
+        program, spans = _parse_quietly(table)
+        for _ in range(edits):
+            source = table.source
+            offset = rng.randint(0, len(source))
+            deleted = rng.randint(0, min(6, len(source) - offset))
+            inserted = rng.choice(REPARSE_EDITS)
+            relexed = relex(table, offset, deleted, inserted)
+            expected = got = None
+            try:
+                expected = _parse_quietly(relexed.table)
+            except Exception:
+                pass
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    reparsed = reparse(program, spans, relexed)
+                got = reparsed.program, reparsed.spans
+            except Exception:
+                pass
+            if expected is None or got is None:
+                if (expected is None) != (got is None):
+                    failures.append((source, offset, deleted, inserted))
+                break
+            if _plain(expected[0]) != _plain(got[0]) or expected[1] != got[1]:
+                failures.append((source, offset, deleted, inserted))
+                break
+            table, (program, spans) = relexed.table, got
+    return failures
+
+
+# Statements that fail to parse, each on its own inside a function body
+BROKEN_STATEMENTS = ['x = ;', 'foo(;', 'return ;', 'y = (a + ;', '= z;', 'a b c;']
+
+
+def broken_source(rng, functions, errors):
+    """
+    (clean, broken): the same functions, with errors bad statements added to the broken one.
+    """
+    bodies = [[rng.choice(REPARSE_STATEMENTS) for _ in range(rng.randint(0, 4))] for _ in range(functions)]
+    broken = [list(body) for body in bodies]
+    for _ in range(errors):
+        body = rng.choice(broken)
+        body.insert(rng.randint(0, len(body)), rng.choice(BROKEN_STATEMENTS))
+    def render(bodies):
+        return '\n'.join(f'myint g{index}(myint a) {{ {" ".join(body)} }}' for index, body in enumerate(bodies)) + '\n'
+    return render(bodies), render(broken)
+
+
+def check_recovery(trials=200, seed=0):
+    """
+    Check that a recovering parse reports every bad statement once and
+    otherwise gives the AST of the source without them.
+
+    Returns the broken sources that came out different.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(trials):
+        errors = rng.randint(0, 6)
+        clean, broken = broken_source(rng, rng.randint(1, 8), errors)
+        expected = _parse_quietly(tokenize(clean))[0]
+        program, _, diagnostics = _parse_quietly(tokenize(broken), recover=True)
+        if len(diagnostics) != errors or _plain(program) != _plain(expected):
+            failures.append(broken)
+    return failures
+
+
+def time_recovery(functions=2000, errors=50, seed=0):
+    """
+    Seconds for one recovering parse of functions functions holding errors
+    bad statements, and the number of diagnostics it reported.
+    """
+    _, broken = broken_source(random.Random(seed), functions, errors)
+    table = tokenize(broken)
+    start = time.perf_counter()
+    _, _, diagnostics = _parse_quietly(table, recover=True)
+    return time.perf_counter() - start, len(diagnostics)
+
+
+def time_includes(units=200, headers=100, per_unit=40, seed=0):
+    """
+    Seconds to process units translation units over a tree of headers.
+
+    Each unit includes per_unit random headers, and each header a few
+    others; half the headers are guarded, half use #pragma once. Returns
+    (seconds, headers lexed, includes skipped).
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(headers):
+            lines = [f'#include "h{rng.randrange(headers)}.h"' for _ in range(3)]
+            lines.append(f'myint h{index}(myint a);')
+            if index % 2:
+                lines = [f'#ifndef H{index}_H', f'#define H{index}_H'] + lines + ['#endif']
+            else:
+                lines.insert(0, '#pragma once')
+            with open(os.path.join(directory, f'h{index}.h'), 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+        paths = []
+        for index in range(units):
+            path = os.path.join(directory, f'u{index}.c')
+            with open(path, 'w') as file:
+                file.write(''.join(f'#include "h{rng.randrange(headers)}.h"\n' for _ in range(per_unit)))
+            paths.append(path)
+
+        processor = IncludeProcessor()
+        start = time.perf_counter()
+        skipped = sum(processor.process(path).skipped for path in paths)
+        return time.perf_counter() - start, processor.misses - units, skipped
+
+
+def symbol_source(rng, functions):
+    # function_source with typedefs and declarations, and where each name should resolve
+    items, expected = [], []
+    for index in range(functions):
+        if rng.random() < 0.2:
+            items.append(f'typedef myint t{index};')
+            expected.append((f't{index}', SymbolKind.TYPEDEF, None))
+        elif rng.random() < 0.3:
+            items.append(f'myint f{index}(myint a);')
+            expected.append((f'f{index}', SymbolKind.FUNCTION, None))
+        else:
+            body = ' '.join(rng.choice(REPARSE_STATEMENTS) for _ in range(rng.randint(0, 3)))
+            typedef = rng.random() < 0.5
+            local = f'typedef u32 l{index}; l{index} v{index};' if typedef else f'myint v{index};'
+            items.append(f'myint g{index}(myint a, myint b) {{ {local} {body} v{index} = a; }}')
+            expected.append((f'g{index}', SymbolKind.FUNCTION, None))
+            # (name, kind, name of a token to look it up at)
+            expected.append(('a', SymbolKind.PARAMETER, f'v{index}'))
+            expected.append((f'v{index}', SymbolKind.VARIABLE, f'v{index}'))
+            if typedef:
+                expected.append((f'l{index}', SymbolKind.TYPEDEF, f'v{index}'))
+    return '\n'.join(items) + '\n', expected
+
+
+def check_symbols(trials=200, seed=0):
+    """
+    Check the parser's SymbolTable on symbol_source: every name resolves
+    to the right kind where it is used, function locals aren't visible at
+    the end of the file, and every scope is closed.
+
+    Returns the sources that came out wrong.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(trials):
+        source, expected = symbol_source(rng, rng.randint(1, 8))
+        table = tokenize(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser = Parser(table)
+            parser.parse_program()
+        symbols = parser.symbols
+        last = {table.value(index): index for index in range(len(table))}
+        ok = symbols.depth == 0 and all(scope.stop is not None for scope in symbols.scopes)
+        for name, kind, at in expected:
+            if at is None:
+                found = symbols.lookup(name)
+            else:
+                found = symbols.lookup_at(name, last[at])
+                # Locals are gone from the file scope
+                ok = ok and symbols.lookup(name) is None
+            ok = ok and found is not None and found.kind is kind
+        if not ok:
+            failures.append(source)
+    return failures
+
+
+def time_pipeline(files=80, functions=40, delay=0.02, seed=0):
+    """
+    Seconds to read and parse files sources behind a DelayedReader of delay
+    seconds, one file after another and through Pipeline.
+
+    Returns (sequential seconds, pipeline seconds, most reads in flight).
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index in range(files):
+            path = os.path.join(directory, f'p{index}.c')
+            with open(path, 'w') as file:
+                file.write(function_source(rng, functions))
+            paths.append(path)
+
+        reader = DelayedReader(delay)
+        async def sequential():
+            return [process_source(path, await reader(path)) for path in paths]
+        start = time.perf_counter()
+        expected = asyncio.run(sequential())
+        sequential_s = time.perf_counter() - start
+
+        reader = DelayedReader(delay)
+        start = time.perf_counter()
+        results = run_pipeline(paths, reader=reader, workers=2)
+        pipeline_s = time.perf_counter() - start
+        if sorted((result.path, result.tokens) for result in results) != sorted((result.path, result.tokens) for result in expected):
+            raise AssertionError('pipeline results differ from reading one file at a time')
+        return sequential_s, pipeline_s, reader.most_in_flight
+
+
+def time_packed(files=100, functions=60, seed=0):
+    """
+    Seconds to get at a parsed project of files sources: tokenizing and
+    parsing them, opening their packed file and finding every function
+    definition, and rebuilding every dict AST from the packed file.
+
+    Returns (parse seconds, open and find seconds, dicts seconds, packed bytes).
+    Raises if a rebuilt AST differs from the parse.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index in range(files):
+            path = os.path.join(directory, f'p{index}.c')
+            with open(path, 'w') as file:
+                file.write(function_source(rng, functions))
+            paths.append(path)
+        out = os.path.join(directory, 'project.cpak')
+        pack(paths, out)
+
+        def parse_all():
+            trees = []
+            for path in paths:
+                with open(path, 'rb') as file:
+                    trees.append(_parse_quietly(tokenize(file.read()))[0])
+            return trees
+        start = time.perf_counter()
+        trees = parse_all()
+        parse_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with PackedFile(out) as packed:
+            found = sum(len(list(unit.find(NodeKind.FUNCTION_DEFINITION))) for unit in packed)
+        find_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with PackedFile(out) as packed:
+            rebuilt = [unit.to_dict() for unit in packed]
+        dicts_s = time.perf_counter() - start
+
+        if [_plain(tree) for tree in rebuilt] != [_plain(tree) for tree in trees]:
+            raise AssertionError('packed ASTs differ from the parse')
+        if found != sum(str(tree).count("'FunctionDefinition'") for tree in trees):
+            raise AssertionError('packed find missed function definitions')
+        return parse_s, find_s, dicts_s, os.path.getsize(out)
+
+
+def time_index(files=100, functions=60, seed=0):
+    """
+    Seconds to build a SymbolIndex of files sources and save it, to load it
+    and update it after one file changed, and to answer a thousand lookups.
+
+    Returns (build seconds, update seconds, query seconds, files parsed by the update).
+    Raises if the update indexes the changed file wrongly.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index in range(files):
+            path = os.path.join(directory, f'p{index}.c')
+            with open(path, 'w') as file:
+                file.write(function_source(rng, functions))
+            paths.append(path)
+        out = os.path.join(directory, 'project.idx')
+
+        start = time.perf_counter()
+        index = SymbolIndex(out)
+        index.update(paths)
+        index.save()
+        build_s = time.perf_counter() - start
+
+        with open(paths[0], 'a') as file:
+            file.write('myint added(myint a) { added(a); }\n')
+        start = time.perf_counter()
+        index = SymbolIndex(out)
+        parsed, _ = index.update(paths)
+        update_s = time.perf_counter() - start
+        if [site.line for site in index.find('added') + index.callers('added')] != [functions + 1] * 2:
+            raise AssertionError('index update missed the changed file')
+
+        names = [f'g{number}' for number in range(functions)] * (1000 // functions + 1)
+        start = time.perf_counter()
+        for name in names[:1000]:
+            index.find(name)
+            index.prefix(name[:2])
+        query_s = time.perf_counter() - start
+        return build_s, update_s, query_s, parsed
+
+
+# Sources whose bodies read names declared around them, for the outline check
+OUTLINE_CASES = [
+    # A parameter hiding a typedef
+    'typedef foo T; foo f(bar T){ T * x; return x; }',
+    # A typedef declared after the body that uses the name
+    'foo f(bar a){ T * x; return x; } typedef foo T; foo g(bar a){ T y; return y; }',
+    'typedef foo T; foo f(bar a){ typedef bar U; U u; T w; return a; } foo g(bar U){ U * T; return U; }',
+]
+
+
+def time_outline(functions=4000, repeat=3):
+    """
+    Best of repeat seconds to tokenize a generated corpus, to parse it in
+    full and to parse it in outline mode, checking the outline's bodies
+    parse to what the full parse gives, there and for OUTLINE_CASES.
+
+    Returns (tokens, tokenize seconds, parse seconds, outline seconds).
+    """
+    spec = sized(CORPORA['plain'], functions)
+    code = generate(spec)
+    table = tokenize(code)
+    def outline(table):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Parser(table, outline=True).parse_program()
+    for case in [table] + [tokenize(case) for case in OUTLINE_CASES]:
+        full = _parse_quietly(case)[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Comparing reads every body, which parses it
+            same = outline(case) == full
+        if not same:
+            raise AssertionError(f'outline bodies differ from the full parse of {case.source[:60]!r}')
+    return (len(table), _best_time(tokenize, code, repeat),
+            _best_time(_parse_quietly, table, repeat), _best_time(outline, table, repeat))
+
+
+# (source, expansion) pairs, the expansion as MacroExpander.expand's source
+MACRO_CASES = [
+    ('#define N 10\nint a = N;', 'int a = 10 ;'),
+    ('#define F(x) ((x)*2)\nF(3+1);', '( ( 3 + 1 ) * 2 ) ;'),
+    ('#define foo foo + 1\nfoo;', 'foo + 1 ;'),
+    ('#define f(a) a*g\n#define g(a) f(a)\nf(2)(9);', '2 * 9 * g ;'),
+    ('#define str(x) #x\nstr(a  + "b");', '"a + \\"b\\"" ;'),
+    ('#define cat(a,b) a##b\nint cat(x,1) = cat(1,2);', 'int x1 = 12 ;'),
+    ('#define P(f, ...) g(f, __VA_ARGS__)\nP(1, 2, 3);', 'g ( 1 , 2 , 3 ) ;'),
+    ('#define A 2\n#if A > 1 && defined(A)\nyes;\n#elif 1\nno;\n#else\nno;\n#endif', 'yes ;'),
+    ('#ifdef B\nno;\n#else\nyes;\n#endif\n#ifndef B\nyes;\n#endif', 'yes ; yes ;'),
+    ('#if 0\n#if 1\nno;\n#endif\n#elif 1\nyes;\n#endif', 'yes ;'),
+    ('#define ONE 1\n#define TWO (ONE+ONE)\nTWO + TWO;', '( 1 + 1 ) + ( 1 + 1 ) ;'),
+    ('#define x 1\nx;\n#undef x\n#define x 2\nx;', '1 ; 2 ;'),
+    # The standard's own example of rescanning, C11 6.10.3.5
+    ('#define x 3\n#define f(a) f(x * (a))\n#undef x\n#define x 2\n#define g f\n#define z z[0]\n'
+     '#define h g(~\n#define m(a) a(w)\n#define w 0,1\n#define t(a) a\n'
+     'f(y+1) + f(f(z)) % t(t(g)(0) + t)(1);\ng(x+(3,4)-w) | h 5) & m\n(f)^m(m);',
+     'f ( 2 * ( y + 1 ) ) + f ( 2 * ( f ( 2 * ( z [ 0 ] ) ) ) ) % f ( 2 * ( 0 ) ) + t ( 1 ) ; '
+     'f ( 2 * ( 2 + ( 3 , 4 ) - 0 , 1 ) ) | f ( 2 * ( ~ 5 ) ) & f ( 2 * ( 0 , 1 ) ) ^ m ( 0 , 1 ) ;'),
+    # A call with the wrong number of arguments is left as written
+    ('#define F(a,b) a+b\n#define G 7\nF(1) x; F(G) F(F(1), 2);', 'F ( 1 ) x ; F ( 7 ) F ( 1 ) + 2 ;'),
+    # Conditions that can't be evaluated count as false rather than raising
+    ('#if 1 << -1\nno;\n#elif 1 << 100000000\nno;\n#else\nyes;\n#endif', 'yes ;'),
+    ('#if 0 && 1 / 0 || (1 ? 2 : 1 / 0) == 2\nyes;\n#endif', 'yes ;'),
+    # Deeper than Python would recurse
+    ('#if 1' + ' + 1' * 5000 + ' == 5001\nyes;\n#endif', 'yes ;'),
+    # Binary constants, and literals #if has no integer value for
+    ('#if 0b1 && 017 == 15 && 0b110 == 6\nyes;\n#else\nno;\n#endif', 'yes ;'),
+    ('#if 1.5\nno;\n#elif "a"\nno;\n#else\nyes;\n#endif', 'yes ;'),
+    ('#ifdef\nno;\n#else\nyes;\n#endif\n#ifndef\nno;\n#endif\nend;', 'yes ; end ;'),
+]
+
+
+def check_macros():
+    """
+    Check MacroExpander against MACRO_CASES, with and without memoizing,
+    and that the expanded table gives no lines or columns of its stand-in
+    source.
+
+    Returns the sources that expanded differently.
+    """
+    failures = []
+    for source, expected in MACRO_CASES:
+        for memoize in (True, False):
+            expanded = MacroExpander(memoize=memoize).expand(tokenize(source))
+            if expanded.source != expected or expanded.location(0) is not None:
+                failures.append(source)
+                break
+    return failures
+
+
+def register_source(registers=500, uses=20000, seed=0):
+    # A register map header and code that keeps reading and writing it
+    rng = random.Random(seed)
+    lines = ['#define BASE 16384', '#define REG(n) (*(volatile u32 *)(BASE + (n) * 4))',
+             '#define SET(r, v) ((r) = (v))', '#define BIT(n) (1 << (n))']
+    lines += [f'#define REG_{index} REG({index})' for index in range(registers)]
+    for _ in range(uses):
+        lines.append(f'SET(REG_{rng.randrange(registers)}, BIT({rng.randrange(32)}));')
+    return '\n'.join(lines) + '\n'
+
+
+def time_macros(repeat=3):
+    """
+    Best of repeat seconds to expand register_source, memoized and not.
+
+    Returns (memoized seconds, plain seconds, hits, misses, tokens out).
+    """
+    table = tokenize(register_source())
+    results = []
+    for memoize in (True, False):
+        results.append(_best_time(lambda table: MacroExpander(memoize=memoize).expand(table), table, repeat))
+    expander = MacroExpander()
+    expanded = expander.expand(table)
+    return (*results, expander.hits, expander.misses, len(expanded))
+
+
+# Expression heavy inputs, each about n operands
+EXPRESSION_CORPUS = {
+    'long_sum':      lambda n: ' + '.join(f'a{i}' for i in range(n)),
+    'mixed_binary':  lambda n: ''.join(f'a{i} {"+-*/%<>&|^"[i % 10]} ' for i in range(n - 1)) + 'z',
+    'deep_parens':   lambda n: '(' * n + 'a' + ')' * n,
+    'prefix_chain':  lambda n: '- ' * n + 'a',
+    'nested_calls':  lambda n: 'f(' * n + ')' * n,
+    'assign_chain':  lambda n: ' = '.join(f'a{i}' for i in range(n)),
+    'ternary_chain': lambda n: ' : '.join(f'c{i} ? v{i}' for i in range(n)) + ' : z',
+    'postfix_mix':   lambda n: ' + '.join(f'p{i}->m[i{i}].n(x{i}, {i})++' for i in range(n // 6)),
+}
+
+
+def time_expressions(operands=20000, repeat=3):
+    """
+    Best of repeat seconds to parse_expression each EXPRESSION_CORPUS input.
+
+    Returns (name, tokens, seconds) per input. Every input is a single
+    expression nested or chained operands deep, far past the recursion limit.
+    """
+    results = []
+    for name, build in EXPRESSION_CORPUS.items():
+        table = tokenize(build(operands))
+        def parse(table):
+            parser = Parser(table)
+            parser.parse_expression()
+            if parser.position != len(table):
+                raise SyntaxError(f'{name} stopped at token {parser.position} of {len(table)}')
+        results.append((name, len(table), _best_time(parse, table, repeat)))
+    return results
+
+
+def check_arena(trials=200, seed=0):
+    """
+    Check that AstArena.to_dict gives back exactly the dict parse.
+
+    Returns the sources and expressions that came out different.
+    """
+    rng = random.Random(seed)
+    sources = [function_source(rng, rng.randint(1, 8)) for _ in range(trials)]
+    failures = []
+    for source in sources:
+        table = tokenize(source)
+        arena = AstArena(table)
+        root, _ = _parse_quietly(table, arena)
+        if arena.to_dict(root) != _parse_quietly(table)[0]:
+            failures.append(source)
+    for name, build in EXPRESSION_CORPUS.items():
+        table = tokenize(build(200))
+        arena = AstArena(table)
+        root = Parser(table, arena=arena).parse_expression()
+        if arena.to_dict(root) != Parser(table).parse_expression():
+            failures.append(name)
+    return failures
+
+
+def ast_memory(operands=20000):
+    """
+    Bytes held by the parse of each EXPRESSION_CORPUS input, as dicts and in an AstArena.
+
+    Returns (name, nodes, dict bytes, arena bytes) per input, measured with
+    tracemalloc over the parse, less what was freed before it returned.
+    """
+    results = []
+    for name, build in EXPRESSION_CORPUS.items():
+        table = tokenize(build(operands))
+        sizes = []
+        for arena in (None, AstArena(table)):
+            tracemalloc.start()
+            result = Parser(table, arena=arena).parse_expression()
+            sizes.append(tracemalloc.get_traced_memory()[0])
+            tracemalloc.stop()
+            del result
+        results.append((name, len(arena), *sizes))
+    return results
+
+
+def main():
+    # Halfway between linear and quadratic growth, on a log scale
+    limit = 2 ** 1.5
+    slow = []
+    for name, lexer, growth in check_linear():
+        flag = ''
+        if growth > limit:
+            slow.append((name, lexer))
+            flag = '  SUPER-LINEAR'
+        print(f'{name:24} {lexer:6} x{growth:5.2f} per doubling{flag}')
+
+    failures = fuzz_backends()
+    print(f'backend fuzz: {len(failures)} disagreements')
+    for source in failures[:5]:
+        print(f'  {source!r}')
+
+    jump_failures = check_jump_index()
+    print(f'jump index: {len(jump_failures)} disagreements')
+    for source in jump_failures[:5]:
+        print(f'  {source!r}')
+    failures += jump_failures
+
+    relex_failures = check_relex()
+    print(f'relex: {len(relex_failures)} disagreements')
+    for edit in relex_failures[:5]:
+        print(f'  {edit!r}')
+    failures += relex_failures
+
+    location_failures = check_locations()
+    print(f'locations: {len(location_failures)} disagreements')
+    for source in location_failures[:5]:
+        print(f'  {source!r}')
+    failures += location_failures
+
+    reparse_failures = check_reparse()
+    print(f'reparse: {len(reparse_failures)} disagreements')
+    for edit in reparse_failures[:5]:
+        print(f'  {edit!r}')
+    failures += reparse_failures
+
+    recovery_failures = check_recovery()
+    print(f'recovery: {len(recovery_failures)} disagreements')
+    for source in recovery_failures[:5]:
+        print(f'  {source!r}')
+    failures += recovery_failures
+
+    macro_failures = check_macros()
+    print(f'macros: {len(macro_failures)} disagreements')
+    for source in macro_failures[:5]:
+        print(f'  {source!r}')
+    failures += macro_failures
+
+    symbol_failures = check_symbols()
+    print(f'symbols: {len(symbol_failures)} disagreements')
+    for source in symbol_failures[:5]:
+        print(f'  {source!r}')
+    failures += symbol_failures
+
+    arena_failures = check_arena()
+    print(f'arena to_dict: {len(arena_failures)} disagreements')
+    for source in arena_failures[:5]:
+        print(f'  {source!r}')
+    failures += arena_failures
+
+    code = identifier_heavy_source()
+    for backend in (BACKEND_REGEX, BACKEND_DFA):
+        elapsed = time_backend(code, backend)
+        print(f'{backend:6} identifier heavy: {elapsed:.3f}s  {len(code) / elapsed / 1e6:.2f} MB/s')
+    print(f'relex   identifier heavy: {time_relex(code):.3f}s for a one character edit')
+    tokenize_s, locate_s = time_locations(code)
+    print(f'locations identifier heavy: tokenize {tokenize_s:.3f}s, line and column of every token {locate_s:.3f}s')
+    elapsed, lexed, skipped = time_includes()
+    print(f'includes: {elapsed:.3f}s for 200 units, {lexed} headers lexed, {skipped} includes skipped')
+    memoized, plain, hits, misses, tokens = time_macros()
+    print(f'macros: {memoized:.3f}s memoized, {plain:.3f}s not, {tokens} tokens out, {hits} hits {misses} misses')
+    sequential, pipelined, in_flight = time_pipeline()
+    print(f'pipeline: {sequential:.3f}s one file at a time, {pipelined:.3f}s pipelined, {in_flight} reads in flight')
+    parse_s, find_s, dicts_s, size = time_packed()
+    print(f'packed project: parse {parse_s:.3f}s, open and find {find_s:.4f}s, '
+          f'rebuild dicts {dicts_s:.3f}s, {size / 1e6:.2f} MB file')
+    build_s, update_s, query_s, parsed = time_index()
+    print(f'symbol index: build {build_s:.3f}s, update after one edit {update_s:.3f}s ({parsed} parsed), '
+          f'1000 lookups {query_s * 1000:.1f}ms')
+    tokens, tokenize_s, parse_s, outline_s = time_outline()
+    print(f'outline: {tokens} tokens, tokenize {tokenize_s:.3f}s, full parse {parse_s:.3f}s, outline {outline_s:.3f}s')
+    elapsed, reported = time_recovery()
+    print(f'recovering parse: {elapsed:.3f}s for {reported} errors in one pass')
+
+    for name, tokens, elapsed in time_expressions():
+        print(f'expression {name:14} {tokens:7} tokens  {elapsed:.3f}s  {tokens / elapsed:10.0f} tokens/s')
+
+    for name, nodes, dict_bytes, arena_bytes in ast_memory():
+        print(f'ast memory {name:14} {nodes:7} nodes  dict {dict_bytes / nodes:6.0f} B/node  '
+              f'arena {arena_bytes / nodes:6.0f} B/node')
+
+    return 1 if failures or slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
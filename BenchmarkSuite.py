@@ -0,0 +1,241 @@
+# BenchmarkSuite.py
+# Lexer and parser benchmarks over generated corpora, with JSON results
+# Run directly: python BenchmarkSuite.py --json results.json
+#               python BenchmarkSuite.py --compare baseline.json
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+
+from Corpus import CORPORA, generate, sized
+from Tokenizer import tokenize, build_regex, classify_match, GROUP_DISPATCH
+from Parser import Parser
+from Tracer import ProfilingTracer
+
+
+# Function counts each corpus is generated at
+DEFAULT_SIZES = (250, 1000, 4000)
+
+# A metric this much worse than the baseline is a regression
+DEFAULT_TOLERANCE = 0.10
+
+# Bump when metrics are renamed or measured differently
+RESULTS_FORMAT = 1
+
+# Timings closer than this to the baseline are noise, whatever the ratio
+NOISE_FLOOR_S = 0.002
+
+# Metrics where a bigger number is better; everything else is a time or a size
+HIGHER_IS_BETTER = frozenset(('tokens_per_s', 'mb_per_s'))
+
+
+def best_time(func, repeat):
+    # Best of repeat runs, the least disturbed by the rest of the machine
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(func):
+    # Peak bytes traced while func ran, over what was held before it
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def time_compile(repeat=5):
+    """
+    Best seconds to compile build_regex, with re's pattern cache emptied each time.
+    """
+    def compile_regex():
+        re.purge()
+        re.compile(build_regex(), re.DOTALL)
+    return best_time(compile_regex, repeat)
+
+
+def _parse_quietly(table):
+    # parse_program reports progress on stdout, which would be timed too
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return Parser(table).parse_program()
+
+
+def profile(table):
+    """
+    ProfilingTracer report of one parse_program over table.
+    """
+    tracer = ProfilingTracer()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        parser = Parser(table, tracer=tracer)
+        parser.parse_program()
+    return tracer.report(parser)
+
+
+def measure(code, parse=True, repeat=3):
+    """
+    Metrics for one source: size, token count, tokenize and classification
+    seconds with the throughput they give, parse_program seconds and the
+    peak memory of tokenizing and of parsing.
+
+    classify_s is the time classify_match takes over all the matches.
+    """
+    size = len(code.encode('utf-8'))
+    pattern = re.compile(build_regex(), re.DOTALL)
+    table = tokenize(code)
+    tokenize_s = best_time(lambda: tokenize(code), repeat)
+
+    matches = list(pattern.finditer(code))
+    def classify():
+        for match in matches:
+            classify_match(match, GROUP_DISPATCH)
+
+    result = {
+        'bytes': size,
+        'tokens': len(table),
+        'tokenize_s': tokenize_s,
+        'tokens_per_s': len(table) / tokenize_s,
+        'mb_per_s': size / tokenize_s / 1e6,
+        'classify_s': best_time(classify, repeat),
+        'tokenize_peak_bytes': peak_memory(lambda: tokenize(code)),
+    }
+    if parse:
+        result['parse_s'] = best_time(lambda: _parse_quietly(table), repeat)
+        result['parse_peak_bytes'] = peak_memory(lambda: _parse_quietly(table))
+    return result
+
+
+def run_suite(sizes=DEFAULT_SIZES, corpora=None, repeat=3):
+    """
+    measure every corpus in CORPORA, or the named ones, at each size.
+
+    Returns a JSON ready dict: run details under 'meta', the build_regex
+    compile time, and each measurement keyed by 'corpus/functions'.
+    """
+    names = corpora or list(CORPORA)
+    results = {'compile_s': time_compile()}
+    for name in names:
+        for functions in sizes:
+            spec = sized(CORPORA[name], functions)
+            results[f'{name}/{functions}'] = measure(generate(spec), spec.parseable, repeat)
+    return {
+        'meta': {
+            'format': RESULTS_FORMAT,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Metrics in current more than tolerance worse than in baseline.
+
+    Returns (key, metric, baseline value, current value, change) tuples,
+    change being the fraction worse. Counts like bytes and tokens describe
+    the input rather than the code, so a difference there is reported as a
+    changed corpus with change None; the timings beside it aren't comparable.
+    """
+    regressions = []
+    def check(key, metric, old, new):
+        if metric in ('bytes', 'tokens'):
+            if old != new:
+                regressions.append((key, metric, old, new, None))
+            return
+        if not old:
+            return
+        if metric in HIGHER_IS_BETTER:
+            change = (old - new) / old
+        elif metric.endswith('_s') and new - old < NOISE_FLOOR_S:
+            return
+        else:
+            change = (new - old) / old
+        if change > tolerance:
+            regressions.append((key, metric, old, new, change))
+
+    for key, old in baseline['results'].items():
+        new = current['results'].get(key)
+        if new is None:
+            continue
+        if isinstance(old, dict):
+            for metric, value in old.items():
+                if metric in new:
+                    check(key, metric, value, new[metric])
+        else:
+            check(key, key, old, new)
+    return regressions
+
+
+def print_results(suite, file=None):
+    results = suite['results']
+    print(f"build_regex compile: {results['compile_s'] * 1e3:.2f} ms", file=file)
+    for key, result in results.items():
+        if not isinstance(result, dict):
+            continue
+        line = (f"{key:18} {result['bytes'] / 1e6:6.2f} MB {result['tokens']:8} tokens  "
+                f"{result['tokens_per_s']:9.0f} tokens/s {result['mb_per_s']:5.2f} MB/s  "
+                f"classify {result['classify_s']:.3f}s  peak {result['tokenize_peak_bytes'] / 1e6:6.1f} MB")
+        if 'parse_s' in result:
+            line += f"  parse {result['parse_s']:.3f}s peak {result['parse_peak_bytes'] / 1e6:6.1f} MB"
+        print(line, file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the lexer and parser on generated c sources.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='function counts to generate')
+    parser.add_argument('--corpus', action='append', choices=sorted(CORPORA), help='corpus to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing, the best is kept')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--compare', default=None, help='baseline results file to check against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='allowed fraction worse than the baseline')
+    parser.add_argument('--profile', action='store_true', help='add per rule parse profiles at the largest size')
+    args = parser.parse_args(argv)
+
+    suite = run_suite(args.sizes, args.corpus, args.repeat)
+    print_results(suite)
+    if args.profile:
+        # Kept out of 'results': traced timings aren't compared
+        suite['profiles'] = {}
+        for name in args.corpus or list(CORPORA):
+            spec = sized(CORPORA[name], max(args.sizes))
+            if spec.parseable:
+                suite['profiles'][f'{name}/{spec.functions}'] = profile(tokenize(generate(spec)))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(suite, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get('meta', {}).get('format') != RESULTS_FORMAT:
+            print(f'{args.compare}: results format differs, not compared')
+            return 1
+        regressions = compare(suite, baseline, args.tolerance)
+        for key, metric, old, new, change in regressions:
+            if change is None:
+                print(f'CHANGED CORPUS {key} {metric}: {old} -> {new}')
+            else:
+                print(f'REGRESSION {key} {metric}: {old:.6g} -> {new:.6g} ({change:+.1%})')
+        print(f'{len(regressions)} regressions against {args.compare} at {args.tolerance:.0%} tolerance')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
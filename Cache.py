@@ -0,0 +1,288 @@
+# Cache.py
+# Content addressed on-disk cache of token tables and parse results
+# Entries are keyed by a hash of the file contents and fingerprints of the
+# lexer (build_regex and the TokenType tables) and of the parser's code, so a
+# changed file, lexer or parser simply misses instead of returning stale
+# tokens or trees.
+from array import array
+from collections.abc import Mapping
+import hashlib
+import importlib.util
+import json
+import os
+import struct
+import sys
+import tempfile
+
+from TokenType import TokenType, TokenBase, Operators, Delimiters, Keywords
+from TokenTable import TokenTable, TokenView, OFFSET_TYPECODE
+from Tokenizer import build_regex, tokenize, SOURCE_ENCODING
+
+
+# Bump when the entry layout changes
+CACHE_FORMAT = 2
+
+# Modules whose code decides the tree a token table parses to
+PARSER_MODULES = ('Parser', 'Expression', 'Ast', 'Symbols', 'JumpIndex')
+
+# Default size budget of a cache directory
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+ENTRY_SUFFIX = '.tok'
+MAGIC = b'CTOK'
+# magic, token count, encoded ast length (0 if there is none)
+HEADER = struct.Struct('<4sQQ')
+
+
+def lexer_fingerprint():
+    """
+    Hash of everything that decides the tokens a source lexes to.
+    """
+    parts = [
+        f'format {CACHE_FORMAT} {sys.byteorder}',
+        build_regex(),
+        repr([(member.name, member.value) for member in TokenBase]),
+        repr([(member.name, member.value) for member in TokenType]),
+        repr(sorted(Operators._mapping.items())),
+        repr(sorted(Delimiters._mapping.items())),
+        repr(sorted(Keywords._mapping.items())),
+    ]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def parser_fingerprint():
+    """
+    Hash of the code that decides the tree tokens parse to.
+
+    The parser has no version number to bump when its output changes, so
+    the sources of PARSER_MODULES are hashed as they are on disk.
+    """
+    digest = hashlib.sha256(f'format {CACHE_FORMAT}'.encode('ascii'))
+    for name in PARSER_MODULES:
+        with open(importlib.util.find_spec(name).origin, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+# A reference in a flattened tree, to an entry or to a token row
+ENTRY, ROW = 'n', 't'
+
+
+def _flatten(ast, table):
+    # The tree as plain data: each dict and list is an entry of a flat list,
+    # children before parents, holding its children as [ENTRY, index] and
+    # its tokens as [ROW, index]. Walked with a stack, and nested only a
+    # couple of levels deep, so no depth of tree trips a recursion limit.
+    entries, done = [], {}
+    def ref(value):
+        if isinstance(value, TokenView):
+            if value._table is not table:
+                raise ValueError('tree holds a token of another table')
+            return [ROW, value.Id]
+        if isinstance(value, (Mapping, list)):
+            return [ENTRY, done[id(value)]]
+        return value
+
+    stack = [(ast, False)]
+    while stack:
+        node, ready = stack.pop()
+        values = node.values() if isinstance(node, Mapping) else node
+        if not ready:
+            stack.append((node, True))
+            stack.extend((value, False) for value in values if isinstance(value, (Mapping, list)))
+            continue
+        if isinstance(node, Mapping):
+            entries.append({key: ref(value) for key, value in node.items()})
+        else:
+            entries.append([ref(value) for value in node])
+        done[id(node)] = len(entries) - 1
+    return entries
+
+
+def _unflatten(entries, table):
+    # The tree _flatten made entries of; it is only ever data, whoever wrote it
+    nodes = []
+    def value(item):
+        if isinstance(item, list):
+            kind, index = item
+            if kind == ENTRY and 0 <= index < len(nodes):
+                return nodes[index]
+            if kind == ROW:
+                return table[index]
+            raise ValueError(f'bad reference {item!r} in cached tree')
+        return item
+    for entry in entries:
+        if isinstance(entry, dict):
+            nodes.append({key: value(item) for key, item in entry.items()})
+        else:
+            nodes.append([value(item) for item in entry])
+    return nodes[-1]
+
+
+class TokenCache:
+    """
+    A directory of cached token tables, and parse results where there are any.
+
+    Each entry holds the table columns as raw arrays and the parse result
+    flattened to json, its tokens stored as row numbers. The source itself
+    is not stored: whoever asks already has the contents, that's what the
+    key is made of. Tables are for the bytes of the source, as from
+    tokenize(bytes).
+
+    Nothing read back is ever run as code, but an entry is trusted to be
+    the parse of its key. The directory must be private to whoever runs the
+    parses; it is created readable by its owner only.
+
+    Once the directory grows past max_bytes the least recently used entries
+    are removed; a hit counts as a use. max_bytes=None never evicts, which
+    suits worker processes sharing a directory that the parent trims.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Token only entries miss on a parser change too, which is rare enough
+        self.fingerprint = f'{lexer_fingerprint()} {parser_fingerprint()}'
+        self.hits = 0
+        self.misses = 0
+        self._sizes = None   # entry path -> size, read from disk on first put
+        self._total = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+
+    def key(self, content):
+        digest = hashlib.sha256(self.fingerprint.encode('ascii'))
+        digest.update(content)
+        return digest.hexdigest()
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+
+    def get(self, content):
+        """
+        (table, ast) cached for content, or None. ast is None if only tokens were stored.
+        """
+        path = self._path(self.key(content))
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            entry = self._decode(content, data)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # A torn or foreign file, drop it
+            self.misses += 1
+            self._remove(path)
+            return None
+        os.utime(path)
+        self.hits += 1
+        return entry
+
+
+    def put(self, content, table, ast=None):
+        """
+        Store table, and ast if given, for content.
+        """
+        data = self._encode(table, ast)
+        path = self._path(self.key(content))
+        handle, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(temp, path)
+
+        if self.max_bytes is not None:
+            sizes = self._index()
+            self._total += len(data) - sizes.get(path, 0)
+            sizes[path] = len(data)
+            if self._total > self.max_bytes:
+                self.trim()
+
+
+    def tokenize(self, content):
+        """
+        (table, ast) for content, from the cache or lexed and stored on a miss.
+
+        ast is whatever parse result was stored with the tokens, None if
+        there is none yet; put it with put(content, table, ast).
+        """
+        entry = self.get(content)
+        if entry is None:
+            entry = tokenize(content), None
+            self.put(content, *entry)
+        return entry
+
+
+    def trim(self, max_bytes=None):
+        """
+        Remove least recently used entries until the directory fits max_bytes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        sizes = self._index(refresh=True)
+        if self._total <= max_bytes:
+            return
+        by_age = []
+        for path in sizes:
+            try:
+                by_age.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                pass
+        for _, path in sorted(by_age):
+            if self._total <= max_bytes:
+                break
+            self._remove(path)
+
+
+    def _index(self, refresh=False):
+        if self._sizes is None or refresh:
+            self._sizes = {}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(ENTRY_SUFFIX):
+                        try:
+                            self._sizes[entry.path] = entry.stat().st_size
+                        except FileNotFoundError:
+                            pass
+            self._total = sum(self._sizes.values())
+        return self._sizes
+
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if self._sizes is not None and path in self._sizes:
+            self._total -= self._sizes.pop(path)
+
+
+    def _encode(self, table, ast):
+        encoded = b''
+        if ast is not None:
+            encoded = json.dumps(_flatten(ast, table), separators=(',', ':')).encode('utf-8')
+        return b''.join((HEADER.pack(MAGIC, len(table), len(encoded)),
+                         table.bases.tobytes(), table.types.tobytes(),
+                         table.starts.tobytes(), table.ends.tobytes(), encoded))
+
+
+    def _decode(self, content, data):
+        magic, count, encoded_size = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not a token cache entry')
+        table = TokenTable(content, SOURCE_ENCODING)
+        offset = HEADER.size
+        for column in (table.bases, table.types):
+            column.frombytes(data[offset:offset + count])
+            offset += count
+        width = array(OFFSET_TYPECODE).itemsize * count
+        for column in (table.starts, table.ends):
+            column.frombytes(data[offset:offset + width])
+            offset += width
+        if offset + encoded_size != len(data):
+            raise ValueError('truncated token cache entry')
+
+        ast = None
+        if encoded_size:
+            ast = _unflatten(json.loads(data[offset:]), table)
+        return table, ast
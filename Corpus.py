@@ -0,0 +1,140 @@
+# Corpus.py
+# Seeded generator of synthetic c sources for benchmarking
+# The same CorpusSpec always gives the same text, so timings from different
+# runs and different machines are taken over identical inputs.
+from dataclasses import dataclass, replace
+import random
+
+
+@dataclass
+class CorpusSpec:
+    seed: int = 0
+    functions: int = 100            # Top level items
+    declarations: float = 0.2       # Share of items that are prototypes rather than definitions
+    statements: int = 6             # Most statements in a function body
+    depth: int = 3                  # Deepest nesting of parentheses and calls in an expression
+    operands: int = 4               # Most operands at one level of an expression
+    comment_density: float = 0.0    # Chance of a comment before each statement and item
+    directive_density: float = 0.0  # Chance of a preprocessor line before each item
+    identifier_ratio: float = 0.6   # Share of operands that are names rather than literals
+    literal_mix: tuple = (0.6, 0.2, 0.1, 0.1)  # Weights of int, float, string and char literals
+
+    @property
+    def parseable(self):
+        # Parser has no rules for comments or directives
+        return not self.comment_density and not self.directive_density
+
+
+# Spec of each named corpus the benchmark suite runs, scaled by functions
+CORPORA = {
+    'plain':     CorpusSpec(),
+    'commented': CorpusSpec(comment_density=0.3, directive_density=0.1),
+    'literals':  CorpusSpec(identifier_ratio=0.2),
+    'nested':    CorpusSpec(depth=8, operands=3),
+}
+
+BINARY_OPERATORS = ('+', '-', '*', '/', '%', '<', '>', '==', '!=', '&&', '||', '&', '|', '^', '<<', '>>')
+PREFIX_OPERATORS = ('-', '!', '~')
+TYPE_NAMES = ('myint', 'size_t', 'u32', 'handle')
+COMMENTS = ('/* {} */', '// {}')
+DIRECTIVES = ('#include "{}.h"', '#define {} 1', '#ifdef {}', '#endif')
+WORDS = ('buffer', 'count', 'index', 'node', 'next', 'size', 'value', 'left', 'right', 'state', 'flags')
+
+
+def sized(spec, functions):
+    """
+    spec with its function count set to functions.
+    """
+    return replace(spec, functions=functions)
+
+
+class _Generator:
+    def __init__(self, spec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.lines = []
+
+    def name(self):
+        return f'{self.rng.choice(WORDS)}{self.rng.randrange(100)}'
+
+    def literal(self):
+        rng = self.rng
+        kind = rng.choices(range(4), weights=self.spec.literal_mix)[0]
+        if kind == 0:
+            return str(rng.randrange(100000))
+        if kind == 1:
+            # build_regex reads one digit before the point
+            return f'{rng.randrange(10)}.{rng.randrange(1000)}'
+        if kind == 2:
+            return '"' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))) + '"'
+        return f"'{rng.choice('abcdefxyz')}'"
+
+    def operand(self, depth):
+        rng = self.rng
+        if depth < self.spec.depth and rng.random() < 0.3:
+            if rng.random() < 0.5:
+                return f'( {self.expression(depth + 1)} )'
+            arguments = ', '.join(self.expression(depth + 1) for _ in range(rng.randint(0, 3)))
+            return f'{self.name()}({arguments})'
+        if rng.random() < 0.1:
+            return f'{rng.choice(PREFIX_OPERATORS)} {self.operand(depth)}'
+        if rng.random() < self.spec.identifier_ratio:
+            return self.name()
+        return self.literal()
+
+    def expression(self, depth=0):
+        rng = self.rng
+        parts = [self.operand(depth)]
+        for _ in range(rng.randint(0, self.spec.operands - 1)):
+            parts += [rng.choice(BINARY_OPERATORS), self.operand(depth)]
+        return ' '.join(parts)
+
+    def comment(self, indent=''):
+        if self.rng.random() < self.spec.comment_density:
+            text = ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(2, 8)))
+            self.lines.append(indent + self.rng.choice(COMMENTS).format(text))
+
+    def statement(self):
+        rng = self.rng
+        kind = rng.random()
+        if kind < 0.35:
+            return f'{self.name()} = {self.expression()};'
+        if kind < 0.6:
+            return f'{rng.choice(TYPE_NAMES)} {self.name()} = {self.expression()};'
+        if kind < 0.85:
+            arguments = ', '.join(self.expression(1) for _ in range(rng.randint(0, 3)))
+            return f'{self.name()}({arguments});'
+        return f'return {self.expression()};'
+
+    def parameters(self):
+        return ', '.join(f'{self.rng.choice(TYPE_NAMES)} {self.name()}' for _ in range(self.rng.randint(0, 4)))
+
+    def item(self, index):
+        rng, spec = self.rng, self.spec
+        if rng.random() < spec.directive_density:
+            self.lines.append(rng.choice(DIRECTIVES).format(self.name().upper()))
+        self.comment()
+        head = f'{rng.choice(TYPE_NAMES)} f{index}({self.parameters()})'
+        if rng.random() < spec.declarations:
+            self.lines.append(head + ';')
+            return
+        self.lines.append(head + ' {')
+        for _ in range(rng.randint(1, spec.statements)):
+            self.comment('    ')
+            self.lines.append('    ' + self.statement())
+        self.lines.append('}')
+
+    def source(self):
+        for index in range(self.spec.functions):
+            self.item(index)
+        return '\n'.join(self.lines) + '\n'
+
+
+def generate(spec=CorpusSpec()):
+    """
+    The c source for spec, the same text for the same spec every time.
+
+    A spec without comments or directives gives a source parse_program
+    accepts; every spec gives one the lexer takes without ERROR tokens.
+    """
+    return _Generator(spec).source()
@@ -0,0 +1,222 @@
+# DfaScanner.py
+# Table driven scanner, an alternative backend to the build_regex alternation
+# Every character is mapped to a character class, and a transition table
+# indexed by [state][class] drives a longest-accept scan from each position.
+# Accept codes are the capture group numbers of build_regex, so the results
+# classify through the same GROUP_DISPATCH, and the token stream matches the
+# regex backend exactly, including which alternative wins where two could.
+import re
+
+
+# Accept codes, numbered like the capture groups of build_regex
+COMMENT_ML, COMMENT_SL, PREPROCESSOR = 1, 2, 3
+FLOAT, INT, STRING, CHAR, UNTERMINATED, BOOL = 4, 5, 6, 7, 8, 9
+WORD, OPERATOR, DELIM = 10, 11, 12
+
+
+# Character classes
+(OTHER, NL, BLANK, SPACE, HASH, SLASH, STAR, OP, DQUOTE, SQUOTE, BSLASH,
+ DOT, DELIMITER, ZERO, DIGIT, ALPHA, B, T, R, U, E, F, A, L, S, UWORD,
+ EOF) = range(27)
+CLASS_COUNT = 27
+
+WHITESPACE = (NL, BLANK, SPACE)
+LETTERS = (ALPHA, B, T, R, U, E, F, A, L, S)
+IDENT_CONTINUE = LETTERS + (ZERO, DIGIT)
+WORD_CHARS = IDENT_CONTINUE + (UWORD,)   # \w
+EVERYTHING = tuple(c for c in range(CLASS_COUNT) if c != EOF)
+
+_SPECIFIC = {
+    '\n': NL, ' ': BLANK, '\t': BLANK, '#': HASH, '/': SLASH, '*': STAR,
+    '"': DQUOTE, "'": SQUOTE, '\\': BSLASH, '.': DOT, '0': ZERO,
+    'b': B, 't': T, 'r': R, 'u': U, 'e': E, 'f': F, 'a': A, 'l': L, 's': S}
+_SPECIFIC.update(dict.fromkeys('+-%=!<>&|^~?:', OP))
+_SPECIFIC.update(dict.fromkeys('{}()[],;', DELIMITER))
+_ASCII_LETTERS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+
+
+# \s, \d and \w differ between str and bytes patterns, so classes are worked
+# out with the same flavour of regex the regex backend would use
+def _char_class(ch, probe, space, digit, word):
+    if ch in _SPECIFIC:
+        return _SPECIFIC[ch]
+    if ch in _ASCII_LETTERS:
+        return ALPHA
+    if space.match(probe):
+        return SPACE
+    if digit.match(probe):
+        return DIGIT
+    if word.match(probe):
+        return UWORD
+    return OTHER
+
+
+class _TextClasses(dict):
+    # str.translate table, filled in on first sight of each character
+    _patterns = (re.compile(r'\s'), re.compile(r'\d'), re.compile(r'\w'))
+
+    def __missing__(self, codepoint):
+        ch = chr(codepoint)
+        cls = chr(_char_class(ch, ch, *self._patterns))
+        self[codepoint] = cls
+        return cls
+
+_TEXT_CLASSES = _TextClasses()
+
+_BYTES_PATTERNS = (re.compile(rb'\s'), re.compile(rb'\d'), re.compile(rb'\w'))
+_BYTES_CLASSES = bytes(_char_class(chr(b), bytes([b]), *_BYTES_PATTERNS) for b in range(256))
+
+
+def char_classes(code):
+    """
+    Map code to a bytes object holding one character class per character.
+    """
+    if isinstance(code, str):
+        return code.translate(_TEXT_CLASSES).encode('latin-1')
+    return bytes(code).translate(_BYTES_CLASSES)
+
+
+# States, DEAD stops the scan
+(DEAD, START, HASH_SEEN, HASH_WS, DIRECTIVE,
+ SLASH_SEEN, LINE_CMT, C_BODY, C_STAR, C_DONE, OP_RUN,
+ DQ, DQ_ESC, DQ_CONT, DQ_CONT_ESC, DQ_DONE,
+ SQ, SQ_ESC, SQ_CONT, SQ_CONT_ESC, SQ_DONE, DELIM_DONE,
+ ZERO_SEEN, INT1, INTN, ZB, ZB1, FLOAT_SEEN,
+ IDENT, T1, TR, TRU, TRUE, F1, FA, FAL, FALS, FALSE) = range(38)
+STATE_COUNT = 38
+
+# Accept code of each state, 0 if it doesn't accept
+ACCEPT = [0] * STATE_COUNT
+# States where the scan stops as soon as they are reached; these are the
+# places where the regex takes an earlier alternative over a longer match
+TERMINAL = [False] * STATE_COUNT
+TRANSITIONS = [[DEAD] * CLASS_COUNT for _ in range(STATE_COUNT)]
+
+
+def _on(state, classes, target):
+    for cls in classes:
+        TRANSITIONS[state][cls] = target
+
+def _accepts(state, code, terminal=False):
+    ACCEPT[state] = code
+    TERMINAL[state] = terminal
+
+
+# Directives: #, blanks, a name, then the rest of the line
+_on(START, (HASH,), HASH_SEEN)
+_on(HASH_SEEN, (BLANK,), HASH_WS)
+_on(HASH_WS, (BLANK,), HASH_WS)
+_on(HASH_SEEN, WORD_CHARS, DIRECTIVE)
+_on(HASH_WS, WORD_CHARS, DIRECTIVE)
+_on(DIRECTIVE, EVERYTHING, DIRECTIVE)
+_on(DIRECTIVE, (NL,), DEAD)
+_accepts(DIRECTIVE, PREPROCESSOR)
+
+# '/' opens comments, otherwise it is an operator run
+_on(START, (SLASH,), SLASH_SEEN)
+_accepts(SLASH_SEEN, OPERATOR)
+_on(SLASH_SEEN, (SLASH, OP), OP_RUN)
+_on(SLASH_SEEN, (SLASH,), LINE_CMT)
+_on(SLASH_SEEN, (STAR,), C_BODY)
+_on(LINE_CMT, EVERYTHING, LINE_CMT)
+_on(LINE_CMT, (NL,), DEAD)
+_accepts(LINE_CMT, COMMENT_SL)
+
+# Inside a /* comment, which ends at the first */ or else runs to the end of
+# the input as an unterminated token
+_on(C_BODY, EVERYTHING, C_BODY)
+_on(C_BODY, (STAR,), C_STAR)
+_accepts(C_BODY, UNTERMINATED)
+_on(C_STAR, EVERYTHING, C_BODY)
+_on(C_STAR, (STAR,), C_STAR)
+_on(C_STAR, (SLASH,), C_DONE)
+_accepts(C_STAR, UNTERMINATED)
+_accepts(C_DONE, COMMENT_ML, terminal=True)
+
+_on(START, (STAR, OP), OP_RUN)
+_on(OP_RUN, (SLASH, STAR, OP), OP_RUN)
+_accepts(OP_RUN, OPERATOR)
+
+# String and char literals. A literal that never closes is an unterminated
+# token up to the end of its first line, even if the literal itself went on
+# past an escaped line break (the _CONT states), so those don't accept.
+for quote, open_state, escape, cont, cont_escape, done, code in (
+        (DQUOTE, DQ, DQ_ESC, DQ_CONT, DQ_CONT_ESC, DQ_DONE, STRING),
+        (SQUOTE, SQ, SQ_ESC, SQ_CONT, SQ_CONT_ESC, SQ_DONE, CHAR)):
+    _on(START, (quote,), open_state)
+    for body, body_escape in ((open_state, escape), (cont, cont_escape)):
+        _on(body, EVERYTHING, body)
+        _on(body, (NL,), DEAD)
+        _on(body, (BSLASH,), body_escape)
+        _on(body, (quote,), done)
+        _on(body_escape, EVERYTHING, body)
+    _on(escape, (NL,), cont)
+    _accepts(open_state, UNTERMINATED)
+    _accepts(escape, UNTERMINATED)
+    _accepts(done, code, terminal=True)
+
+_on(START, (DOT, DELIMITER), DELIM_DONE)
+_accepts(DELIM_DONE, DELIM, terminal=True)
+
+# Numbers: (0b)?\d\.\d* is a float, (0b)?\d+ an int
+_on(START, (ZERO,), ZERO_SEEN)
+_on(START, (DIGIT,), INT1)
+_on(ZERO_SEEN, (B,), ZB)
+_on(ZB, (ZERO, DIGIT), ZB1)
+for state in (ZERO_SEEN, INT1, ZB1):
+    _on(state, (ZERO, DIGIT), INTN)
+    _on(state, (DOT,), FLOAT_SEEN)
+    _accepts(state, INT)
+_on(INTN, (ZERO, DIGIT), INTN)
+_accepts(INTN, INT)
+_on(FLOAT_SEEN, (ZERO, DIGIT), FLOAT_SEEN)
+_accepts(FLOAT_SEEN, FLOAT)
+
+# Identifiers, with true and false winning over longer identifiers
+_on(START, LETTERS, IDENT)
+_on(START, (T,), T1)
+_on(START, (F,), F1)
+for state, following, target in ((T1, R, TR), (TR, U, TRU), (TRU, E, TRUE),
+                                  (F1, A, FA), (FA, L, FAL), (FAL, S, FALS), (FALS, E, FALSE)):
+    _on(state, IDENT_CONTINUE, IDENT)
+    _on(state, (following,), target)
+    _accepts(state, WORD)
+_on(IDENT, IDENT_CONTINUE, IDENT)
+_accepts(IDENT, WORD)
+_accepts(TRUE, BOOL, terminal=True)
+_accepts(FALSE, BOOL, terminal=True)
+
+
+def scan(code):
+    """
+    Yield (group, start, end) for every token in code, str or bytes.
+
+    group is the build_regex capture group the regex backend would have
+    matched. Characters no token can start with are skipped, as
+    re.finditer would. Each scan either accepts what it read or fails within
+    a few characters, so the whole pass is linear.
+    """
+    classes = char_classes(code)
+    transitions, accept, terminal = TRANSITIONS, ACCEPT, TERMINAL
+    n = len(classes)
+    pos = 0
+
+    while pos < n:
+        state = START
+        i = pos
+        group = 0
+        while i < n:
+            state = transitions[state][classes[i]]
+            if state == DEAD:
+                break
+            i += 1
+            if accept[state]:
+                group, end = accept[state], i
+            if terminal[state]:
+                break
+
+        if group:
+            yield group, pos, end
+        else:
+            end = pos + 1
+        pos = end
@@ -0,0 +1,295 @@
+# Expression.py
+# Precedence climbing expression parser
+# Operators are shifted onto an explicit stack and reduced by precedence, so
+# nesting depth never turns into Python recursion: a generated expression
+# with tens of thousands of operands or parentheses parses in a flat loop.
+from TokenType import TokenType, TokenBase, Operators
+from TokenTable import TYPE_CODE, BASE_CODE
+from Ast import NodeKind
+
+
+# Binary operators: symbol -> (precedence, right associative). Higher binds
+# tighter. The categories follow Operators._mapping, split into C's levels
+# where one category spans several (arithmetic, relational, bitwise).
+BINARY_OPERATORS = {
+    # operator_assignment
+    '=': (1, True), '+=': (1, True), '-=': (1, True), '*=': (1, True), '/=': (1, True),
+    '%=': (1, True), '&=': (1, True), '|=': (1, True), '^=': (1, True), '<<=': (1, True), '>>=': (1, True),
+    # operator_logical
+    '||': (3, False), '&&': (4, False),
+    # operator_bitwise, '&' is operator_special
+    '|': (5, False), '^': (6, False), '&': (7, False),
+    # operator_relational
+    '==': (8, False), '!=': (8, False),
+    '<': (9, False), '<=': (9, False), '>': (9, False), '>=': (9, False),
+    '<<': (10, False), '>>': (10, False),
+    # operator_arithmetic, '*' is operator_unary
+    '+': (11, False), '-': (11, False),
+    '*': (12, False), '/': (12, False), '%': (12, False),
+}
+ASSIGNMENT_PRECEDENCE = 1
+TERNARY_PRECEDENCE = 2      # operator_ternary, ? and :
+PREFIX_PRECEDENCE = 13      # Binds tighter than any binary operator
+
+PREFIX_OPERATORS = frozenset(('-', '+', '!', '~', '*', '&', '++', '--', 'sizeof'))
+POSTFIX_OPERATORS = frozenset(('++', '--'))
+
+# Every operator, for splitting a lexed operator run like '=-' into '=' '-'
+# by longest match, the way a C lexer would have
+OPERATOR_SYMBOLS = sorted(set(BINARY_OPERATORS) | PREFIX_OPERATORS | set(Operators._mapping)
+                          | {'?', ':', '->'}, key=len, reverse=True)
+
+# Type codes the loop dispatches on
+LPAREN = TYPE_CODE[TokenType.DELIM_LPAREN]
+RPAREN = TYPE_CODE[TokenType.DELIM_RPAREN]
+LBRACKET = TYPE_CODE[TokenType.DELIM_LBRACKET]
+RBRACKET = TYPE_CODE[TokenType.DELIM_RBRACKET]
+COMMA = TYPE_CODE[TokenType.DELIM_COMMA]
+DOT = TYPE_CODE[TokenType.DELIM_DOT]
+IDENTIFIER = TYPE_CODE[TokenType.IDENTIFIER]
+SIZEOF = TYPE_CODE[TokenType.KEYWORD_SIZEOF]
+OPERATOR_BASE = BASE_CODE[TokenBase.OPERATOR]
+LITERAL_BASE = BASE_CODE[TokenBase.LITERAL]
+
+# Node kinds as plain ints, to index the builder's makers with
+ASSIGNMENT_NODE = int(NodeKind.ASSIGNMENT)
+BINARY_NODE = int(NodeKind.BINARY_OPERATION)
+UNARY_NODE = int(NodeKind.UNARY_OPERATION)
+POSTFIX_NODE = int(NodeKind.POSTFIX_OPERATION)
+TERNARY_NODE = int(NodeKind.TERNARY_OPERATION)
+IDENTIFIER_NODE = int(NodeKind.IDENTIFIER)
+LITERAL_NODE = int(NodeKind.LITERAL)
+CALL_NODE = int(NodeKind.FUNCTION_CALL)
+INDEX_NODE = int(NodeKind.INDEX)
+MEMBER_NODE = int(NodeKind.MEMBER_ACCESS)
+
+# Operator stack entries, (kind, ...)
+BINARY, PREFIX, TERNARY, QUESTION, PAREN, CALL, INDEX = range(7)
+GROUPS = (QUESTION, PAREN, CALL, INDEX)
+
+
+_split_cache = {}
+
+def split_operator(text):
+    """
+    Split an operator run into C operators by longest match.
+    """
+    pieces = _split_cache.get(text)
+    if pieces is None:
+        pieces, position = [], 0
+        while position < len(text):
+            for symbol in OPERATOR_SYMBOLS:
+                if text.startswith(symbol, position):
+                    break
+            else:
+                raise SyntaxError(f"Unknown operator: {text[position:]!r} in {text!r}")
+            pieces.append(symbol)
+            position += len(symbol)
+        pieces = _split_cache[text] = tuple(pieces)
+    return pieces
+
+
+def _reduce(makers, operands, operators):
+    # Pop one operator off the stack and combine its operands
+    entry = operators.pop()
+    kind = entry[0]
+    if kind == BINARY:
+        right, left = operands.pop(), operands.pop()
+        if entry[2] == ASSIGNMENT_PRECEDENCE:
+            operands.append(makers[ASSIGNMENT_NODE](left, entry[1], right))
+        else:
+            operands.append(makers[BINARY_NODE](left, entry[1], right))
+    elif kind == PREFIX:
+        operands.append(makers[UNARY_NODE](entry[1], operands.pop()))
+    elif kind == TERNARY:
+        otherwise, then, condition = operands.pop(), operands.pop(), operands.pop()
+        operands.append(makers[TERNARY_NODE](condition, then, otherwise))
+    else:
+        raise SyntaxError("Unbalanced expression")
+
+
+def _precedence(entry):
+    kind = entry[0]
+    if kind == BINARY:
+        return entry[2]
+    if kind == PREFIX:
+        return PREFIX_PRECEDENCE
+    if kind == TERNARY:
+        return TERNARY_PRECEDENCE
+    return 0    # groups are never reduced past
+
+
+def _reduce_above(makers, operands, operators, precedence, right_associative):
+    # Reduce everything that binds tighter than an incoming operator
+    while operators:
+        top = _precedence(operators[-1])
+        if top > precedence or (top == precedence and not right_associative and top):
+            _reduce(makers, operands, operators)
+        else:
+            return
+
+
+def _reduce_to_group(makers, operands, operators):
+    # Reduce down to the innermost open group and return it, None if there is none
+    while operators and operators[-1][0] not in GROUPS:
+        _reduce(makers, operands, operators)
+    return operators[-1] if operators else None
+
+
+def parse_expression(parser):
+    """
+    Parse one expression from parser's current position and return its AST.
+
+    Covers assignment, ternary, logical, bitwise, relational, shift,
+    arithmetic and prefix operators, postfix ++/--, calls, indexing and
+    member access with . and ->. The expression ends at the first token
+    that can't continue it, such as ; or a ) or , that closes something
+    outside it; that token is left for the caller.
+
+    Nodes are made with the parser's builder, so this returns whatever
+    that makes, a dict or an arena index.
+    """
+    tokens, types, bases = parser.tokens, parser.types, parser.tokens.bases
+    value = tokens.value
+    makers = parser.builder.makers
+    size = len(types)
+
+    operands = []
+    operators = []
+    expect_operand = True
+    position = parser.position
+    pieces, piece = (), 0   # operator run being worked through, and where we are in it
+    last_name = (None, None)    # latest Identifier node and its text, for naming calls
+
+    while True:
+        if piece < len(pieces):
+            symbol = pieces[piece]
+        elif position < size and bases[position] == OPERATOR_BASE:
+            pieces, piece = split_operator(value(position)), 0
+            symbol = pieces[0]
+        else:
+            symbol = None
+
+        if symbol is None:
+            if position >= size:
+                break
+            code = types[position]
+
+            if expect_operand:
+                if code == IDENTIFIER:
+                    node = makers[IDENTIFIER_NODE](position)
+                    last_name = node, value(position)
+                    operands.append(node)
+                    expect_operand = False
+                elif bases[position] == LITERAL_BASE:
+                    operands.append(makers[LITERAL_NODE](position))
+                    expect_operand = False
+                elif code == SIZEOF:
+                    operators.append((PREFIX, 'sizeof'))
+                elif code == LPAREN:
+                    operators.append((PAREN,))
+                elif code == RPAREN and operators and operators[-1][0] == CALL and not operators[-1][2]:
+                    # f(), no arguments
+                    _, callee, arguments, name = operators.pop()
+                    operands.append(makers[CALL_NODE](name, callee, arguments))
+                    expect_operand = False
+                else:
+                    raise SyntaxError(f"Unexpected token: {tokens[position].ofType} {parser.where(position)}, expected an operand")
+                position += 1
+                continue
+
+            if code == LPAREN:
+                # Only a bare name as the callee gives the call a name
+                callee = operands.pop()
+                operators.append((CALL, callee, [], last_name[1] if callee is last_name[0] else None))
+                expect_operand = True
+            elif code == LBRACKET:
+                operators.append((INDEX, operands.pop()))
+                expect_operand = True
+            elif code == DOT:
+                position += 1
+                operands.append(_member(operands.pop(), '.', parser, position))
+            elif code == COMMA:
+                group = _reduce_to_group(makers, operands, operators)
+                if group is None or group[0] != CALL:
+                    break
+                group[2].append(operands.pop())
+                expect_operand = True
+            elif code == RPAREN:
+                group = _reduce_to_group(makers, operands, operators)
+                if group is None:
+                    break
+                operators.pop()
+                if group[0] == CALL:
+                    group[2].append(operands.pop())
+                    operands.append(makers[CALL_NODE](group[3], group[1], group[2]))
+                elif group[0] != PAREN:
+                    raise SyntaxError(f"Unexpected token: {tokens[position].ofType} {parser.where(position)}")
+            elif code == RBRACKET:
+                group = _reduce_to_group(makers, operands, operators)
+                if group is None:
+                    break
+                operators.pop()
+                if group[0] != INDEX:
+                    raise SyntaxError(f"Unexpected token: {tokens[position].ofType} {parser.where(position)}")
+                operands.append(makers[INDEX_NODE](group[1], operands.pop()))
+            else:
+                break
+            position += 1
+            continue
+
+        # An operator piece
+        if expect_operand:
+            if symbol not in PREFIX_OPERATORS:
+                raise SyntaxError(f"Unexpected operator: {symbol!r} {parser.where(position)}, expected an operand")
+            operators.append((PREFIX, symbol))
+        elif symbol in POSTFIX_OPERATORS:
+            operands.append(makers[POSTFIX_NODE](symbol, operands.pop()))
+        elif symbol == '->':
+            if piece + 1 < len(pieces):
+                raise SyntaxError(f"Unexpected operator: {pieces[piece + 1]!r} {parser.where(position)}")
+            position, pieces, piece = position + 1, (), 0
+            operands.append(_member(operands.pop(), '->', parser, position))
+            position += 1
+            continue
+        elif symbol == '?':
+            _reduce_above(makers, operands, operators, TERNARY_PRECEDENCE, True)
+            operators.append((QUESTION,))
+            expect_operand = True
+        elif symbol == ':':
+            group = _reduce_to_group(makers, operands, operators)
+            if group is None or group[0] != QUESTION:
+                if piece:
+                    raise SyntaxError(f"Unexpected operator: ':' {parser.where(position)}")
+                break   # a label or bit field, not ours
+            operators[-1] = (TERNARY,)
+            expect_operand = True
+        elif symbol in BINARY_OPERATORS:
+            precedence, right_associative = BINARY_OPERATORS[symbol]
+            _reduce_above(makers, operands, operators, precedence, right_associative)
+            operators.append((BINARY, symbol, precedence))
+            expect_operand = True
+        else:
+            raise SyntaxError(f"Unexpected operator: {symbol!r} {parser.where(position)}")
+
+        piece += 1
+        if piece == len(pieces):
+            position, pieces, piece = position + 1, (), 0
+
+    if expect_operand:
+        token = tokens[position] if position < size else None
+        raise SyntaxError(f"Unexpected token: {token.ofType if token else 'end of input'} {parser.where(position)}, expected an operand")
+    while operators:
+        if operators[-1][0] in GROUPS:
+            raise SyntaxError(f"Unclosed bracket or '?' in expression ending {parser.where(position)}")
+        _reduce(makers, operands, operators)
+
+    parser.position = position
+    return operands.pop()
+
+
+def _member(target, operator, parser, position):
+    # The member name after a . or ->
+    if position >= len(parser.types) or parser.types[position] != IDENTIFIER:
+        raise SyntaxError(f"Expected a member name after {operator!r} {parser.where(position)}")
+    return parser.builder.makers[MEMBER_NODE](target, operator, position)
@@ -0,0 +1,229 @@
+# Includes.py
+# #include resolution over a shared header cache
+# Every header is read and lexed at most once per IncludeProcessor, however
+# many translation units include it. Headers with an include guard or
+# #pragma once are skipped on a repeat include without being walked again.
+from dataclasses import dataclass, field
+import os
+import re
+
+from TokenType import TokenType
+from TokenTable import TYPE_CODE
+from Tokenizer import tokenize, SOURCE_ENCODING
+from JumpIndex import TRIVIA
+
+
+PREPROCESSOR = TYPE_CODE[TokenType.PREPROCESSOR]
+
+# '#  name rest', rest running to the end of the line
+DIRECTIVE = re.compile(r'#[ \t]*(\w+)[ \t]*(.*)', re.DOTALL)
+INCLUDE_TARGET = re.compile(r'"([^"]+)"|<([^>]+)>')
+MACRO_NAME = re.compile(r'([A-Za-z_]\w*)')
+
+CONDITIONAL_OPEN = frozenset(('if', 'ifdef', 'ifndef'))
+
+
+def parse_directive(text):
+    """
+    (name, rest) of a PREPROCESSOR token's text, or (None, text) if it isn't one.
+    """
+    match = DIRECTIVE.match(text)
+    if match is None:
+        return None, text
+    rest = match.group(2)
+    # A trailing comment isn't part of the directive
+    for marker in ('//', '/*'):
+        cut = rest.find(marker)
+        if cut >= 0:
+            rest = rest[:cut]
+    return match.group(1), rest.strip()
+
+
+@dataclass
+class Header:
+    path: str = None
+    table: object = None        # TokenTable of the file
+    guard: str = None           # Macro of an #ifndef/#define/#endif guard around the whole file
+    once: bool = False          # Has #pragma once
+    includes: list = field(default_factory=list)  # (token index, name, angled) of each #include
+
+
+@dataclass
+class Unit:
+    path: str = None
+    segments: list = field(default_factory=list)  # (Header, start, stop) token runs, in order
+    included: list = field(default_factory=list)  # Paths of the headers walked, in order
+    skipped: int = 0            # Includes skipped as guarded, once or already open
+    missing: list = field(default_factory=list)   # (including path, name) of includes not found
+    defined: set = field(default_factory=set)     # Guard macros defined by the headers walked
+
+    def tokens(self):
+        """
+        (Header, token index) of every token of the unit, includes spliced in.
+        """
+        for header, start, stop in self.segments:
+            for index in range(start, stop):
+                yield header, index
+
+
+def find_guard(table):
+    """
+    The macro of an include guard wrapping all of table, or None.
+
+    That is an #ifndef X and #define X as the first two non-trivia tokens,
+    and an #endif as the last that closes the #ifndef.
+    """
+    types = table.types
+    significant = [index for index in range(len(types)) if types[index] not in TRIVIA]
+    if len(significant) < 3 or any(types[index] != PREPROCESSOR for index in (significant[0], significant[1], significant[-1])):
+        return None
+    name, rest = parse_directive(table.value(significant[0]))
+    defined, defined_rest = parse_directive(table.value(significant[1]))
+    if name != 'ifndef' or defined != 'define':
+        return None
+    guard = MACRO_NAME.match(rest)
+    if guard is None or MACRO_NAME.match(defined_rest) is None or MACRO_NAME.match(defined_rest).group(1) != guard.group(1):
+        return None
+    depth = 0
+    for index in significant:
+        if types[index] != PREPROCESSOR:
+            continue
+        name, _ = parse_directive(table.value(index))
+        if name in CONDITIONAL_OPEN:
+            depth += 1
+        elif name == 'endif':
+            depth -= 1
+            if depth == 0:
+                return guard.group(1) if index == significant[-1] else None
+    return None
+
+
+class IncludeProcessor:
+    """
+    Resolves #include directives and splices headers into translation units.
+
+    A quoted include is looked for next to the including file, then in
+    search_paths, then in system_paths; an angled one only in search_paths
+    and system_paths. Resolutions and lexed headers are kept for the life of
+    the processor, so give one processor a whole batch of units. cache is
+    an optional Cache.TokenCache to lex headers through.
+    """
+    def __init__(self, search_paths=(), system_paths=(), cache=None):
+        self.search_paths = list(search_paths)
+        self.system_paths = list(system_paths)
+        self.cache = cache
+        self.headers = {}       # real path -> Header
+        self._resolved = {}     # (name, angled, directory) -> path or None
+        self.hits = 0
+        self.misses = 0
+
+
+    def resolve(self, name, angled, directory):
+        """
+        Path of the header an #include of name from a file in directory names, or None.
+        """
+        key = (name, angled, directory)
+        if key in self._resolved:
+            return self._resolved[key]
+        candidates = [] if angled else [directory]
+        candidates += self.search_paths + self.system_paths
+        found = None
+        for base in candidates:
+            path = os.path.join(base, name)
+            if os.path.isfile(path):
+                found = os.path.realpath(path)
+                break
+        self._resolved[key] = found
+        return found
+
+
+    def header(self, path):
+        """
+        The Header for path, read and lexed on first use only.
+        """
+        path = os.path.realpath(path)
+        header = self.headers.get(path)
+        if header is not None:
+            self.hits += 1
+            return header
+        self.misses += 1
+        if self.cache is not None:
+            with open(path, 'rb') as file:
+                table, _ = self.cache.tokenize(file.read())
+        else:
+            with open(path, encoding=SOURCE_ENCODING) as file:
+                table = tokenize(file.read())
+
+        header = Header(path, table, find_guard(table))
+        types = table.types
+        for index in range(len(types)):
+            if types[index] != PREPROCESSOR:
+                continue
+            name, rest = parse_directive(table.value(index))
+            if name == 'include':
+                target = INCLUDE_TARGET.match(rest)
+                if target is not None:
+                    header.includes.append((index, target.group(1) or target.group(2), target.group(2) is not None))
+            elif name == 'pragma' and rest == 'once':
+                header.once = True
+        self.headers[path] = header
+        return header
+
+
+    def process(self, path):
+        """
+        The translation unit of the source at path, with its includes spliced in.
+
+        Each #include directive token is replaced by the tokens of the
+        header it names, recursively. A header is skipped if its guard macro
+        is already defined in the unit, if it has #pragma once and was
+        walked before, or if it is already open further up (a cycle).
+        Includes that can't be found are listed in missing and left out.
+        """
+        unit = Unit(path)
+        walked = set()
+        root = self.header(path)
+        # [header, position in header.includes, next token to emit]
+        stack = [[root, 0, 0]]
+        open_paths = {root.path}
+        walked.add(root.path)
+        if root.guard:
+            unit.defined.add(root.guard)
+
+        while stack:
+            frame = stack[-1]
+            header, include, emitted = frame
+            if include == len(header.includes):
+                if emitted < len(header.table):
+                    unit.segments.append((header, emitted, len(header.table)))
+                stack.pop()
+                open_paths.discard(header.path)
+                continue
+
+            index, name, angled = header.includes[include]
+            if emitted < index:
+                unit.segments.append((header, emitted, index))
+            frame[1], frame[2] = include + 1, index + 1
+
+            target = self.resolve(name, angled, os.path.dirname(header.path))
+            if target is None:
+                unit.missing.append((header.path, name))
+                continue
+            if target in open_paths:
+                unit.skipped += 1
+                continue
+            included = self.headers.get(target)
+            if included is not None and ((included.guard and included.guard in unit.defined)
+                                         or (included.once and target in walked)):
+                self.hits += 1
+                unit.skipped += 1
+                continue
+
+            included = self.header(target)
+            if included.guard:
+                unit.defined.add(included.guard)
+            walked.add(target)
+            open_paths.add(target)
+            unit.included.append(target)
+            stack.append([included, 0, 0])
+        return unit
@@ -0,0 +1,173 @@
+# Incremental.py
+# Incremental re-lexing and reparsing after an edit
+# Only the stretch of source an edit can influence is matched again; the
+# tokens before it are kept as they are, and the ones after it are kept with
+# their offsets shifted by the change in length. Reparsing works the same
+# way one level up, on top level items.
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+import re
+
+from TokenTable import TokenTable, OFFSET_TYPECODE
+from JumpIndex import JumpIndex
+from Parser import Parser
+from Tokenizer import build_regex, build_regex_bytes, GROUP_DISPATCH, GROUP_DISPATCH_BYTES
+
+
+@dataclass
+class Relexed:
+    table: TokenTable = None  # Tokens of the edited source
+    first: int = 0            # First token that was lexed again
+    old_stop: int = 0         # Old tokens [first, old_stop) were replaced by
+    new_stop: int = 0         # new tokens [first, new_stop)
+
+    @property
+    def delta(self):
+        # Change in token count
+        return self.new_stop - self.old_stop
+
+
+def restart_point(table, offset):
+    """
+    Earliest offset in table.source whose tokens an edit at offset could change.
+
+    Matching from a line start gives the same tokens as a full pass, since
+    no attempt that fails on one line looks past its end; the exceptions are
+    a token spanning the line break and a line continued with a backslash,
+    which a string can run through, and an unterminated comment running to
+    the end of the input, which text appended there would extend. Each of
+    these moves the restart further back.
+    """
+    source, starts, ends = table.source, table.starts, table.ends
+    newline, backslash = ('\n', '\\') if isinstance(source, str) else (b'\n', b'\\')
+    position = offset
+    while True:
+        position = source.rfind(newline, 0, position) + 1
+        while position >= 2 and source[position - 2:position - 1] == backslash:
+            position = source.rfind(newline, 0, position - 1) + 1
+        index = bisect_right(starts, position) - 1
+        if index >= 0 and starts[index] < position and (position < ends[index] or ends[index] == len(source)):
+            position = starts[index]
+        else:
+            return position
+
+
+def relex(table, offset, deleted, inserted):
+    """
+    Tokens of table.source with deleted characters at offset replaced by inserted.
+
+    Matching restarts at restart_point and stops at the first new token
+    after the edit whose end lines up with the end of an old token: from
+    there on both passes see the same text, so the rest of the old tokens
+    are reused with shifted offsets. An edit opening a comment or a string
+    just runs on until the tokens line up again, or to the end of the input.
+
+    table is left untouched, a new table is returned in a Relexed.
+    """
+    source = table.source
+    if not isinstance(source, (str, bytes)):
+        source = bytes(source)
+    if isinstance(source, str):
+        pattern, dispatch = re.compile(build_regex(), re.DOTALL), GROUP_DISPATCH
+    else:
+        pattern, dispatch = re.compile(build_regex_bytes(), re.DOTALL), GROUP_DISPATCH_BYTES
+
+    edit_end = offset + deleted
+    new_source = source[:offset] + inserted + source[edit_end:]
+    shift = len(inserted) - deleted
+    new_edit_end = offset + len(inserted)
+
+    restart = restart_point(table, offset)
+    first = bisect_left(table.starts, restart)
+    old_ends = table.ends
+
+    result = TokenTable(new_source, table.encoding)
+    result.bases = table.bases[:first]
+    result.types = table.types[:first]
+    result.starts = table.starts[:first]
+    result.ends = table.ends[:first]
+    append = result.append
+
+    old_stop = len(table)
+    for match in pattern.finditer(new_source, restart):
+        group = match.lastindex
+        lookup, default = dispatch[group]
+        base, ofType = default if lookup is None else lookup.get(match.group(group), default)
+        start, end = match.start(group), match.end(group)
+        append(base, ofType, start, end)
+
+        if end >= new_edit_end:
+            old_end = end - shift
+            index = bisect_left(old_ends, old_end, first)
+            if index < len(old_ends) and old_ends[index] == old_end:
+                old_stop = index + 1
+                break
+
+    new_stop = len(result)
+    result.bases += table.bases[old_stop:]
+    result.types += table.types[old_stop:]
+    if shift:
+        result.starts += array(OFFSET_TYPECODE, [start + shift for start in table.starts[old_stop:]])
+        result.ends += array(OFFSET_TYPECODE, [end + shift for end in table.ends[old_stop:]])
+    else:
+        result.starts += table.starts[old_stop:]
+        result.ends += table.ends[old_stop:]
+
+    return Relexed(result, first, old_stop, new_stop)
+
+
+@dataclass
+class Reparsed:
+    program: dict = None      # {"type": "Program", "body": [...]} for the edited source
+    spans: list = None        # (first token, stop) of each item in program["body"]
+    first: int = 0            # First item that was parsed again
+    old_stop: int = 0         # Old items [first, old_stop) were replaced by
+    new_stop: int = 0         # new items [first, new_stop)
+
+
+def reparse(program, spans, relexed):
+    """
+    Parse result for relexed.table, reusing every top level item the edit missed.
+
+    program and spans are the old parse_program result and the parser's
+    spans for it. Items that end before the first relexed token, and items
+    that start after the last one, are reused as they are; the old dicts go
+    into the new body, so unchanged subtrees keep their identity. Only the
+    items in between are parsed, over a JumpIndex limited to them, so the
+    cost follows the size of the edited items rather than the file.
+
+    The window ends at the start of the next untouched old item. If the new
+    items don't end exactly there, the edit ran past it, and the window is
+    grown to the item boundary at least twice as far before trying again.
+    Reused items keep tokens of the old table; their values don't change.
+    """
+    table = relexed.table
+    shift = relexed.new_stop - relexed.old_stop
+    stops = [stop for _, stop in spans]
+    starts = [start for start, _ in spans]
+
+    first = bisect_right(stops, relexed.first)
+    window_start = spans[first - 1][1] if first else 0
+    old_stop = bisect_left(starts, relexed.old_stop)
+
+    while True:
+        window_stop = starts[old_stop] + shift if old_stop < len(spans) else len(table)
+        parser = Parser(table, jumps=JumpIndex(table.types, window_start, window_stop))
+        parser.position = window_start
+        try:
+            body = parser.parse_items(window_stop)
+            if parser.position == window_stop and not parser.jumps.open_item:
+                break
+        except SyntaxError:
+            if window_stop == len(table):
+                raise
+        if window_stop == len(table):
+            break
+        reach = window_start + 2 * (window_stop - window_start) - shift
+        old_stop = max(old_stop + 1, bisect_left(starts, reach))
+
+    new_body = program['body'][:first] + body + program['body'][old_stop:]
+    new_spans = (spans[:first] + parser.spans
+                 + [(start + shift, stop + shift) for start, stop in spans[old_stop:]])
+    return Reparsed({**program, 'body': new_body}, new_spans, first, old_stop, first + len(body))
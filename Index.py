@@ -0,0 +1,290 @@
+# Index.py
+# Project wide index of function declarations, definitions and calls
+# Run directly: python Index.py project.idx src/ 'include/**/*.h'
+#               python Index.py project.idx --find name --prefix na --callers name
+# The index is kept on disk between runs. An update parses again only the
+# files whose contents changed, and queries answer from dicts and a sorted
+# name list without touching the sources.
+import argparse
+from bisect import bisect_left
+import contextlib
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+from Tokenizer import tokenize
+from Parser import Parser
+from Ast import AstArena, NodeKind
+from Cache import lexer_fingerprint, parser_fingerprint
+from Batch import collect_files
+
+
+# Bump when what is recorded per file changes; an index of another format is rebuilt
+INDEX_FORMAT = 2
+
+DEFINITION = 'definition'
+DECLARATION = 'declaration'
+CALL = 'call'
+
+
+@dataclass
+class Site:
+    name: str = None        # Function named
+    kind: str = None        # DEFINITION, DECLARATION or CALL
+    path: str = None
+    position: int = 0       # Token index of the name
+    offset: int = 0         # Byte offset of the name in the file
+    line: int = 0           # Line of the name, from 1
+    detail: str = None      # Signature of a definition or declaration, calling function of a call
+
+
+@dataclass
+class FileEntry:
+    digest: str = None      # Hash of the contents and the lexer, see SymbolIndex.digest
+    mtime: float = 0        # Stat of the file when digest was taken, to skip hashing unchanged files
+    size: int = 0
+    sites: list = field(default_factory=list)   # Site per declaration, definition and call
+    errors: int = 0         # Syntax errors recovered from while parsing
+
+
+def index_source(path, content):
+    """
+    FileEntry sites for content, the bytes of the file at path.
+
+    The parse recovers from syntax errors, so a file with a broken function
+    still has the rest indexed.
+    """
+    table = tokenize(content)
+    arena = AstArena(table)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        parser = Parser(table, arena=arena, recover=True)
+        root = parser.parse_program()
+
+    def site(name, kind, position, detail):
+        return Site(name, kind, path, position, table.starts[position], table.location(position)[0], detail)
+
+    sites = []
+    for item in arena[root].body:
+        node = arena[item]
+        if node.kind not in (NodeKind.FUNCTION_DEFINITION, NodeKind.FUNCTION_DECLARATION):
+            continue
+        name = table.value(node.name)
+        parameters = ', '.join(f'{table.value(arena[parameter].paramType)} {table.value(arena[parameter].name)}'
+                               for parameter in node.parameters)
+        signature = f'{table.value(node.returnType)} {name}({parameters})'
+        if node.kind == NodeKind.FUNCTION_DECLARATION:
+            sites.append(site(name, DECLARATION, node.name, signature))
+            continue
+        sites.append(site(name, DEFINITION, node.name, signature))
+        for index in arena.walk(node.body):
+            call = arena[index]
+            if call.kind == NodeKind.FUNCTION_CALL and call.name is not None:
+                callee = arena[call.callee]
+                sites.append(site(call.name, CALL, callee.value, name))
+    return FileEntry(sites=sites, errors=len(parser.diagnostics))
+
+
+# The index is saved as json, so loading one runs nothing from the file.
+# A site is saved as a row of these fields; its path is the file's key.
+SITE_FIELDS = ('name', 'kind', 'position', 'offset', 'line', 'detail')
+KINDS = (DEFINITION, DECLARATION, CALL)
+
+
+def _entry_data(entry):
+    return {'digest': entry.digest, 'mtime': entry.mtime, 'size': entry.size, 'errors': entry.errors,
+            'sites': [[getattr(site, name) for name in SITE_FIELDS] for site in entry.sites]}
+
+
+def _entry_from_data(path, data):
+    # FileEntry of saved data, or ValueError if it isn't shaped like one
+    sites = []
+    for row in data['sites']:
+        name, kind, position, offset, line, detail = row
+        if (kind not in KINDS or not isinstance(name, str) or not isinstance(detail, str)
+                or not all(type(number) is int for number in (position, offset, line))):
+            raise ValueError(f'bad site in the index for {path}')
+        sites.append(Site(name, kind, path, position, offset, line, detail))
+    entry = FileEntry(data['digest'], data['mtime'], data['size'], sites, data['errors'])
+    if (not isinstance(entry.digest, str) or type(entry.mtime) not in (int, float)
+            or type(entry.size) is not int or type(entry.errors) is not int):
+        raise ValueError(f'bad entry in the index for {path}')
+    return entry
+
+
+class SymbolIndex:
+    """
+    Declarations, definitions and calls of every function in a set of
+    files, saved to path.
+
+    update() brings the index up to date with the files, parsing only the
+    ones whose contents hash differently from last time; save() writes it
+    back. definitions, declarations and callers answer for a name, and
+    prefix lists the declared or defined names starting with a prefix.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fingerprint = f'{lexer_fingerprint()} {parser_fingerprint()}'
+        self.files = {}         # path -> FileEntry
+        self.parsed = 0         # Files parsed by updates since loading
+        try:
+            with open(path, 'rb') as file:
+                saved = json.load(file)
+            if saved.get('format') == INDEX_FORMAT and saved.get('fingerprint') == self.fingerprint:
+                self.files = {name: _entry_from_data(name, data) for name, data in saved['files'].items()}
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # Torn or foreign, start again
+            self.files = {}
+        self._build()
+
+
+    def _build(self):
+        # Name -> sites maps, derived from files and kept in step by update
+        self._sites = {DEFINITION: {}, DECLARATION: {}, CALL: {}}
+        for entry in self.files.values():
+            self._add(entry)
+        self._names = None
+
+    def _add(self, entry):
+        for site in entry.sites:
+            self._sites[site.kind].setdefault(site.name, []).append(site)
+
+    def _remove(self, path, entry):
+        # Once per name however often the file uses it, a hot name has a long list
+        for kind, name in {(site.kind, site.name) for site in entry.sites}:
+            sites = [site for site in self._sites[kind][name] if site.path != path]
+            if sites:
+                self._sites[kind][name] = sites
+            else:
+                del self._sites[kind][name]
+
+
+    def digest(self, content):
+        hash = hashlib.sha256(f'{INDEX_FORMAT} {self.fingerprint}'.encode('ascii'))
+        hash.update(content)
+        return hash.hexdigest()
+
+
+    def update(self, paths, remove_missing=True):
+        """
+        Index paths, parsing each file whose contents changed since it was
+        last indexed. With remove_missing, files indexed before but not in
+        paths are dropped. A path that can't be read counts as missing.
+
+        Returns (files parsed, files dropped).
+        """
+        parsed = 0
+        wanted, missing = set(), set()
+        for path in paths:
+            wanted.add(path)
+            entry = self.files.get(path)
+            try:
+                stat = os.stat(path)
+                if entry is not None and entry.mtime == stat.st_mtime and entry.size == stat.st_size:
+                    continue
+                with open(path, 'rb') as file:
+                    content = file.read()
+            except OSError:
+                # Gone, unreadable or a directory, it is dropped like a missing file
+                missing.add(path)
+                continue
+            digest = self.digest(content)
+            if entry is not None and entry.digest == digest:
+                entry.mtime, entry.size = stat.st_mtime, stat.st_size
+                continue
+            fresh = index_source(path, content)
+            fresh.digest, fresh.mtime, fresh.size = digest, stat.st_mtime, stat.st_size
+            if entry is not None:
+                self._remove(path, entry)
+            self.files[path] = fresh
+            self._add(fresh)
+            parsed += 1
+
+        dropped = 0
+        for path in list(self.files):
+            if path in missing or (remove_missing and path not in wanted):
+                self._remove(path, self.files.pop(path))
+                dropped += 1
+        if parsed or dropped:
+            self._names = None
+        self.parsed += parsed
+        return parsed, dropped
+
+
+    def save(self):
+        """
+        Write the index to its path, whole or not at all.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        files = {path: _entry_data(entry) for path, entry in self.files.items()}
+        with os.fdopen(handle, 'w', encoding='ascii') as file:
+            json.dump({'format': INDEX_FORMAT, 'fingerprint': self.fingerprint, 'files': files},
+                      file, separators=(',', ':'))
+        os.replace(temp, self.path)
+
+
+    def definitions(self, name):
+        return list(self._sites[DEFINITION].get(name, ()))
+
+    def declarations(self, name):
+        return list(self._sites[DECLARATION].get(name, ()))
+
+    def callers(self, name):
+        """
+        Call sites of name, each with the function it is called from as detail.
+        """
+        return list(self._sites[CALL].get(name, ()))
+
+    def find(self, name):
+        """
+        Definitions of name, or its declarations where there are none, as go to definition wants.
+        """
+        return self.definitions(name) or self.declarations(name)
+
+    def prefix(self, prefix):
+        """
+        Sorted names declared or defined that start with prefix.
+        """
+        if self._names is None:
+            self._names = sorted(self._sites[DEFINITION].keys() | self._sites[DECLARATION].keys())
+        names = self._names
+        result = []
+        index = bisect_left(names, prefix)
+        while index < len(names) and names[index].startswith(prefix):
+            result.append(names[index])
+            index += 1
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Keep a project wide index of c functions, and query it.')
+    parser.add_argument('index', help='index file, created if missing')
+    parser.add_argument('patterns', nargs='*', help='directories or glob patterns to bring the index up to date with')
+    parser.add_argument('--find', action='append', default=[], help='show where a function is defined, or declared')
+    parser.add_argument('--prefix', action='append', default=[], help='list function names starting with this')
+    parser.add_argument('--callers', action='append', default=[], help='show where a function is called from')
+    args = parser.parse_args(argv)
+
+    index = SymbolIndex(args.index)
+    if args.patterns:
+        parsed, dropped = index.update(collect_files(args.patterns))
+        index.save()
+        print(f'{len(index.files)} files indexed, {parsed} parsed, {dropped} dropped')
+    for name in args.find:
+        for site in index.find(name):
+            print(f'{site.path}:{site.line}: {site.kind} {site.detail}')
+    for prefix in args.prefix:
+        print(' '.join(index.prefix(prefix)))
+    for name in args.callers:
+        for site in index.callers(name):
+            print(f'{site.path}:{site.line}: called from {site.detail}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# JumpIndex.py
+# Precomputed jump tables over a token type column
+# Built once per token list in linear time, so the parser can answer "where
+# is the next ;", "where does this bracket close" and "where does this top
+# level item end" with a single array lookup instead of walking the tokens.
+from array import array
+
+from TokenType import TokenType
+from TokenTable import TYPE_CODE
+
+
+# Positions are stored as signed 64 bit integers, -1 is "none"
+INDEX_TYPECODE = 'q'
+NONE = -1
+
+SEMICOLON = TYPE_CODE[TokenType.DELIM_SEMICOLON]
+LBRACE = TYPE_CODE[TokenType.DELIM_LBRACE]
+RBRACE = TYPE_CODE[TokenType.DELIM_RBRACE]
+RPAREN = TYPE_CODE[TokenType.DELIM_RPAREN]
+
+# Closing bracket code -> opening bracket code
+BRACKET_PAIRS = {
+    TYPE_CODE[TokenType.DELIM_RPAREN]: TYPE_CODE[TokenType.DELIM_LPAREN],
+    TYPE_CODE[TokenType.DELIM_RBRACKET]: TYPE_CODE[TokenType.DELIM_LBRACKET],
+    RBRACE: LBRACE,
+}
+OPENERS = frozenset(BRACKET_PAIRS.values())
+
+# Tokens that never start or end a top level item on their own
+TRIVIA = frozenset((TYPE_CODE[TokenType.COMMENT_ML], TYPE_CODE[TokenType.COMMENT_SL]))
+PREPROCESSOR = TYPE_CODE[TokenType.PREPROCESSOR]
+
+
+class JumpIndex:
+    """
+    Jump tables for a column of token type codes, as in TokenTable.types.
+
+    next_semicolon[i] and next_lbrace[i] are the first ; or { at or after i,
+    matching[i] is the partner of the bracket at i, and item_end[i] is the
+    last token of the top level item holding i. Missing entries are NONE.
+
+    A top level item ends at a ; outside any bracket, at the } closing a
+    function body, or is a lone preprocessor line. A closer that doesn't
+    match the innermost open bracket closes the nearest one it does match,
+    leaving the brackets in between unmatched, so one stray bracket doesn't
+    throw off the rest of the file.
+
+    start and stop limit the index to a window of the tokens, which should
+    begin at an item start; the tables are then indexed from start, while
+    the methods take and return positions in the whole column. Nothing
+    outside the window is ever looked at.
+    """
+    def __init__(self, types, start=0, stop=None):
+        self.types = types
+        self.start = start
+        self.stop = len(types) if stop is None else stop
+        size = self.stop - start
+        self.size = size
+        self.matching = array(INDEX_TYPECODE, [NONE]) * size
+        self.item_end = array(INDEX_TYPECODE, [NONE]) * size
+        self.item_starts = array(INDEX_TYPECODE)
+        self.open_item = False  # the tokens end in the middle of an item
+        self._next = {}
+
+        self._build_brackets_and_items()
+        self.next_semicolon = self.next_of(SEMICOLON)
+        self.next_lbrace = self.next_of(LBRACE)
+
+
+    def _build_brackets_and_items(self):
+        types, matching, base = self.types, self.matching, self.start
+        open_positions = []  # positions of unclosed openers, innermost last
+        # The same split by kind, so a closer finds its opener without
+        # searching, and a stray one costs no more than a matched one
+        open_by_kind = {opener: [] for opener in OPENERS}
+        item_start = None
+        previous = NONE      # last non trivia token
+
+        for position in range(self.start, self.stop):
+            code = types[position]
+            if code in TRIVIA:
+                continue
+            if item_start is None:
+                item_start = position
+            closes_item = False
+
+            if code in OPENERS:
+                open_positions.append(position)
+                open_by_kind[code].append(position)
+            elif code in BRACKET_PAIRS:
+                candidates = open_by_kind[BRACKET_PAIRS[code]]
+                if candidates:
+                    start = candidates[-1]
+                    matching[start - base] = position
+                    matching[position - base] = start
+                    # Openers left inside stay unmatched; each is the
+                    # innermost of its kind, so popped in step
+                    while True:
+                        inner = open_positions.pop()
+                        open_by_kind[types[inner]].pop()
+                        if inner == start:
+                            break
+                    # A body brace, i.e. ) { ... }, ends a function definition
+                    closes_item = (not open_positions and code == RBRACE
+                                   and self._previous_code(start) == RPAREN)
+            elif not open_positions and (code == SEMICOLON or code == PREPROCESSOR):
+                closes_item = True
+
+            if closes_item:
+                self._close_item(item_start, position)
+                item_start = None
+            previous = position
+
+        # An item cut off by the end of the tokens runs to the last one
+        if item_start is not None:
+            self.open_item = True
+            self._close_item(item_start, previous)
+
+
+    def _previous_code(self, position):
+        # Type code of the last non trivia token before position
+        types = self.types
+        position -= 1
+        while position >= self.start and types[position] in TRIVIA:
+            position -= 1
+        return types[position] if position >= self.start else NONE
+
+
+    def _close_item(self, start, end):
+        self.item_starts.append(start)
+        self.item_end[start - self.start:end + 1 - self.start] = array(INDEX_TYPECODE, [end]) * (end + 1 - start)
+
+
+    def next_of(self, code):
+        """
+        Table of the first position at or after each index holding type code.
+
+        Built on first use for each code, in one backwards pass.
+        """
+        table = self._next.get(code)
+        if table is None:
+            types, base = self.types, self.start
+            table = array(INDEX_TYPECODE, [NONE]) * (self.size + 1)
+            following = NONE
+            for position in range(self.stop - 1, base - 1, -1):
+                if types[position] == code:
+                    following = position
+                table[position - base] = following
+            self._next[code] = table
+        return table
+
+
+    def find(self, position, code, stop=None):
+        """
+        Position of the first token of type code at or after position, and
+        before stop, or None.
+        """
+        if not self.start <= position < self.stop:
+            return None
+        found = self.next_of(code)[position - self.start]
+        if found == NONE or (stop is not None and found >= stop):
+            return None
+        return found
+
+
+    def first_of(self, position, low, high, stop=None):
+        """
+        -1 if a low code comes before any high code from position, 1 if a high
+        code comes first, None if neither appears before stop.
+        """
+        low_at, high_at = self.find(position, low, stop), self.find(position, high, stop)
+        if low_at is None and high_at is None:
+            return None
+        if high_at is None or (low_at is not None and low_at < high_at):
+            return -1
+        return 1
+
+
+    def match_of(self, position):
+        """
+        Position of the bracket paired with the one at position, or None.
+        """
+        if not self.start <= position < self.stop:
+            return None
+        found = self.matching[position - self.start]
+        return None if found == NONE else found
+
+
+    def end_of_item(self, position):
+        """
+        Last position of the top level item holding position, or None for trivia between items.
+        """
+        if not self.start <= position < self.stop:
+            return None
+        found = self.item_end[position - self.start]
+        return None if found == NONE else found
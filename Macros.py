@@ -0,0 +1,647 @@
+# Macros.py
+# Macro table and expander over the token stream
+# Expansion follows the C standard's rescanning rules with Prosser's hide
+# sets: a token carries the names of the macros it came out of, and a name
+# in its own hide set is never expanded again, so recursive macros stop.
+# Expansions that don't depend on the tokens after them are memoized.
+from array import array
+from collections import deque
+from itertools import accumulate
+from operator import add
+from dataclasses import dataclass
+import re
+
+from TokenType import TokenType, TokenBase
+from TokenTable import TokenTable, BASE_CODE, TYPE_CODE, OFFSET_TYPECODE
+from Tokenizer import build_regex, GROUP_DISPATCH
+from JumpIndex import TRIVIA
+from Includes import parse_directive, Unit
+from Parser import Parser
+
+
+IDENTIFIER = TYPE_CODE[TokenType.IDENTIFIER]
+PREPROCESSOR = TYPE_CODE[TokenType.PREPROCESSOR]
+LPAREN = TYPE_CODE[TokenType.DELIM_LPAREN]
+RPAREN = TYPE_CODE[TokenType.DELIM_RPAREN]
+COMMA = TYPE_CODE[TokenType.DELIM_COMMA]
+LITERAL_BASE = BASE_CODE[TokenBase.LITERAL]
+LITERAL_INT = TYPE_CODE[TokenType.LITERAL_INT]
+QUOTED = frozenset((TYPE_CODE[TokenType.LITERAL_STRING], TYPE_CODE[TokenType.LITERAL_CHAR]))
+
+# Tokens are tuples (base code, type code, text, hide set, space before)
+BASE, TYPE, TEXT, HIDE, SPACE = range(5)
+NO_HIDE = frozenset()
+
+# Replacement list items, (kind, payload)
+TOKEN, PARAMETER, STRINGIZE, PASTE = range(4)
+
+VARIADIC = '__VA_ARGS__'
+
+_pattern = re.compile(build_regex(), re.DOTALL)
+_blank = re.compile(r'[ \t\r\n\f\v]*')
+
+
+def lex(text, hide=NO_HIDE):
+    """
+    Tokens of text, without comments. '#' and '##' come out as their own
+    tokens with type code 0, where build_regex would read a directive.
+    """
+    tokens, position, size = [], 0, len(text)
+    while True:
+        blank = _blank.match(text, position).end()
+        space, position = blank > position, blank
+        if position >= size:
+            return tokens
+        if text.startswith('##', position):
+            tokens.append((0, 0, '##', hide, space))
+            position += 2
+            continue
+        if text[position] == '#':
+            tokens.append((0, 0, '#', hide, space))
+            position += 1
+            continue
+        match = _pattern.match(text, position)
+        if match is None:
+            # A character no token starts with, kept so nothing is lost
+            tokens.append((0, 0, text[position], hide, space))
+            position += 1
+            continue
+        group = match.lastindex
+        lookup, default = GROUP_DISPATCH[group]
+        base, ofType = default if lookup is None else lookup.get(match.group(group), default)
+        code = TYPE_CODE[ofType]
+        if code not in TRIVIA:
+            tokens.append((BASE_CODE[base], code, match.group(group), hide, space))
+        position = match.end()
+
+
+@dataclass
+class Macro:
+    name: str = None
+    parameters: tuple = None    # Parameter names, None for an object-like macro
+    variadic: bool = False      # Ends in ..., the rest of the arguments are __VA_ARGS__
+    body: tuple = ()            # Replacement list, (kind, payload) items
+
+
+def parse_define(rest):
+    """
+    The Macro a '#define rest' directive defines.
+    """
+    match = re.match(r'([A-Za-z_]\w*)(\()?', rest)
+    if match is None:
+        raise SyntaxError(f'Bad #define: {rest!r}')
+    name = match.group(1)
+    parameters, variadic = None, False
+    text = rest[match.end():]
+    if match.group(2):
+        close = text.find(')')
+        if close < 0:
+            raise SyntaxError(f'Unclosed parameter list in #define {name}')
+        parameters = [part.strip() for part in text[:close].split(',')] if text[:close].strip() else []
+        if parameters and parameters[-1].endswith('...'):
+            variadic = True
+            last = parameters.pop()[:-3].strip()
+            parameters.append(last or VARIADIC)
+        parameters = tuple(parameters)
+        text = text[close + 1:]
+
+    body = []
+    for token in lex(text):
+        if token[TYPE] == IDENTIFIER and parameters is not None and token[TEXT] in parameters:
+            body.append((PARAMETER, parameters.index(token[TEXT])))
+        elif token[TYPE] == 0 and token[TEXT] == '#' and parameters is not None:
+            body.append((STRINGIZE, None))
+        elif token[TYPE] == 0 and token[TEXT] == '##':
+            body.append((PASTE, None))
+        else:
+            body.append((TOKEN, token))
+    return Macro(name, parameters, variadic, tuple(body))
+
+
+def stringize(tokens):
+    # The # operator: the argument's spelling as a string literal
+    parts = []
+    for index, token in enumerate(tokens):
+        if index and token[SPACE]:
+            parts.append(' ')
+        text = token[TEXT]
+        if token[TYPE] in QUOTED:
+            text = text.replace('\\', '\\\\').replace('"', '\\"')
+        parts.append(text)
+    text = '"' + ''.join(parts) + '"'
+    return (BASE_CODE[TokenBase.LITERAL], TYPE_CODE[TokenType.LITERAL_STRING], text, NO_HIDE, False)
+
+
+def paste(left, right):
+    # The ## operator: the two spellings joined and lexed again
+    tokens = lex(left[TEXT] + right[TEXT], left[HIDE] & right[HIDE])
+    if tokens:
+        tokens[0] = tokens[0][:SPACE] + (left[SPACE],)
+    return tokens
+
+
+class _Rescan:
+    """
+    One pass of expansion over a token source: the file, or in isolation
+    a replacement list or an argument.
+
+    incomplete is set if a call's arguments ran past the end of the source,
+    and trailing if the source ended on the name of a function-like macro;
+    either way the result depends on what follows, so it can't be cached.
+    """
+    def __init__(self, expander, source):
+        self.expander = expander
+        self.source = source
+        self.pending = deque()
+        self.incomplete = False
+        self.trailing = False
+
+    def next(self):
+        if self.pending:
+            return self.pending.popleft()
+        return self.source()
+
+    def run(self, out):
+        expander, macros = self.expander, self.expander.macros
+        while True:
+            token = self.next()
+            if token is None:
+                return out
+            name = token[TEXT]
+            if token[TYPE] != IDENTIFIER or name not in macros or name in token[HIDE]:
+                out.append(token)
+                continue
+            macro = macros[name]
+
+            if macro.parameters is None:
+                expanded, replacement = expander.expand_object(macro, token)
+            else:
+                following = self.next()
+                if following is None or following[TYPE] != LPAREN:
+                    out.append(token)
+                    if following is None:
+                        self.trailing = True
+                    else:
+                        self.pending.appendleft(following)
+                    continue
+                arguments, seen = self.arguments()
+                if arguments is None:
+                    # Ran out of tokens inside the call, leave it as it was
+                    self.incomplete = True
+                    out.append(token)
+                    out.append(following)
+                    out.extend(seen)
+                    continue
+                result = expander.expand_call(macro, token, arguments, seen[-1])
+                if result is None:
+                    # Not a call it can expand, the name stays and the rest is scanned as text
+                    out.append(token)
+                    self.pending.extendleft(reversed([following] + seen))
+                    continue
+                expanded, replacement = result
+
+            if expanded is not None:
+                out.extend(expanded)
+            else:
+                self.pending.extendleft(reversed(replacement))
+
+    def arguments(self):
+        """
+        (arguments, tokens read) for a call whose ( was just read, the
+        closing ) last of the tokens; arguments is None if the source ran
+        out first.
+        """
+        arguments, current, depth, seen = [], [], 0, []
+        while True:
+            token = self.next()
+            if token is None:
+                return None, seen
+            seen.append(token)
+            code = token[TYPE]
+            if code == LPAREN:
+                depth += 1
+            elif code == RPAREN:
+                if not depth:
+                    arguments.append(tuple(current))
+                    return arguments, seen
+                depth -= 1
+            elif code == COMMA and not depth:
+                arguments.append(tuple(current))
+                current = []
+                continue
+            current.append(token)
+
+
+class MacroExpander:
+    """
+    A macro table and the expansion of token streams against it.
+
+    expand() takes a TokenTable or an Includes.Unit and returns a new
+    TokenTable of the expanded tokens: directives applied and removed,
+    #if/#ifdef/#ifndef/#elif/#else/#endif groups that are off dropped,
+    comments dropped, macros expanded. #define and #undef met on the way
+    change the table for the rest of the stream and for later calls.
+
+    Object-like expansions and function-like calls with identical
+    arguments are memoized while the table stays the same; any #define
+    or #undef empties the memo. predefined maps names to replacement
+    text, as -D does; memoize=False expands everything afresh.
+    """
+    def __init__(self, predefined=None, memoize=True):
+        self.macros = {}
+        self.memoize = memoize
+        self.diagnostics = []
+        self.hits = 0
+        self.misses = 0
+        self._objects = {}      # (name, hide set) -> (expansion or None, replacement)
+        self._calls = {}        # (name, hide set, arguments) -> same
+        self._arguments = {}    # argument tokens -> fully expanded tokens
+        for name, value in (predefined or {}).items():
+            self.define(f'{name} {value}')
+
+
+    def define(self, rest):
+        """
+        Apply '#define rest'.
+        """
+        macro = parse_define(rest)
+        self.macros[macro.name] = macro
+        self._forget()
+
+    def undef(self, name):
+        if self.macros.pop(name, None) is not None:
+            self._forget()
+
+    def _forget(self):
+        self._objects.clear()
+        self._calls.clear()
+        self._arguments.clear()
+
+
+    def _isolated(self, tokens):
+        # Expand tokens on their own; (result, whether it depends on what follows)
+        iterator = iter(tokens)
+        rescan = _Rescan(self, lambda: next(iterator, None))
+        result = rescan.run([])
+        return result, rescan.incomplete or rescan.trailing
+
+
+    def _finish(self, memo, key, replacement):
+        # Fully expand a replacement list on its own if that gives the same
+        # as rescanning it with the tokens after it; remember either way
+        expanded, open_ended = self._isolated(replacement)
+        entry = (None if open_ended else tuple(expanded), replacement)
+        if self.memoize:
+            memo[key] = entry
+        return entry
+
+
+    def expand_object(self, macro, token):
+        """
+        (expansion, replacement) for an object-like macro name token.
+
+        expansion is the fully expanded result, or None if it has to be
+        rescanned with the tokens that follow; replacement is the result
+        before rescanning.
+        """
+        key = (macro.name, token[HIDE])
+        entry = self._objects.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        replacement = self.substitute(macro, (), token[HIDE] | {macro.name}, token[SPACE])
+        return self._finish(self._objects, key, replacement)
+
+
+    def expand_call(self, macro, token, arguments, close):
+        """
+        (expansion, replacement) for a call of a function-like macro, as
+        expand_object, or None if the number of arguments is wrong, which
+        is reported.
+        """
+        if len(arguments) == 1 and not arguments[0] and not macro.parameters:
+            arguments = []
+        count = len(macro.parameters)
+        if macro.variadic and len(arguments) >= count:
+            # The variadic part, commas included
+            rest = []
+            for index, argument in enumerate(arguments[count - 1:]):
+                if index:
+                    rest.append((BASE_CODE[TokenBase.DELIM], COMMA, ',', NO_HIDE, False))
+                rest.extend(argument)
+            arguments = arguments[:count - 1] + [tuple(rest)]
+        elif macro.variadic and len(arguments) == count - 1:
+            arguments = arguments + [()]
+        if len(arguments) != count:
+            self.diagnostics.append(f'{macro.name} takes {count} arguments, {len(arguments)} given')
+            return None
+
+        hide = token[HIDE] & close[HIDE]
+        key = (macro.name, hide, tuple(arguments))
+        entry = self._calls.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        replacement = self.substitute(macro, arguments, hide | {macro.name}, token[SPACE])
+        return self._finish(self._calls, key, replacement)
+
+
+    def expand_argument(self, argument):
+        expanded = self._arguments.get(argument)
+        if expanded is None:
+            expanded = tuple(self._isolated(argument)[0])
+            if self.memoize:
+                self._arguments[argument] = expanded
+        return expanded
+
+
+    def substitute(self, macro, arguments, hide, space):
+        """
+        macro's replacement list with arguments put in and hide added to every token.
+        """
+        out = []
+        body = macro.body
+        index = 0
+        while index < len(body):
+            kind, payload = body[index]
+            pasting = index + 1 < len(body) and body[index + 1][0] == PASTE
+            if kind == STRINGIZE and index + 1 < len(body) and body[index + 1][0] == PARAMETER:
+                out.append(stringize(arguments[body[index + 1][1]]))
+                index += 2
+                continue
+            if kind == PASTE and index + 1 < len(body):
+                kind, payload = body[index + 1]
+                right = list(arguments[payload]) if kind == PARAMETER else [payload]
+                if kind == STRINGIZE and index + 2 < len(body):
+                    right = [stringize(arguments[body[index + 2][1]])]
+                    index += 1
+                if out and right:
+                    out[-1:] = paste(out[-1], right[0])
+                    out.extend(right[1:])
+                else:
+                    out.extend(right)
+                index += 2
+                continue
+            if kind == PARAMETER:
+                # An operand of ## is put in as written, anything else expanded first
+                argument = arguments[payload]
+                out.extend(argument if pasting else self.expand_argument(argument))
+            elif kind == TOKEN:
+                out.append(payload)
+            index += 1
+
+        # Tokens mostly share a handful of hide sets, so each union is made once
+        unions = {}
+        result = []
+        for token in out:
+            hidden = unions.get(token[HIDE])
+            if hidden is None:
+                hidden = unions[token[HIDE]] = token[HIDE] | hide
+            result.append((token[BASE], token[TYPE], token[TEXT], hidden, token[SPACE]))
+        if result:
+            result[0] = result[0][:SPACE] + (space,)
+        return result
+
+
+    def evaluate(self, rest):
+        """
+        Value of an #if or #elif condition.
+
+        defined NAME and defined(NAME) are settled first, then macros are
+        expanded and any name left over counts as 0, as the standard says.
+        """
+        tokens = lex(rest)
+        settled = []
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            if token[TYPE] == IDENTIFIER and token[TEXT] == 'defined':
+                if index + 1 < len(tokens) and tokens[index + 1][TYPE] == LPAREN:
+                    name, index = tokens[index + 2][TEXT], index + 4
+                else:
+                    name, index = tokens[index + 1][TEXT], index + 2
+                settled.append((LITERAL_BASE, LITERAL_INT, '1' if name in self.macros else '0', NO_HIDE, True))
+                continue
+            settled.append(token)
+            index += 1
+
+        expanded, _ = self._isolated(settled)
+        zero = (LITERAL_BASE, LITERAL_INT, '0', NO_HIDE, True)
+        table = self._table([zero if token[TYPE] == IDENTIFIER else token for token in expanded])
+        if not len(table):
+            raise SyntaxError('#if with no condition')
+        parser = Parser(table)
+        tree = parser.parse_expression()
+        if parser.position != len(table):
+            raise SyntaxError(f'Trailing tokens in #if {rest!r}')
+        return _evaluate(tree)
+
+
+    def expand(self, source):
+        """
+        TokenTable of source, a TokenTable or an Includes.Unit, with every
+        directive applied and every macro expanded.
+
+        The new table's source is the expanded token texts one space apart,
+        a stand-in like TokenTable.from_tokens makes, so it isn't located.
+        """
+        out = _Rescan(self, self._reader(source)).run([])
+        return self._table(out)
+
+
+    def _table(self, tokens):
+        # TokenTable over the token texts joined one space apart. Its offsets
+        # only point into that string, so it has no lines or columns to give
+        table = TokenTable()
+        table.located = False
+        stray = [token for token in tokens if not token[TYPE]]
+        if stray:
+            # A # or character no token starts with, left over after expansion
+            self.diagnostics.extend(f'Unexpected {token[TEXT]!r} in expanded source' for token in stray)
+            tokens = [token for token in tokens if token[TYPE]]
+        texts = [token[TEXT] for token in tokens]
+        starts = list(accumulate((len(text) + 1 for text in texts), initial=0))[:-1]
+        table.bases = array('B', [token[BASE] for token in tokens])
+        table.types = array('B', [token[TYPE] for token in tokens])
+        table.starts = array(OFFSET_TYPECODE, starts)
+        table.ends = array(OFFSET_TYPECODE, map(add, starts, map(len, texts)))
+        table.source = ' '.join(texts)
+        return table
+
+
+    def _reader(self, source):
+        # The source's tokens one at a time, directives applied, off groups and comments left out
+        if isinstance(source, Unit):
+            runs = [(header.table, start, stop) for header, start, stop in source.segments]
+        else:
+            runs = [(source, 0, len(source))]
+
+        # Per open conditional: [this group is on, a group was taken, the enclosing group is on]
+        conditions = []
+        def active():
+            return not conditions or conditions[-1][0]
+
+        def tokens():
+            for table, start, stop in runs:
+                types, starts, ends = table.types, table.starts, table.ends
+                for index in range(start, stop):
+                    code = types[index]
+                    if code == PREPROCESSOR:
+                        self._directive(table.value(index), conditions, active())
+                        continue
+                    if code in TRIVIA or not active():
+                        continue
+                    space = index > start and starts[index] > ends[index - 1]
+                    yield (table.bases[index], code, table.value(index), NO_HIDE, space)
+            if conditions:
+                self.diagnostics.append(f'{len(conditions)} #if groups left open at the end of input')
+
+        iterator = tokens()
+        return lambda: next(iterator, None)
+
+
+    def _directive(self, text, conditions, on):
+        name, rest = parse_directive(text)
+        try:
+            if name in ('if', 'ifdef', 'ifndef'):
+                if not on:
+                    conditions.append([False, True, False])
+                    return
+                if name == 'if':
+                    value = self._condition(text, rest)
+                elif rest:
+                    value = (rest.split()[0] in self.macros) == (name == 'ifdef')
+                else:
+                    # Counts as false, like a condition that can't be evaluated, so #endif still pairs up
+                    conditions.append([False, False, True])
+                    raise SyntaxError(f'#{name} without a macro name')
+                conditions.append([value, value, True])
+            elif name in ('elif', 'else'):
+                if not conditions:
+                    raise SyntaxError(f'#{name} without #if')
+                group = conditions[-1]
+                if group[1] or not group[2]:
+                    group[0] = False
+                else:
+                    group[0] = name == 'else' or self._condition(text, rest)
+                    group[1] = group[0]
+            elif name == 'endif':
+                if not conditions:
+                    raise SyntaxError('#endif without #if')
+                conditions.pop()
+            elif not on:
+                return
+            elif name == 'define':
+                self.define(rest)
+            elif name == 'undef':
+                self.undef(rest.split()[0] if rest else '')
+            elif name == 'error':
+                self.diagnostics.append(f'#error {rest}')
+            # #include is spliced by Includes, #pragma and #line are left to others
+        except SyntaxError as error:
+            self.diagnostics.append(f'{text.strip()}: {error}')
+
+    def _condition(self, text, rest):
+        # An #if or #elif condition that can't be evaluated is reported and counts as false
+        try:
+            return bool(self.evaluate(rest))
+        except (SyntaxError, IndexError, KeyError, ValueError, ZeroDivisionError, RecursionError) as error:
+            self.diagnostics.append(f'{text.strip()}: {error}')
+            return False
+
+
+# Integer constants #if takes: binary, hex, octal and decimal, with suffixes
+_INTEGER = re.compile(r'(?:0[bB]([01]+)|0[xX]([0-9a-fA-F]+)|(0[0-7]*)|([1-9][0-9]*))[uUlL]*\Z')
+_INTEGER_BASES = (2, 16, 8, 10)
+
+
+def _literal_value(text):
+    if text.startswith("'"):
+        body = text[1:-1]
+        return ord(body[-1]) if body else 0
+    if text in ('true', 'false'):
+        return int(text == 'true')
+    match = _INTEGER.match(text)
+    if match is None:
+        # A float or a string has no value here, rather than a silent 0
+        raise SyntaxError(f'{text} is not an integer constant')
+    for digits, base in zip(match.groups(), _INTEGER_BASES):
+        if digits is not None:
+            return int(digits, base)
+
+
+# Shift counts past the width of intmax_t are undefined in c; refusing them
+# also keeps 1 << huge from building a huge int
+MAX_SHIFT = 63
+
+UNARY = {'-': lambda value: -value, '+': lambda value: value,
+         '!': lambda value: int(not value), '~': lambda value: ~value}
+
+
+def _binary(operator, left, right):
+    if operator in ('/', '%'):
+        if right == 0:
+            raise ZeroDivisionError('division by zero in #if')
+        quotient = abs(left) // abs(right) * (1 if (left < 0) == (right < 0) else -1)
+        return quotient if operator == '/' else left - right * quotient
+    if operator in ('<<', '>>') and not 0 <= right <= MAX_SHIFT:
+        raise SyntaxError(f'shift count {right} out of range in #if')
+    return {
+        '+': lambda: left + right, '-': lambda: left - right, '*': lambda: left * right,
+        '<<': lambda: left << right, '>>': lambda: left >> right,
+        '<': lambda: int(left < right), '>': lambda: int(left > right),
+        '<=': lambda: int(left <= right), '>=': lambda: int(left >= right),
+        '==': lambda: int(left == right), '!=': lambda: int(left != right),
+        '&': lambda: left & right, '|': lambda: left | right, '^': lambda: left ^ right,
+    }[operator]()
+
+
+# Steps of _evaluate's walk: visit a node, or finish one whose operands are done
+VISIT, APPLY, CHOOSE, TRUTH = range(4)
+
+
+def _evaluate(node):
+    # Value of an #if expression tree from Expression.parse_expression, C style.
+    # Walked with an explicit stack, as it was parsed, so a long condition
+    # can't run out of Python recursion. &&, || and ?: evaluate only the
+    # operands c does, so 0 && 1 / 0 is fine.
+    values = []
+    steps = [(VISIT, node)]
+    while steps:
+        step, node = steps.pop()
+        kind = node['type']
+        if step == VISIT:
+            if kind == 'Literal':
+                values.append(_literal_value(node['value']))
+            elif kind == 'Identifier':
+                values.append(0)
+            elif kind == 'UnaryOperation':
+                steps += ((APPLY, node), (VISIT, node['operand']))
+            elif kind == 'TernaryOperation':
+                steps += ((CHOOSE, node), (VISIT, node['condition']))
+            elif kind != 'BinaryOperation':
+                raise SyntaxError(f'{kind} in #if')
+            elif node['operator'] in ('&&', '||'):
+                steps += ((CHOOSE, node), (VISIT, node['left']))
+            else:
+                steps += ((APPLY, node), (VISIT, node['right']), (VISIT, node['left']))
+        elif step == APPLY:
+            if kind == 'UnaryOperation':
+                values.append(UNARY[node['operator']](values.pop()))
+            else:
+                right = values.pop()
+                values.append(_binary(node['operator'], values.pop(), right))
+        elif step == CHOOSE:
+            value = values.pop()
+            if kind == 'TernaryOperation':
+                steps.append((VISIT, node['then'] if value else node['else']))
+            elif bool(value) == (node['operator'] == '&&'):
+                # Left doesn't settle it, the right operand's truth is the answer
+                steps += ((TRUTH, node), (VISIT, node['right']))
+            else:
+                values.append(int(bool(value)))
+        else:
+            values.append(int(bool(values.pop())))
+    return values.pop()
@@ -0,0 +1,485 @@
+# Packed.py
+# Versioned binary file of token tables and ASTs, read back through mmap
+# Run directly: python Packed.py project.cpak src/ 'include/**/*.h'
+#               python Packed.py --info project.cpak
+# A packed file holds any number of units, each a source with its token
+# columns and its AstArena nodes flattened into integer arrays. The reader
+# maps the file and slices typed views out of it, so opening one costs the
+# same however big it is and only what is asked for gets decoded.
+from array import array
+from bisect import bisect_left, bisect_right
+import argparse
+import contextlib
+import mmap
+import os
+import struct
+import sys
+
+from TokenType import TokenType, TokenBase
+from TokenTable import TokenTable, BASES, TYPES, OFFSET_TYPECODE, line_starts
+from Tokenizer import tokenize
+from Ast import NodeKind, NODE_CLASSES, AstArena, CHILD, CHILDREN, TEXT
+from Parser import Parser
+from Batch import collect_files
+
+
+# Bump when the layout of the file changes; older files are refused
+PACK_FORMAT = 1
+
+MAGIC = b'CPAK'
+# magic, format, byte order (1 little, 2 big), section count
+HEADER = struct.Struct('<4sHHI')
+# tag, offset, length in bytes
+SECTION = struct.Struct('<4sQQ')
+# Sections start on this boundary so their views can be cast in place
+ALIGNMENT = 8
+
+BYTE_ORDER = 1 if sys.byteorder == 'little' else 2
+
+# name, source offset, source length, first token, token count,
+# first node, node count, root node (-1 for none)
+UNIT_FIELDS = 8
+
+# Typecode of each section's view
+SECTIONS = {
+    b'META': 'I',               # String indices, see _layout
+    b'STRO': 'I',               # Start of each string in STRB, and the end of the last
+    b'STRB': 'B',               # Strings, utf-8
+    b'UNIT': 'q',               # UNIT_FIELDS per unit
+    b'SRC ': 'B',               # Sources, one after another
+    b'TBAS': 'B',               # Token columns, as in TokenTable
+    b'TTYP': 'B',
+    b'TSTA': OFFSET_TYPECODE,   # Byte offsets into the unit's source
+    b'TEND': OFFSET_TYPECODE,
+    b'TLIN': 'I',               # Line of each token's start, from 1
+    b'NKND': 'B',               # NodeKind of each node
+    b'NSTA': 'I',               # Start of each node's fields in NDAT
+    b'NDAT': 'i',               # Node fields, see _encode_node
+}
+
+
+def _layout():
+    # Everything the codes in a file stand for: base, type and node kind
+    # names, and each node's fields; a file packed with other tables is refused
+    return ([base.name for base in TokenBase], [ofType.name for ofType in TokenType],
+            ';'.join(f'{cls.kind.name}:' + ','.join(f'{attribute}/{field}' for attribute, _, field in cls.fields)
+                     for cls in sorted(NODE_CLASSES.values(), key=lambda cls: cls.kind)))
+
+
+def _byte_offsets(text, encoding, offsets):
+    # Character offsets into text as byte offsets into text.encode(encoding)
+    if text.isascii():
+        return None
+    mapping, previous, position = {}, 0, 0
+    for offset in sorted(set(offsets)):
+        position += len(text[previous:offset].encode(encoding))
+        mapping[offset] = position
+        previous = offset
+    return mapping
+
+
+class _Strings:
+    def __init__(self):
+        self.index = {}
+        self.blob = bytearray()
+        self.offsets = array('I', [0])
+
+    def __call__(self, text):
+        if text is None:
+            return -1
+        index = self.index.get(text)
+        if index is None:
+            index = self.index[text] = len(self.offsets) - 1
+            self.blob += text.encode('utf-8')
+            self.offsets.append(len(self.blob))
+        return index
+
+
+def _encode_node(node, data, strings):
+    # Each field in order: a node or token index, -1 for None; a string
+    # index for TEXT; for CHILDREN the count, then that many node indices
+    for attribute, _, field in node.fields:
+        value = getattr(node, attribute)
+        if field == CHILDREN:
+            data.append(len(value))
+            data.extend(-1 if child is None else child for child in value)
+        elif field == TEXT:
+            data.append(strings(value))
+        else:
+            data.append(-1 if value is None else value)
+
+
+def write(path, units):
+    """
+    Pack units into a file at path, written whole then moved into place.
+
+    units are (name, table, arena, root) with arena an Ast.AstArena over
+    table and root its top node; arena and root may be None to store only
+    the tokens.
+    """
+    strings = _Strings()
+    bases_names, type_names, fields = _layout()
+    meta = array('I', [len(bases_names)] + [strings(name) for name in bases_names]
+                 + [len(type_names)] + [strings(name) for name in type_names]
+                 + [strings(fields)])
+    columns = {tag: array(code) for tag, code in SECTIONS.items() if tag not in (b'META', b'STRO', b'STRB')}
+    sources = bytearray()
+
+    for name, table, arena, root in units:
+        source = table.source
+        starts, ends = table.starts, table.ends
+        if isinstance(source, str):
+            mapping = _byte_offsets(source, table.encoding, list(starts) + list(ends))
+            source = source.encode(table.encoding)
+            if mapping is not None:
+                starts = array(OFFSET_TYPECODE, [mapping[offset] for offset in starts])
+                ends = array(OFFSET_TYPECODE, [mapping[offset] for offset in ends])
+        source = bytes(source)
+        if table.encoding.replace('-', '').lower() != 'utf8' and not source.isascii():
+            raise ValueError(f'{name}: only utf-8 sources can be packed, not {table.encoding}')
+
+        nodes = arena.nodes if arena is not None else ()
+        columns[b'UNIT'].extend((strings(name), len(sources), len(source), len(columns[b'TBAS']), len(table),
+                                 len(columns[b'NKND']), len(nodes), -1 if root is None else root))
+        sources += source
+        columns[b'TBAS'].extend(table.bases)
+        columns[b'TTYP'].extend(table.types)
+        columns[b'TSTA'].extend(starts)
+        columns[b'TEND'].extend(ends)
+
+        # Line of each start, from the offsets the lines of the source start at
+        newlines = line_starts(source)
+        columns[b'TLIN'].extend(bisect_right(newlines, start) for start in starts)
+
+        kinds, node_starts, data = columns[b'NKND'], columns[b'NSTA'], columns[b'NDAT']
+        for node in nodes:
+            kinds.append(node.kind)
+            node_starts.append(len(data))
+            _encode_node(node, data, strings)
+
+    columns[b'SRC '] = sources
+    columns[b'META'] = meta
+    columns[b'STRO'] = strings.offsets
+    columns[b'STRB'] = strings.blob
+
+    tags = list(SECTIONS)
+    offset = _align(HEADER.size + SECTION.size * len(tags))
+    table_of_sections, blobs = [], []
+    for tag in tags:
+        blob = columns[tag] if isinstance(columns[tag], (bytes, bytearray)) else columns[tag].tobytes()
+        table_of_sections.append(SECTION.pack(tag, offset, len(blob)))
+        blobs.append((offset, blob))
+        offset = _align(offset + len(blob))
+
+    temp = path + '.tmp'
+    with open(temp, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, PACK_FORMAT, BYTE_ORDER, len(tags)))
+        file.write(b''.join(table_of_sections))
+        for offset, blob in blobs:
+            file.write(b'\0' * (offset - file.tell()))
+            file.write(blob)
+    os.replace(temp, path)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def pack(paths, out, parse=True):
+    """
+    Tokenize and parse each of paths into an arena and write them all to out.
+
+    A file that doesn't parse is stored with its tokens only. Returns the
+    paths that didn't parse.
+    """
+    units, failed = [], []
+    for path in paths:
+        with open(path, 'rb') as file:
+            table = tokenize(file.read())
+        arena = root = None
+        if parse:
+            arena = AstArena(table)
+            try:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    root = Parser(table, arena=arena).parse_program()
+            except Exception:
+                arena = root = None
+                failed.append(path)
+        units.append((path, table, arena, root))
+    write(out, units)
+    return failed
+
+
+class PackedFile:
+    """
+    A packed file mapped read only.
+
+    Opening checks the header and the code tables and nothing else; units
+    are read through views into the mapping as they are used. Close it, or
+    use it as a context manager, once no views are needed any more.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f'{path}: empty file, not a packed file')
+        self._views = []
+        try:
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self):
+        if len(self._map) < HEADER.size:
+            raise ValueError(f'{self.path}: not a packed file')
+        magic, version, order, count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f'{self.path}: not a packed file')
+        if version != PACK_FORMAT:
+            raise ValueError(f'{self.path}: pack format {version}, this reader takes {PACK_FORMAT}')
+        if order != BYTE_ORDER:
+            raise ValueError(f'{self.path}: packed on a machine of the other byte order')
+
+        whole = memoryview(self._map)
+        self._views.append(whole)
+        self.sections = {}
+        self.offsets = {}
+        for index in range(count):
+            tag, offset, length = SECTION.unpack_from(self._map, HEADER.size + index * SECTION.size)
+            if tag not in SECTIONS or offset + length > len(self._map):
+                raise ValueError(f'{self.path}: bad section {tag!r}')
+            view = whole[offset:offset + length].cast(SECTIONS[tag])
+            self._views.append(view)
+            self.sections[tag] = view
+            self.offsets[tag] = offset
+        missing = set(SECTIONS) - set(self.sections)
+        if missing:
+            raise ValueError(f'{self.path}: missing sections {sorted(missing)}')
+
+        meta = self.sections[b'META']
+        bases = [self.string(index) for index in meta[1:1 + meta[0]]]
+        types_at = 1 + meta[0]
+        types = [self.string(index) for index in meta[types_at + 1:types_at + 1 + meta[types_at]]]
+        fields = self.string(meta[types_at + 1 + meta[types_at]])
+        current = _layout()
+        if fields != current[2]:
+            raise ValueError(f'{self.path}: packed with different AST nodes')
+        # Codes are positions in BASES and TYPES; map names that moved
+        self.bases = (None,) + tuple(TokenBase[name] if name in TokenBase.__members__ else None for name in bases)
+        self.types = (None,) + tuple(TokenType[name] if name in TokenType.__members__ else None for name in types)
+        self.same_codes = bases == current[0] and types == current[1]
+        self.units = [PackedUnit(self, index) for index in range(len(self.sections[b'UNIT']) // UNIT_FIELDS)]
+        self._by_name = {unit.name: unit for unit in self.units}
+
+    def string(self, index):
+        if index < 0:
+            return None
+        offsets = self.sections[b'STRO']
+        return bytes(self.sections[b'STRB'][offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def unit(self, name):
+        """
+        The PackedUnit stored under name, KeyError if there is none.
+        """
+        return self._by_name[name]
+
+    def __len__(self):
+        return len(self.units)
+
+    def __iter__(self):
+        return iter(self.units)
+
+    def close(self):
+        # The mapping can't close while any view of it is alive
+        for unit in getattr(self, 'units', ()):
+            unit._release()
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if not self._map.closed:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PackedUnit:
+    """
+    One source of a PackedFile: token columns and AST nodes read in place.
+
+    Indices are the unit's own, as in its TokenTable and AstArena. table()
+    and arena() copy the whole unit out for code that wants those; the
+    rest reads only the rows asked for.
+    """
+    def __init__(self, packed, index):
+        self.packed = packed
+        record = packed.sections[b'UNIT'][index * UNIT_FIELDS:(index + 1) * UNIT_FIELDS]
+        name, self._source_at, self._source_size, first, count, first_node, nodes, root = record
+        self.name = packed.string(name)
+        self.root = None if root < 0 else root
+        sections = packed.sections
+        tokens, node_slice = slice(first, first + count), slice(first_node, first_node + nodes)
+        self._bases = sections[b'TBAS'][tokens]
+        self._types = sections[b'TTYP'][tokens]
+        self.starts = sections[b'TSTA'][tokens]
+        self.ends = sections[b'TEND'][tokens]
+        self.lines = sections[b'TLIN'][tokens]
+        self._kinds = sections[b'NKND'][node_slice]
+        self._node_starts = sections[b'NSTA'][node_slice]
+        self._source = sections[b'SRC '][self._source_at:self._source_at + self._source_size]
+        self._kinds_at = packed.offsets[b'NKND'] + first_node
+
+    def _release(self):
+        for view in (self._bases, self._types, self.starts, self.ends, self.lines,
+                     self._kinds, self._node_starts, self._source):
+            view.release()
+
+    def __len__(self):
+        return len(self._bases)
+
+    @property
+    def node_count(self):
+        return len(self._kinds)
+
+
+    def base(self, index):
+        return self.packed.bases[self._bases[index]]
+
+    def ofType(self, index):
+        return self.packed.types[self._types[index]]
+
+    def value(self, index):
+        return bytes(self._source[self.starts[index]:self.ends[index]]).decode('utf-8')
+
+    def line(self, index):
+        return self.lines[index]
+
+    def tokens_on_line(self, line):
+        """
+        range of the indices of the tokens starting on line.
+        """
+        return range(bisect_left(self.lines, line), bisect_right(self.lines, line))
+
+    def source(self):
+        return bytes(self._source)
+
+
+    def table(self):
+        """
+        The unit as a TokenTable over its source bytes.
+        """
+        table = TokenTable(self.source(), 'utf-8')
+        if self.packed.same_codes:
+            table.bases.frombytes(self._bases)
+            table.types.frombytes(self._types)
+        else:
+            bases = bytes(BASES.index(base) if base is not None else 0 for base in self.packed.bases)
+            types = bytes(TYPES.index(ofType) if ofType is not None else 0 for ofType in self.packed.types)
+            table.bases.frombytes(bytes(self._bases).translate(bases.ljust(256, b'\0')))
+            table.types.frombytes(bytes(self._types).translate(types.ljust(256, b'\0')))
+        table.starts.frombytes(self.starts.cast('B'))
+        table.ends.frombytes(self.ends.cast('B'))
+        return table
+
+
+    def kind(self, index):
+        return NodeKind(self._kinds[index])
+
+    def node(self, index):
+        """
+        Node index as the Ast node class AstArena holds.
+        """
+        data = self.packed.sections[b'NDAT']
+        cls = NODE_CLASSES[self._kinds[index]]
+        position = self._node_starts[index]
+        values = []
+        for _, _, field in cls.fields:
+            value = data[position]
+            position += 1
+            if field == CHILDREN:
+                children = data[position:position + value]
+                value = [None if child < 0 else child for child in children]
+                position += len(value)
+            elif field == TEXT:
+                value = self.packed.string(value)
+            elif value < 0:
+                value = None
+            values.append(value)
+        return cls(*values)
+
+    def children(self, index):
+        """
+        Indices of the direct children of node index, in field order.
+        """
+        node = self.node(index)
+        result = []
+        for attribute, _, field in node.fields:
+            value = getattr(node, attribute)
+            if field == CHILD:
+                if value is not None:
+                    result.append(value)
+            elif field == CHILDREN:
+                result.extend(child for child in value if child is not None)
+        return result
+
+    def find(self, kind):
+        """
+        Yield the index of every node of kind, without reading any node.
+        """
+        # Searched for in the mapping itself, kinds are one byte each
+        found, code = self.packed._map.find, bytes((kind,))
+        start, stop = self._kinds_at, self._kinds_at + len(self._kinds)
+        while True:
+            position = found(code, start, stop)
+            if position < 0:
+                return
+            yield position - self._kinds_at
+            start = position + 1
+
+    def arena(self, table=None):
+        """
+        The unit's nodes as an AstArena over table, by default self.table().
+        """
+        arena = AstArena(self.table() if table is None else table)
+        arena.nodes.extend(self.node(index) for index in range(self.node_count))
+        # Bodies packed from an outline parse are parsed when read
+        arena.parse_body = Parser(arena.tokens, arena=arena).parse_body
+        return arena
+
+    def to_dict(self, root=None):
+        """
+        Dict form of node root, by default the unit's root, as the parser returns it.
+        """
+        return self.arena().to_dict(self.root if root is None else root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack tokenized and parsed c sources into one file, or describe one.')
+    parser.add_argument('out', help='packed file to write, or to read with --info')
+    parser.add_argument('patterns', nargs='*', help='directories or glob patterns to pack')
+    parser.add_argument('--no-parse', action='store_true', help='only store tokens')
+    parser.add_argument('--info', action='store_true', help='list the units of a packed file')
+    args = parser.parse_args(argv)
+
+    if args.info:
+        with PackedFile(args.out) as packed:
+            for unit in packed:
+                print(f'{unit.name}: {len(unit)} tokens, {unit.node_count} nodes')
+        return 0
+
+    failed = pack(collect_files(args.patterns), args.out, parse=not args.no_parse)
+    for path in failed:
+        print(f'{path}: did not parse, tokens only')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
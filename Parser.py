@@ -1,5 +1,12 @@
-from TokenType import TokenType, TokenBase, DataType, Keywords
-from TokenType import BlockStart, StatementTerminate, DataMod
+from TokenType import TokenType, TokenBase, Keywords
+from TokenTable import TokenTable, TYPE_CODE
+from JumpIndex import JumpIndex, SEMICOLON, RBRACE, OPENERS
+from Ast import NodeKind, DictBuilder
+from Symbols import SymbolTable, SymbolKind
+import Tracer
+import Expression
+from bisect import bisect_right
+from dataclasses import dataclass
 from enum import Enum
 from pprint import pprint
 
@@ -21,42 +28,6 @@ def _debug(func):
     return wrapper
 
 
-def debug(func):
-    """
-    A decorator to print debug information about a function call.
-    """
-    def wrapper(*args, **kwargs):
-        print(f"\nDebug:  {func.__name__.upper()}")
-        token = args[0].current_token()
-        print(f"Recieved: {token.Id:>12} {token.ofType:>12} {token.value:>12}")
-
-        result = func(*args, **kwargs)
-
-        print(f"{func.__name__}  Returned: {result}\n\n")
-        # print(f"--- End Debug ---\n")
-        return result
-    return wrapper
-
-def debug_match(func):
-    """
-    A decorator to print debug information about a function call.
-    """
-    def wrapper(*args, **kwargs):
-        print(f"\nDebug: {func.__name__.upper()}")
-        token = args[0].current_token()
-        print(f"Recieved: {token.Id:>12} {token.ofType:>12} {token.value:>12}")
-        print(f"Expecting: {args[1]:>31}")
-        # print(f"Keyword Arguments: {kwargs}")
-
-        result = func(*args, **kwargs)
-
-        print(f"Match!: {result}\n")
-        # print(f"--- End Debug ---\n")
-        return result
-    return wrapper
-
-
-
 def log_scope(func):
     def wrapper(*args, **kwargs):
         print(f"--- Debugging {func.__name__} ---")
@@ -75,15 +46,62 @@ def log_scope(func):
     return wrapper
 
 
+IDENTIFIER = TYPE_CODE[TokenType.IDENTIFIER]
+LPAREN = TYPE_CODE[TokenType.DELIM_LPAREN]
+
+
+@dataclass
+class Diagnostic:
+    position: int = 0       # Token the parser had reached when the error was raised
+    message: str = None     # The SyntaxError's message
+    resumed: int = 0        # Token parsing carried on from
+    line: int = 0           # Line and column of position in the source, from 1, 0 if not known
+    column: int = 0
+
+
 class Parser:
-    def __init__(self, tokens):
+    def __init__(self, tokens, tracer=None, jumps=None, arena=None, recover=False, outline=False):
         """
-        Initialize the parser with a list of tokens.
+        Initialize the parser with a TokenTable, or a list of tokens.
+
+        tracer, if given, is told about every match, peek and traced rule,
+        see Tracer. Without one the parser runs unwrapped. jumps is a
+        JumpIndex to use instead of indexing all of tokens, e.g. one limited
+        to the window an incremental reparse covers. arena is an
+        Ast.AstArena to build the nodes in, the parse then returns arena
+        indices instead of dicts.
+
+        recover turns a syntax error into a Diagnostic in self.diagnostics:
+        the parser skips to the end of the statement, or of the top level
+        item, and carries on, leaving what failed out of the AST.
+
+        Declarations are recorded in self.symbols, a Symbols.SymbolTable,
+        as they are parsed; it can be queried once the parse is done.
+
+        outline steps over function bodies from { to the matching } without
+        parsing them. Each is built as a lazy node, an Ast.LazyBody dict
+        stand-in or an Ast.LazyBlock in the arena, that this parser parses
+        the first time it is read, to the same tree a full parse gives.
         """
+        if not isinstance(tokens, TokenTable):
+            tokens = TokenTable.from_tokens(tokens)
         self.tokens = tokens
+        self.types = tokens.types # ofType codes, compared directly against TYPE_CODE
+        self.jumps = jumps or JumpIndex(self.types) # next ;/{, bracket pairs and item ends
+        self.arena = arena
+        self.builder = DictBuilder(tokens) if arena is None else arena
+        self.build = self.builder.build # every AST node is made through this
         self.position = 0
-
-        self.scope = []
+        self.spans = [] # (first token, stop) of each top level statement parsed
+        self.recover = recover
+        self.diagnostics = []
+        self.outline = outline
+        if outline:
+            # Looked up when a body is read, so a tracer installed below sees it
+            self.builder.parse_body = lambda start: self.parse_body(start)
+
+        self.symbols = SymbolTable(len(tokens))
+        self.late = False   # parsing a body after the rest of the file, see parse_body
         self.error = 0
         self.peek_error = 0
         self.match_error = 0
@@ -92,6 +110,10 @@ class Parser:
 
         self.counter_main_loop = 0
 
+        self.tracer = tracer
+        if tracer is not None:
+            Tracer.install(self, tracer)
+
 
     def current_token(self):
         """
@@ -99,6 +121,16 @@ class Parser:
         """
         return self.tokens[self.position] if self.position < len(self.tokens) else None
 
+    def where(self, position):
+        """
+        Token position as error messages give it, with its line and column
+        where the tokens know them.
+        """
+        location = self.tokens.location(position)
+        if location is None:
+            return f'at token {position}'
+        return f'at line {location[0]}, column {location[1]} (token {position})'
+
     def next_token(self):
         """
         Advance to the next token and return it.
@@ -106,46 +138,41 @@ class Parser:
         self.position += 1
         return self.current_token()
 
-    @debug_match
     def match(self, expected_type):
         """
         Consume a token if it matches the expected type; raise an error otherwise.
         """
         token = self.current_token()
-        if token and token.ofType == expected_type:
+        if token and self.types[self.position] == TYPE_CODE[expected_type]:
             self.next_token()
             return token
         else:
             self.match_error += 1
 
-            raise SyntaxError(f"Unexpected token: {token.ofType} at position {self.position}, expected {expected_type}")
+            raise SyntaxError(f"Unexpected token: {token.ofType if token else 'end of input'} {self.where(self.position)}, expected {expected_type}")
 
-    @debug
     def peek(self, expected_type, n=0):
-        # if self.current_token() and self.current_token().ofType == expected_type:
-        if self.current_token() and self.current_token().ofType == expected_type:
+        position = self.position + n
+        if position < len(self.types) and self.types[position] == TYPE_CODE[expected_type]:
             return True
         else:
             self.peek_error += 1
             return False
 
-    # Returns a list of the next n tokens
-    @debug
+    # Returns a list of the current token and the n tokens after it
     def scan(self, n):
         temp_pos = self.position
-        if len(self.tokens) < temp_pos + n
+        if len(self.tokens) <= temp_pos + n:
             raise SyntaxError(f"Scan called with {n}! number of tokens {len(self.tokens)}, position: {self.position}")
 
         result = []
         while n >= 0:
             token = self.tokens[temp_pos]
             result.append(token)
+            temp_pos += 1
             n -= 1
 
-        if token and token.ofType == expected_type:
-            return result
-        else:
-            return None
+        return result
 
 
     def group_match(self, group_func):
@@ -158,8 +185,9 @@ class Parser:
         Returns:
             dict: The matched token, or raises an exception if no match.
         """
-        if self.current_token():
-            if group_func(self.current_token()):
+        token = self.current_token()
+        if token:
+            if group_func(token):
                 self.next_token()
                 return token
         raise SyntaxError(f"Unexpected token: {self.current_token()}, expected one of {group_func}")
@@ -180,13 +208,15 @@ class Parser:
             print(token)
 
             print('calling parse_statement')
-            statements.append(self.parse_statement())
+            self.parse_item(statements)
 
-            if self.error > 0:
+            if self.recover:
+                pass    # errors are in self.diagnostics
+            elif self.error > 0:
                 raise Exception(f'Unhandled Error {self.current_token=}, {token=}, {self.match_error}')
-            if self.match_error > 0:
+            elif self.match_error > 0:
                 raise Exception(f'Unhandled Match Error {self.current_token=}, {token=}, {self.match_error}')
-            if self.unresolveable_error > 0:
+            elif self.unresolveable_error > 0:
                 raise Exception(f'Unresolved Error {self.current_token=}, {token=}, {self.unresolveable_error}')
 
             if token == self.current_token():
@@ -203,21 +233,136 @@ class Parser:
         print('len tokens: ', len(self.tokens))
         print('final position: ', self.position)
 
-        return {"type": "Program", "body": statements}
+        return self.build(NodeKind.PROGRAM, statements)
 
 
-    def lookahead(self, target_low, target_high, skip_whitespace=True):
-        temp_pos = self.position
+    def parse_items(self, stop):
+        """
+        Parse top level statements from the current position up to stop.
 
-        while temp_pos < len(self.tokens):
-            token = self.tokens[temp_pos]
+        Returns the statements, and adds their spans to self.spans.
+        """
+        statements = []
+        while self.position < stop:
+            start = self.position
+            self.parse_item(statements)
+            if self.position == start:
+                raise SyntaxError(f"Unexpected token: {self.current_token()} {self.where(start)}")
+        return statements
 
-            if token.ofType == target_low: return -1
-            if token.ofType == target_high: return 1
 
-            temp_pos += 1
+    def parse_item(self, statements):
+        """
+        Parse one top level statement onto statements, and record its span.
+
+        In recover mode a syntax error is recorded instead, and parsing
+        resumes at the start of the next top level item.
+        """
+        start = self.position
+        if not self.recover:
+            statements.append(self.parse_statement())
+            self.spans.append((start, self.position))
+            return
+        depth = self.symbols.depth
+        try:
+            statement = self.parse_statement()
+        except SyntaxError as error:
+            self.resume(error, self.next_item_start(max(self.position, start)))
+            self.symbols.unwind(depth, self.position)
+            return
+        statements.append(statement)
+        self.spans.append((start, self.position))
+
+
+    def next_item_start(self, position):
+        """
+        Where to carry on after a syntax error at position in a top level item.
+
+        That is the start of the next item, or sooner, just after a ; or }
+        followed by what looks like a function's start, `type name (`: an
+        unclosed bracket leaves the jump index one item running on to the
+        end of the file, and that would hide every error after it.
+        """
+        starts = self.jumps.item_starts
+        index = bisect_right(starts, position)
+        stop = starts[index] if index < len(starts) else self.jumps.stop
+        types = self.types
+        while position < stop - 3:
+            if ((types[position] == SEMICOLON or types[position] == RBRACE)
+                    and types[position + 1] == IDENTIFIER and types[position + 2] == IDENTIFIER
+                    and types[position + 3] == LPAREN):
+                return position + 1
+            position += 1
+        return stop
 
-        return None
+
+    def parse_block_item(self, statements):
+        """
+        Parse one statement of a block onto statements.
+
+        In recover mode a syntax error is recorded instead, and parsing
+        resumes after the next ; outside brackets, or at the } closing the
+        block. If the top level item ends before either, the error is
+        raised on for parse_item to skip the whole item.
+        """
+        if not self.recover:
+            statements.append(self.parse_expression_statement())
+            return
+        start = self.position
+        try:
+            statements.append(self.parse_expression_statement())
+            return
+        except SyntaxError as error:
+            failed = error
+        position = max(self.position, start)
+        end = self.jumps.end_of_item(position)
+        stop = len(self.types) if end is None else end + 1
+        types = self.types
+        while position < stop:
+            code = types[position]
+            if code == SEMICOLON:
+                self.resume(failed, position + 1)
+                return
+            if code == RBRACE:
+                self.resume(failed, position)
+                return
+            partner = self.jumps.match_of(position) if code in OPENERS else None
+            position = position + 1 if partner is None else partner + 1
+        raise failed
+
+
+    def resume(self, error, position):
+        """
+        Record error as a Diagnostic and carry on parsing at position.
+        """
+        line, column = self.tokens.location(self.position) or (0, 0)
+        self.diagnostics.append(Diagnostic(self.position, str(error), position, line, column))
+        self.position = position
+
+
+    def lookahead(self, target_low, target_high, skip_whitespace=True):
+        """
+        -1 if target_low comes first from the current position, 1 if
+        target_high does, None if neither is left in the current top level
+        item. Answered from the jump tables, so it costs the same however far
+        away the target is. Stopping at the item end keeps each item's parse
+        down to its own tokens, which incremental reparsing relies on.
+        """
+        end = self.jumps.end_of_item(self.position)
+        return self.jumps.first_of(self.position, TYPE_CODE[target_low], TYPE_CODE[target_high],
+                                   None if end is None else end + 1)
+
+    def matching_bracket(self, position=None):
+        """
+        Position of the bracket paired with the one at position, or None.
+        """
+        return self.jumps.match_of(self.position if position is None else position)
+
+    def item_end(self, position=None):
+        """
+        Position of the last token of the top level item at position, or None.
+        """
+        return self.jumps.end_of_item(self.position if position is None else position)
 
 
     def parse_statement(self):
@@ -226,19 +371,23 @@ class Parser:
 
         token = self.current_token()
 
-        if token.ofType == TokenType.IDENTIFIER:
-
-            lookahead = self.lookahead(TokenType.DELIM_SEMICOLON, TokenType.DELIM_LBRACE)
-
-            if lookahead < 0:
-                print('returning parse_function_declaration')
-                return self.parse_function_declaration()
-            elif lookahead > 0:
-                print('returning parse_function_definition')
-                return self.parse_function_definition()
-            raise SyntaxError(f"Unexpected token: {token.ofType} at position {self.position}")
-        else:
-            raise SyntaxError(f"Unexpected token: {token.ofType} at position {self.position}")
+        if token.ofType == TokenType.KEYWORD_TYPEDEF:
+            return self.parse_typedef()
+        if token.ofType == TokenType.KEYWORD_STRUCT:
+            return self.parse_struct_declaration()
+
+        # `type name (...)` then ; for a declaration or { for a definition,
+        # the ) found through the jump index rather than by scanning for it
+        if token.ofType == TokenType.IDENTIFIER and self.peek(TokenType.IDENTIFIER, 1) and self.peek(TokenType.DELIM_LPAREN, 2):
+            close = self.matching_bracket(self.position + 2)
+            if close is not None:
+                if self.peek(TokenType.DELIM_SEMICOLON, close + 1 - self.position):
+                    print('returning parse_function_declaration')
+                    return self.parse_function_declaration()
+                if self.peek(TokenType.DELIM_LBRACE, close + 1 - self.position):
+                    print('returning parse_function_definition')
+                    return self.parse_function_definition()
+        raise SyntaxError(f"Unexpected token: {token.ofType} {self.where(self.position)}")
 
 
     def parse_function_definition(self):
@@ -252,23 +401,64 @@ class Parser:
         return_type = self.match(TokenType.IDENTIFIER)  # Match the return type
         function_name = self.match(TokenType.IDENTIFIER)  # Match the function name
 
+        self.symbols.declare(function_name.value, SymbolKind.FUNCTION, return_type.value, function_name.Id)
+
         print('returntype set, functionname set, ', self.current_token())
         self.match(TokenType.DELIM_LPAREN)  # Match '('
+        self.symbols.push(self.position)    # The parameters and the body share a scope
         parameters = []
         if self.peek(TokenType.IDENTIFIER):
             parameters = self.parse_parameters()
 
         self.match(TokenType.DELIM_RPAREN)  # Match ')'
         print('parse function definition, after match')
-        body = self.parse_block_statement()  # Parse the function body
+        if self.outline:
+            body = self.skip_body()
+        else:
+            body = self.parse_block_statement(new_scope=False)  # Parse the function body
+        self.symbols.pop(self.position)
 
-        return {
-            "type": "FunctionDefinition",
-            "returnType": return_type.value,
-            "name": function_name.value,
-            "parameters": parameters,
-            "body": body
-        }
+        return self.build(NodeKind.FUNCTION_DEFINITION, return_type.Id, function_name.Id, parameters, body)
+
+
+    def skip_body(self):
+        """
+        Step over a block from its { to the matching }, found through the
+        jump index, and build it as a lazy node for parse_body.
+        """
+        start = self.position
+        self.match(TokenType.DELIM_LBRACE)
+        stop = self.matching_bracket(start)
+        if stop is None:
+            raise SyntaxError(f"Unclosed {{ {self.where(start)}")
+        self.position = stop + 1
+        return self.build(NodeKind.LAZY_BLOCK, start, stop)
+
+    def parse_body(self, start):
+        """
+        Parse the function body whose { is at token start, for a lazy node.
+
+        The parser's position is left where it was, so bodies can be parsed
+        in any order once the outline is done. The function's scope is
+        reopened, parameters and all, and a name counts as a typedef only
+        if it is one where it is used, not as the file ended. A parser that
+        didn't parse the outline itself, as for a packed unit, parses it
+        first for the names declared around the body.
+        """
+        scope = self.symbols.scope_at(start)
+        if scope.parent is None:
+            outline = Parser(self.tokens, jumps=self.jumps, recover=self.recover, outline=True)
+            outline.parse_program()
+            self.symbols = outline.symbols
+            scope = self.symbols.scope_at(start)
+        position, late, depth = self.position, self.late, self.symbols.depth
+        self.position, self.late = start, True
+        self.symbols.reopen(scope)
+        try:
+            return self.parse_block_statement(new_scope=False)
+        finally:
+            self.symbols.unwind(depth, self.position)
+            self.position, self.late = position, late
 
 
     def parse_function_call(self):
@@ -288,11 +478,7 @@ class Parser:
         self.match(TokenType.DELIM_RPAREN)  # Match ')'
         print('parse function call, after match')
 
-        return {
-            "type": "FunctionCall",
-            "name": function_name.value,
-            "parameters": parameters
-        }
+        return self.build(NodeKind.FUNCTION_CALL, function_name.value, None, parameters)
 
     def parse_function_declaration(self):
         """
@@ -302,20 +488,18 @@ class Parser:
         return_type = self.match(TokenType.IDENTIFIER)  # Match the return type
 
         function_name = self.match(TokenType.IDENTIFIER)  # Match the function name
+        self.symbols.declare(function_name.value, SymbolKind.FUNCTION, return_type.value, function_name.Id)
 
         self.match(TokenType.DELIM_LPAREN)  # Match '('
+        self.symbols.push(self.position)    # Parameter names only last to the )
         parameters = []
         if self.peek(TokenType.IDENTIFIER):
             parameters = self.parse_parameters()
         self.match(TokenType.DELIM_RPAREN)  # Match ')'
+        self.symbols.pop(self.position)
         self.match(TokenType.DELIM_SEMICOLON)  # Match ';'
 
-        return {
-            "type": "FunctionDeclaration",
-            "returnType": return_type.value,
-            "name": function_name.value,
-            "parameters": parameters
-        }
+        return self.build(NodeKind.FUNCTION_DECLARATION, return_type.Id, function_name.Id, parameters)
 
 
     def parse_parameter(self):
@@ -325,11 +509,9 @@ class Parser:
         """
         param_type = self.match(TokenType.IDENTIFIER)  # Match parameter type
         param_name = self.match(TokenType.IDENTIFIER)  # Match parameter name
-        return { "type": "Parameter",
-                "paramType": param_type.value,
-                "name": param_name.value}
+        self.symbols.declare(param_name.value, SymbolKind.PARAMETER, param_type.value, param_name.Id)
+        return self.build(NodeKind.PARAMETER, param_type.Id, param_name.Id)
 
-    @debug
     def parse_parameters(self):
         """
         Parse function parameters.
@@ -337,7 +519,8 @@ class Parser:
         """
         parameters = []
         token = None
-        while token != self.current_token() and self.match_error == 0:
+        errors = self.match_error
+        while token != self.current_token() and self.match_error == errors:
             parameters.append(self.parse_parameter())
             token = self.current_token()
             if self.peek(TokenType.DELIM_COMMA):
@@ -348,28 +531,28 @@ class Parser:
         """
         Parse an if statement.
         """
-        self.match(TokenType.KEYWORD_IF.value)
-        self.match(TokenType.DELIM_LPAREN.value)  # Expect '('
+        self.match(TokenType.KEYWORD_IF)
+        self.match(TokenType.DELIM_LPAREN)  # Expect '('
         condition = self.parse_expression()
-        self.match(TokenType.DELIM_RPAREN.value)  # Expect ')'
+        self.match(TokenType.DELIM_RPAREN)  # Expect ')'
         then_block = self.parse_block_statement()
         else_block = None
-        if self.current_token() and self.current_token().ofType == TokenType.KEYWORD_ELSE.value:
-            self.match(TokenType.KEYWORD_ELSE.value)
+        if self.peek(TokenType.KEYWORD_ELSE):
+            self.match(TokenType.KEYWORD_ELSE)
             else_block = self.parse_block_statement()
-        return {"type": "IfStatement", "condition": condition, "then": then_block, "else": else_block}
+        return self.build(NodeKind.IF_STATEMENT, condition, then_block, else_block)
 
 
     def parse_while_statement(self):
         """
         Parse a while statement.
         """
-        self.match(TokenType.KEYWORD_WHILE.value)
-        self.match(TokenType.DELIM_LPAREN.value)
+        self.match(TokenType.KEYWORD_WHILE)
+        self.match(TokenType.DELIM_LPAREN)
         condition = self.parse_expression()
-        self.match(TokenType.DELIM_RPAREN.value)
+        self.match(TokenType.DELIM_RPAREN)
         body = self.parse_block_statement()
-        return {"type": "WhileStatement", "condition": condition, "body": body}
+        return self.build(NodeKind.WHILE_STATEMENT, condition, body)
 
 
     def parse_return_statement(self):
@@ -379,44 +562,54 @@ class Parser:
         self.match(TokenType.KEYWORD_RETURN)
         expression = self.parse_expression()
         self.match(TokenType.DELIM_SEMICOLON)
-        return {"type": "ReturnStatement", "expression": expression}
+        return self.build(NodeKind.RETURN_STATEMENT, expression)
 
 
     def parse_struct_declaration(self):
         """
         Parse a struct declaration.
         """
-        self.match(TokenType.KEYWORD_STRUCT.value)
-        identifier = self.match(TokenType.IDENTIFIER.value)
-        self.match(TokenType.DELIM_LBRACE.value)
+        self.match(TokenType.KEYWORD_STRUCT)
+        identifier = self.match(TokenType.IDENTIFIER)
+        self.symbols.declare_tag(identifier.value, identifier.Id)
+        self.match(TokenType.DELIM_LBRACE)
+        self.symbols.push(self.position)    # Fields aren't ordinary names outside the struct
         fields = []
-        while self.current_token() and self.current_token().ofType != TokenType.DELIM_RBRACE.value:
-            fields.append(self.parse_declaration())
-        self.match(TokenType.DELIM_RBRACE.value)
-        self.match(TokenType.DELIM_SEMICOLON.value)
-        return {"type": "StructDeclaration", "name": identifier['value'], "fields": fields}
+        while self.current_token() and not self.peek(TokenType.DELIM_RBRACE):
+            fields.append(self.parse_declaration(SymbolKind.MEMBER))
+            self.match(TokenType.DELIM_SEMICOLON)
+        self.symbols.pop(self.position)
+        self.match(TokenType.DELIM_RBRACE)
+        self.match(TokenType.DELIM_SEMICOLON)
+        return self.build(NodeKind.STRUCT_DECLARATION, identifier.Id, fields)
 
 
-    def parse_block_statement(self):
+    def parse_block_statement(self, new_scope=True):
         """
         Parse a block statement (enclosed in curly braces).
+
+        The block opens a scope of its own unless new_scope is False, for a
+        function body that shares its parameters' scope.
         """
         print('parse_block_statement: ',  self.current_token())
 
         statements = []
 
         Next = self.match(TokenType.DELIM_LBRACE)
+        if new_scope:
+            self.symbols.push(self.position)
         while Next and not self.peek(TokenType.DELIM_RBRACE):
-            statements.append(self.parse_expression_statement())
+            self.parse_block_item(statements)
 
             if Next == self.current_token():
                 Next = False
                 self.error += 1
 
+        if new_scope:
+            self.symbols.pop(self.position)
         self.match(TokenType.DELIM_RBRACE)
-        return {"type": "BlockStatement", "body": statements}
+        return self.build(NodeKind.BLOCK_STATEMENT, statements)
 
-    @debug
     def parse_expression_statement(self):
         """
         Parse an expression statement.
@@ -424,82 +617,54 @@ class Parser:
         # no more statements
         token = self.current_token()
 
-        if self.peek(TokenType(KEYWORD_RETURN)):
+        if self.peek(TokenType.KEYWORD_RETURN):
             return self.parse_return_statement()
+        if self.peek(TokenType.KEYWORD_TYPEDEF):
+            return self.parse_typedef()
         if self.peek(TokenType.DELIM_RBRACE):
             return
 
-        lookahead = 0
-        if self.lookahead(TokenType.OPERATOR, TokenType.DELIM_LPAREN)
-            if lookahead > 0:
-                return self.parse_function_call()
-            if lookahead < 0:
-                return self.parse_assignment():
-                
+        # A declaration starts `type name` or with a typedef name, a plain
+        # assignment `name =`; anything else is an expression
+        if self.peek(TokenType.IDENTIFIER) and (self.peek(TokenType.IDENTIFIER, 1)
+                                                or self.peek(TokenType.OPERATOR_ASSIGNMENT, 1)
+                                                or self.is_typedef(token.value)):
+            statement = self.parse_assignment()
+            self.match(TokenType.DELIM_SEMICOLON)
+            return self.build(NodeKind.EXPRESSION_STATEMENT, statement)
+
         print('parse_expression_statement: ', self.current_token())
         expression = self.parse_expression()
         self.match(TokenType.DELIM_SEMICOLON)
-        return {"type": "ExpressionStatement", "expression": expression}
+        return self.build(NodeKind.EXPRESSION_STATEMENT, expression)
 
-    @debug
-    def _parse_expression(self):
+    def parse_expression(self):
         """
-        Parse an expression (placeholder for now).
+        Parse an expression, see Expression.parse_expression.
         """
-        token = self.current_token()
-
-        # Return should have been eaten already, leave this for now though for debug
-        if token.ofType == TokenType.KEYWORD:
-            self.unresolveable_error += 1
-            print('error Return call inside expression!!')
-
-        # expressions = []
-        # Next = self.match(TokenType.DELIM_LBRACE)
-        # while Next and not self.peek(TokenType.DELIM_SEMICOLON):
-
-        #     expressions.append(self.parse_expression())
-
-        #     if Next == self.current_token():
-        #         Next = False
-        #         self.error += 1
-
-            # If we return here, we just go back to expression statements, and probably get called again?
-
-        # Lets assume, if it's a function call, the next 2 tokens will be Identifier, open paren, though thats not at all true.
-        # Function Call:
-        tokens = self.scan(1)
-        if tokens[0].ofType == TokenType.IDENTIFIER:
-            if tokens[1].ofType == TokenType.LPAREN:
-                return self.parse_function_call()
-            elif token.ofType == TokenType.IDENTIFIER:
-                return self.parse_declaration()
-            elif token.ofType == BaseType.OPERATOR:
-                return self.parse_expression_left_right()
-
-        # elif token.ofType in [TokenType.IDENTIFIER, TokenType.LITERAL_SPECIAL]:
-            # self.next_token()
-            return {"type": "Literal" if token.ofType == TokenType.LITERAL_SPECIAL else "Identifier", "value": token.value}
-        raise SyntaxError(f"Unexpected token: {token.ofType} at position {self.position}")
+        return Expression.parse_expression(self)
 
 
-    def parse_expression(self):
-
-        
-
-
-
-        token = self.match(TokenType.IDENTIFIER)
-
-        return {"type": "Literal" if token.ofType == TokenType.LITERAL_SPECIAL else "Identifier", "value": token.value}
-
-
-    def binary_operation(self):
+    def is_typedef(self, name):
+        """
+        Whether name is a typedef at the current position.
+        """
+        if self.late:
+            return self.symbols.is_typedef_at(name, self.position)
+        return self.symbols.is_typedef(name)
 
-        l_operand = self.match(TokenType.IDENTIFIER) # Or literal
-        operator = self.match(TokenType.OPERATOR_ARITHMETIC)
-        r_operand = self.match(TokenType.IDENTIFIER) # Or Literal
 
-        return {"type": "BinaryOperation", "left": l_operand, "operator": operator, "right": r_operand}
+    def parse_typedef(self):
+        """
+        Parse a typedef, making its name a type for the rest of the scope.
+        Example: `typedef myint length;`
+        """
+        self.match(TokenType.KEYWORD_TYPEDEF)
+        type_token = self.match(TokenType.IDENTIFIER)
+        name = self.match(TokenType.IDENTIFIER)
+        self.match(TokenType.DELIM_SEMICOLON)
+        self.symbols.declare(name.value, SymbolKind.TYPEDEF, type_token.value, name.Id)
+        return self.build(NodeKind.TYPEDEF_DECLARATION, type_token.Id, name.Id)
 
 
     def parse_assignment(self):
@@ -510,25 +675,30 @@ class Parser:
         if self.peek(TokenType.DELIM_SEMICOLON, 1):
             return self.parse_declaration()
         variable = self.parse_declaration()
+        if self.peek(TokenType.DELIM_SEMICOLON):
+            return variable # declared without a value
         operator = self.match(TokenType.OPERATOR_ASSIGNMENT)
+        value = self.parse_expression()
 
-        return {"type": "variable": declaration, "operator": identifier['value']}
+        return self.build(NodeKind.ASSIGNMENT, variable, operator.value, value)
 
-    def parse_declaration(self):
+    def parse_declaration(self, kind=SymbolKind.VARIABLE):
         """
-        Parse a variable declaration (e.g., int x;).
+        Parse a variable declaration (e.g., int x;), recorded as a symbol of kind.
         """
-        # Check if this is actually a declaration
-        if self.peek(TokenType.IDENTIFIER, 1):
+        # Check if this is actually a declaration, a typedef name always starts one
+        if self.peek(TokenType.IDENTIFIER, 1) or (self.peek(TokenType.IDENTIFIER)
+                                                  and self.is_typedef(self.tokens.value(self.position))):
             type_token = self.match(TokenType.IDENTIFIER)  # Extend for other types
             identifier = self.match(TokenType.IDENTIFIER)
+            self.symbols.declare(identifier.value, kind, type_token.value, identifier.Id)
 
-            return {"type": "Declaration", "varType": type_token, "name": identifier}
+            return self.build(NodeKind.DECLARATION, type_token.Id, identifier.Id)
         # This is not a declaration, return the identifier
         else:
-            identifier = self.match(TokenType.IDENTIFIER):
+            identifier = self.match(TokenType.IDENTIFIER)
 
-            return {"type": "Assignment", "varType": type_token, "name": identifier}
+            return self.build(NodeKind.TARGET, None, identifier.Id)
 
 
 
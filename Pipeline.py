@@ -0,0 +1,183 @@
+# Pipeline.py
+# asyncio front end that overlaps file reads with lexing and parsing
+# Run directly: python Pipeline.py src/ 'include/**/*.h' --reads 32 -j 8
+# Reads run concurrently up to a limit while earlier files are lexed and
+# parsed on an executor, so a slow filesystem doesn't leave the CPUs idle.
+# A bounded queue between the stages holds reads back when parsing lags.
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import sys
+import time
+
+from Batch import FileResult, collect_files, process_source, summarize, print_summary
+
+
+# Reads in flight at once
+DEFAULT_MAX_READS = 16
+
+# Sources read and waiting to be lexed, and results waiting to be taken
+DEFAULT_QUEUE_SIZE = 32
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class DelayedReader:
+    """
+    A reader that waits delay seconds before each read, standing in for a
+    slow network filesystem. The wait doesn't block the event loop, so as
+    many of them overlap as the pipeline lets run.
+    """
+    def __init__(self, delay, read=read_bytes):
+        self.delay = delay
+        self.read = read
+        self.reads = 0
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def __call__(self, path):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            self.reads += 1
+            return self.read(path)
+        finally:
+            self.in_flight -= 1
+
+
+async def pipeline(paths, reader=None, max_reads=DEFAULT_MAX_READS, queue_size=DEFAULT_QUEUE_SIZE,
+                   executor=None, workers=None, parse=True):
+    """
+    Read, tokenize and optionally parse paths, yielding a FileResult per
+    path as each is done, in the order they finish.
+
+    reader is an async callable from a path to its content; by default
+    files are read on a thread pool of max_reads threads. At most
+    max_reads reads are in flight, and at most queue_size read sources wait
+    for the executor. Lexing and parsing run on executor, by default a
+    ProcessPoolExecutor of workers processes shut down at the end. A file
+    that can't be read is yielded with its error set, like one that fails
+    to parse.
+    """
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    read_pool = None
+    if reader is None:
+        read_pool = ThreadPoolExecutor(max_workers=max_reads)
+        async def reader(path):
+            return await loop.run_in_executor(read_pool, read_bytes, path)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    sources = asyncio.Queue(queue_size)
+    results = asyncio.Queue(queue_size)
+    slots = asyncio.Semaphore(max_reads)
+
+    async def read(path):
+        # The slot is held until the source is queued, so a full queue stops new reads
+        try:
+            try:
+                await sources.put((path, await reader(path), None))
+            except OSError as error:
+                await sources.put((path, None, f'{type(error).__name__}: {error}'))
+        finally:
+            slots.release()
+
+    async def feed():
+        reads = []
+        try:
+            for path in paths:
+                await slots.acquire()
+                reads.append(asyncio.create_task(read(path)))
+            await asyncio.gather(*reads)
+        finally:
+            for task in reads:
+                task.cancel()
+        for _ in range(workers):
+            await sources.put(None)
+
+    async def work():
+        while True:
+            item = await sources.get()
+            if item is None:
+                return
+            path, content, error = item
+            if error is not None:
+                result = FileResult(path, error=error)
+            else:
+                result = await loop.run_in_executor(executor, process_source, path, content, parse)
+            await results.put(result)
+
+    async def run():
+        # One stage failing, say a broken process pool, stops the others
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(work()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    runner = asyncio.create_task(run())
+    try:
+        while True:
+            getter = asyncio.ensure_future(results.get())
+            await asyncio.wait((getter, runner), return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            yield getter.result()
+        while not results.empty():
+            yield results.get_nowait()
+        await runner    # raises whatever stopped it early
+    finally:
+        if not runner.done():
+            runner.cancel()
+        if own_executor:
+            executor.shutdown(wait=runner.done(), cancel_futures=True)
+        if read_pool is not None:
+            read_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_pipeline(paths, **options):
+    """
+    pipeline over paths run to the end; a FileResult per path, in the order they finished.
+    """
+    async def collect():
+        return [result async for result in pipeline(paths, **options)]
+    return asyncio.run(collect())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Read, tokenize and parse c sources, reads overlapped with parsing.')
+    parser.add_argument('patterns', nargs='+', help='directories or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: cpu count)')
+    parser.add_argument('--reads', type=int, default=DEFAULT_MAX_READS, help='reads in flight at once')
+    parser.add_argument('--queue', type=int, default=DEFAULT_QUEUE_SIZE, help='read sources waiting to be parsed')
+    parser.add_argument('--delay', type=float, default=None, help='wait this long before each read, to try out a slow filesystem')
+    parser.add_argument('--no-parse', action='store_true', help='only tokenize')
+    args = parser.parse_args(argv)
+
+    paths = collect_files(args.patterns)
+    reader = DelayedReader(args.delay) if args.delay is not None else None
+    async def run():
+        results = []
+        async for result in pipeline(paths, reader, args.reads, args.queue, workers=args.workers, parse=not args.no_parse):
+            if not result.ok:
+                print(f'{result.path}: {result.error}')
+            results.append(result)
+        return results
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    print_summary(summarize(results, time.perf_counter() - start))
+    return 1 if any(not result.ok for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+# Symbols.py
+# Scoped symbol table the parser records declarations in
+# Lookups go through one dict from each name to its bindings, innermost
+# last, so what a name means is found in one step however deep the scopes
+# nest. Closed scopes are kept, each with its own dict, for tools to query
+# what was visible where once the parse is done.
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from enum import Enum
+
+
+class SymbolKind(Enum):
+    VARIABLE  = 'variable'
+    PARAMETER = 'parameter'
+    FUNCTION  = 'function'
+    TYPEDEF   = 'typedef'
+    MEMBER    = 'member'    # A struct field, only visible in the struct's own scope
+    STRUCT    = 'struct'    # A struct tag, kept apart from ordinary names as c does
+
+
+@dataclass
+class Symbol:
+    name: str = None
+    kind: SymbolKind = None
+    type: str = None        # Text of the declared type, None for a struct tag
+    position: int = 0       # Token index of the name where it was declared
+    scope: int = 0          # Index of the declaring Scope in SymbolTable.scopes
+
+
+@dataclass
+class Scope:
+    index: int = 0
+    parent: int = None      # Index of the enclosing Scope, None for file scope
+    depth: int = 0
+    start: int = 0          # First token inside the scope
+    stop: int = None        # Token after the scope, None while it is open
+    names: dict = field(default_factory=dict)   # name -> Symbol declared here
+    tags: dict = field(default_factory=dict)    # struct tag -> Symbol declared here
+
+
+class SymbolTable:
+    """
+    Scopes pushed and popped as blocks open and close, and the names
+    declared in them.
+
+    While parsing, lookup and lookup_tag answer for the innermost binding
+    of a name with a single dict access. Afterwards every scope is still in
+    scopes, and lookup_at answers for any token position by walking the
+    chain of scope dicts outwards from there.
+    """
+    def __init__(self, stop=None):
+        self.scopes = [Scope(0, None, 0, 0, stop)]
+        self.current = self.scopes[0]
+        self._names = {}    # name -> [Symbol], innermost last
+        self._tags = {}
+        self._starts = [0]  # start of each scope, sorted; a lazily parsed body opens its scope late
+        self._order = [0]   # index of the scope at each of _starts
+
+
+    @property
+    def depth(self):
+        return self.current.depth
+
+
+    def push(self, position):
+        """
+        Open a scope starting at token position, inside the current one.
+        """
+        scope = Scope(len(self.scopes), self.current.index, self.current.depth + 1, position)
+        self.scopes.append(scope)
+        at = bisect_right(self._starts, position)
+        self._starts.insert(at, position)
+        self._order.insert(at, scope.index)
+        self.current = scope
+        return scope
+
+    def pop(self, position):
+        """
+        Close the current scope at token position, unbinding its names.
+        """
+        scope = self.current
+        if scope.parent is None:
+            raise SyntaxError(f'Scope closed at position {position} with none open')
+        for bindings, declared in ((self._names, scope.names), (self._tags, scope.tags)):
+            for name in declared:
+                stack = bindings[name]
+                stack.pop()
+                if not stack:
+                    del bindings[name]
+        scope.stop = position
+        self.current = self.scopes[scope.parent]
+        return scope
+
+    def reopen(self, scope):
+        """
+        Make a closed scope current again, its names bound as they were, so
+        declarations carry on into it; pop closes it again. For a function
+        body parsed after the rest of the file.
+        """
+        for bindings, declared in ((self._names, scope.names), (self._tags, scope.tags)):
+            for name, symbol in declared.items():
+                bindings.setdefault(name, []).append(symbol)
+        self.current = scope
+        return scope
+
+    def unwind(self, depth, position):
+        """
+        Close scopes until depth is reached, e.g. after a syntax error left some open.
+        """
+        while self.current.depth > depth:
+            self.pop(position)
+
+
+    def declare(self, name, kind, type=None, position=0):
+        """
+        Bind name in the current scope. A name declared again in the same
+        scope, as a prototype followed by its definition, is rebound.
+        """
+        return self._bind(self._names, self.current.names, Symbol(name, kind, type, position, self.current.index))
+
+    def declare_tag(self, name, position=0):
+        return self._bind(self._tags, self.current.tags, Symbol(name, SymbolKind.STRUCT, None, position, self.current.index))
+
+    def _bind(self, bindings, declared, symbol):
+        stack = bindings.setdefault(symbol.name, [])
+        if symbol.name in declared:
+            stack[-1] = symbol
+        else:
+            stack.append(symbol)
+        declared[symbol.name] = symbol
+        return symbol
+
+
+    def lookup(self, name):
+        """
+        The innermost Symbol bound to name in the open scopes, or None.
+        """
+        stack = self._names.get(name)
+        return stack[-1] if stack else None
+
+    def lookup_tag(self, name):
+        stack = self._tags.get(name)
+        return stack[-1] if stack else None
+
+    def is_typedef(self, name):
+        stack = self._names.get(name)
+        return bool(stack) and stack[-1].kind is SymbolKind.TYPEDEF
+
+
+    def is_typedef_at(self, name, position):
+        """
+        Whether name is a typedef at token position, whatever was declared after it.
+        """
+        symbol = self.lookup_at(name, position)
+        return symbol is not None and symbol.kind is SymbolKind.TYPEDEF
+
+
+    def scope_at(self, position):
+        """
+        The innermost Scope that token position is inside.
+        """
+        index = bisect_right(self._starts, position) - 1
+        scope = self.scopes[self._order[max(index, 0)]]
+        while scope.parent is not None and not (scope.start <= position and (scope.stop is None or position < scope.stop)):
+            scope = self.scopes[scope.parent]
+        return scope
+
+    def lookup_at(self, name, position, tag=False):
+        """
+        The Symbol name meant at token position, or None; a struct tag if tag is set.
+
+        Only declarations made before position count, as in c.
+        """
+        scope = self.scope_at(position)
+        while scope is not None:
+            symbol = (scope.tags if tag else scope.names).get(name)
+            if symbol is not None and symbol.position < position:
+                return symbol
+            scope = None if scope.parent is None else self.scopes[scope.parent]
+        return None
+
+    def symbols(self):
+        """
+        Every Symbol declared, scope by scope.
+        """
+        for scope in self.scopes:
+            yield from scope.tags.values()
+            yield from scope.names.values()
@@ -0,0 +1,213 @@
+# TokenTable.py
+# Struct-of-arrays token storage
+# Each token is a row across parallel array columns: base code, type code and
+# start/end offsets into the source. No per token objects are kept around.
+# Lines and columns aren't stored; they come from a table of line starts
+# built the first time one is asked for.
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+import re
+
+from TokenType import TokenType, TokenBase
+
+
+# Column codes, 0 is reserved for "not set"
+BASES = (None,) + tuple(TokenBase)
+TYPES = (None,) + tuple(TokenType)
+BASE_CODE = {base: code for code, base in enumerate(BASES)}
+TYPE_CODE = {ofType: code for code, ofType in enumerate(TYPES)}
+
+# Offsets are stored as signed 64 bit integers
+OFFSET_TYPECODE = 'q'
+
+NEWLINE = re.compile(b'\n')
+
+
+def line_starts(source):
+    """
+    array of the offset each line of source starts at, the first line's 0.
+    """
+    if isinstance(source, (str, bytes)):
+        # Split and sum the lengths, which leaves the newline search to C
+        newline = '\n' if isinstance(source, str) else b'\n'
+        starts = array(OFFSET_TYPECODE, accumulate((len(line) + 1 for line in source.split(newline)), initial=0))
+        starts.pop()
+        return starts
+    # A mapped file, searched in place rather than copied out
+    starts = array(OFFSET_TYPECODE, [0])
+    starts.extend(match.end() for match in NEWLINE.finditer(source))
+    return starts
+
+
+class TokenView:
+    """
+    A per token proxy into a TokenTable, for code that wants token.ofType style access.
+
+    Views are created on demand and only hold the table and the row index,
+    which doubles as the token Id.
+    """
+    __slots__ = ('_table', 'Id')
+
+    def __init__(self, table, index):
+        self._table = table
+        self.Id = index
+
+    @property
+    def base(self):
+        return BASES[self._table.bases[self.Id]]
+
+    @property
+    def ofType(self):
+        return TYPES[self._table.types[self.Id]]
+
+    @property
+    def start(self):
+        return self._table.starts[self.Id]
+
+    @property
+    def end(self):
+        return self._table.ends[self.Id]
+
+    @property
+    def value(self):
+        return self._table.value(self.Id)
+
+    @property
+    def line(self):
+        location = self._table.location(self.Id)
+        return None if location is None else location[0]
+
+    @property
+    def column(self):
+        location = self._table.location(self.Id)
+        return None if location is None else location[1]
+
+    def __eq__(self, other):
+        if isinstance(other, TokenView):
+            return self._table is other._table and self.Id == other.Id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((id(self._table), self.Id))
+
+    def __repr__(self):
+        return f'TokenView({self.Id}, {self.base}, {self.ofType}, {self.value!r})'
+
+    def __str__(self):
+        if self.ofType:
+            return f'{self.Id:3} {self.base:18} {self.ofType:18} {self.value:18}'
+        else:
+            return f'{self.Id:3} {self.base:18}{" "*18}{self.value:18}'
+
+
+class TokenTable:
+    """
+    Tokens of a single source, stored column-wise.
+
+    source is the text the offsets point into. It may be a str, bytes or a
+    mapped file; bytes are decoded only when a token's value is read.
+
+    location gives the line and column of a token. The line starts it
+    bisects are found on the first call, so lexing never pays for them.
+    located is False when the offsets point into a stand-in for the real
+    source, see from_tokens, and there are no lines or columns to give.
+    """
+    def __init__(self, source='', encoding='utf-8'):
+        self.source = source
+        self.encoding = encoding
+        self.bases = array('B')
+        self.types = array('B')
+        self.starts = array(OFFSET_TYPECODE)
+        self.ends = array(OFFSET_TYPECODE)
+        self._line_starts = None
+        self.located = True
+
+    @classmethod
+    def from_tokens(cls, tokens, source=None):
+        """
+        Build a table from Token objects, e.g. the output of tokenize_stream.
+
+        With source, the text the tokens were lexed from, their own start
+        and end offsets are kept and point into it. Without, token values
+        are packed into a fresh source string, one space apart, and the
+        offsets point into that string; the table then isn't located.
+        """
+        if source is not None:
+            table = cls(source)
+            for token in tokens:
+                table.append(token.base, token.ofType or None, token.start, token.end)
+            return table
+        table = cls()
+        table.located = False
+        parts = []
+        offset = 0
+        for token in tokens:
+            value = token.value
+            table.append(token.base, token.ofType or None, offset, offset + len(value))
+            parts.append(value)
+            offset += len(value) + 1
+        table.source = ' '.join(parts)
+        return table
+
+    def append(self, base, ofType, start, end):
+        self.bases.append(BASE_CODE[base])
+        self.types.append(TYPE_CODE[ofType])
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def value(self, index):
+        text = self.source[self.starts[index]:self.ends[index]]
+        if isinstance(text, str):
+            return text
+        return text.decode(self.encoding)
+
+    @property
+    def line_starts(self):
+        if self._line_starts is None:
+            self._line_starts = line_starts(self.source)
+        return self._line_starts
+
+    def offset_location(self, offset):
+        """
+        (line, column) of offset into source, both from 1, or None if the
+        table isn't located. Columns count characters of a str source and
+        bytes of the others.
+        """
+        if not self.located:
+            return None
+        starts = self.line_starts
+        line = bisect_right(starts, offset)
+        return line, offset - starts[line - 1] + 1
+
+    def location(self, index):
+        """
+        (line, column) of where token index starts, both from 1, or None if
+        the table isn't located. An index past the last token is the end of
+        the source, where a parse that ran out of tokens stopped.
+        """
+        if index < len(self.starts):
+            return self.offset_location(self.starts[index])
+        return self.offset_location(len(self.source))
+
+    def __len__(self):
+        return len(self.bases)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.bases)
+        if not 0 <= index < len(self.bases):
+            raise IndexError('token index out of range')
+        return TokenView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.bases)):
+            yield TokenView(self, index)
+
+    def __getstate__(self):
+        # A mapped file can't be pickled, ship its bytes instead
+        state = self.__dict__.copy()
+        state['_line_starts'] = None    # Cheaper to find again than to ship
+        if not isinstance(self.source, (str, bytes)):
+            state['source'] = bytes(self.source)
+        return state
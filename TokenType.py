@@ -11,6 +11,7 @@ class TokenBase(Enum):
     KEYWORD     = 'keyword'
     OPERATOR    = 'operator'
     DELIM       = 'delim'
+    ERROR       = 'error'
 
 
 
@@ -35,6 +36,8 @@ class TokenType(Enum):
     KEYWORD_TYPEDEF  = 'keyword_typedef'
     KEYWORD_CONST    = 'keyword_const'
     KEYWORD_STATIC   = 'keyword_static'
+    KEYWORD_UNION    = 'keyword_union'
+    KEYWORD_SIZEOF   = 'keyword_sizeof'
     IDENTIFIER       = 'identifier'
     LITERAL_SPECIAL  = 'literal_special'
     LITERAL_INT      = 'literal_int'
@@ -58,6 +61,7 @@ class TokenType(Enum):
     DELIM_RBRACKET   = 'delim_rbracket'
     DELIM_SEMICOLON  = 'delim_semicolon'
     DELIM_COMMA      = 'delim_comma'
+    DELIM_DOT        = 'delim_dot'
 
     @classmethod
     def from_value(cls, value):
@@ -128,10 +132,10 @@ class Delimiters:
     _mapping = {
         '(': 'delim_lparen',
         ')': 'delim_rparen',
-        '[': 'delim_lbrace',
-        ']': 'delim_rbrace',
-        '{': 'delim_lcurly',
-        '}': 'delim_rcurly',
+        '[': 'delim_lbracket',
+        ']': 'delim_rbracket',
+        '{': 'delim_lbrace',
+        '}': 'delim_rbrace',
         ';': "delim_semicolon",
         '.': "delim_dot",
         ',': "delim_comma"
@@ -3,13 +3,16 @@
 # Jan 11, 2025 Updated, some cleanup and data veriification
 # This file is still in the very early stages of development
 # Break a simple c.source code file into tokens
-from dataclasses import dataclass, field
-from typing import Dict
+from dataclasses import dataclass
+import mmap
+import os
 import re
 
 
 from TokenType import TokenType, Delimiters, Keywords, Operators
 from TokenType import TokenBase
+from TokenTable import TokenTable
+import DfaScanner
 # from Parser import Parser
 
 
@@ -17,46 +20,58 @@ from TokenType import TokenBase
 # C Source code file
 TEST_FILE = 'j:/compiler/c_files/memmgr.c'
 
-def main():
-
-    # Load our test c source
-    code = load_code(TEST_FILE)
-
-    # Build Very Large Regex
-    pattern = build_regex()
+# Encoding used when decoding tokens out of a mapped source
+SOURCE_ENCODING = 'utf-8'
+
+# Number of characters read per chunk by tokenize_stream
+CHUNK_SIZE = 1 << 16
+
+# Lexer backends accepted by tokenize, see DfaScanner
+BACKEND_REGEX = 'regex'
+BACKEND_DFA = 'dfa'
+DEFAULT_BACKEND = BACKEND_REGEX
+
+# Capture group of build_regex for comments and literals that never close
+GROUP_UNTERMINATED = 8
+
+# Token text -> (base, ofType), for the groups where the text decides the type
+WORD_TYPES = {word: (TokenBase.KEYWORD, TokenType(name)) for word, name in Keywords._mapping.items()}
+OPERATOR_TYPES = {symbol: (TokenBase.OPERATOR, TokenType(name)) for symbol, name in Operators._mapping.items()}
+DELIM_TYPES = {symbol: (TokenBase.DELIM, TokenType(name)) for symbol, name in Delimiters._mapping.items()}
+
+# Indexed by match.lastindex, each entry is (lookup, default).
+# lookup maps the token text to (base, ofType), default covers everything else.
+GROUP_DISPATCH = (
+    None,
+    (None, (TokenBase.COMMENT_ML, TokenType.COMMENT_ML)),
+    (None, (TokenBase.COMMENT_SL, TokenType.COMMENT_SL)),
+    (None, (TokenBase.PREPROCESSOR, TokenType.PREPROCESSOR)),
+    (None, (TokenBase.LITERAL, TokenType.LITERAL_FLOAT)),
+    (None, (TokenBase.LITERAL, TokenType.LITERAL_INT)),
+    (None, (TokenBase.LITERAL, TokenType.LITERAL_STRING)),
+    (None, (TokenBase.LITERAL, TokenType.LITERAL_CHAR)),
+    (None, (TokenBase.ERROR, TokenType.ERROR)),
+    (None, (TokenBase.LITERAL, TokenType.LITERAL_SPECIAL)),
+    (WORD_TYPES, (TokenBase.IDENTIFIER, TokenType.IDENTIFIER)),
+    (OPERATOR_TYPES, (TokenBase.OPERATOR, None)),
+    (DELIM_TYPES, (TokenBase.DELIM, None)),
+)
+
+# Same table, keyed by bytes for build_regex_bytes matches
+GROUP_DISPATCH_BYTES = tuple(
+    entry if entry is None or entry[0] is None
+    else ({text.encode('ascii'): types for text, types in entry[0].items()}, entry[1])
+    for entry in GROUP_DISPATCH)
 
-    # Perform regex on entire file
-    match = re.findall(pattern, code, re.DOTALL)
+def main():
 
-    # Based on our regex, these groups will be filled in with their appropriate members
-    match_index_to_base = {
-    0: TokenBase.COMMENT_ML, 1: TokenBase.COMMENT_SL, 2: TokenBase.PREPROCESSOR,
-    5: TokenBase.LITERAL, 6: TokenBase.WORD,
-    7: TokenBase.OPERATOR, 8: TokenBase.DELIM}
-
-    # Build a list of all tokens
-    tokens = []
-    key_gen = get_next_key()
-    for e in match:
-        for k, v in match_index_to_base.items():
-            token = {}
-            if e[k]:
-                assert(token == {}) # Error multiple matches
-                token = Token()
-                token.Id = next(key_gen)
-                token.base = v
-                token.value = e[k]
-            if token:
-                tokens.append(token)
+    # Stream classified tokens straight from the test c source
+    tokens = list(tokenize_stream(TEST_FILE))
 
     # debug print
     for e in tokens:
         print(e)
 
-    # Modifies and prints token data
-    # Modification is in place, thus no return.
-    modify_tokens_add_ofType_data(tokens)
-
 
     # parser = Parser(tokens)
     # ast = parser.parse()
@@ -72,10 +87,12 @@ def get_next_key():
 
 @dataclass
 class Token:
-    Id: Dict = field(default_factory=dict)   # Unique identifier for the token
-    base: Dict = field(default_factory=dict) # Token base e.g.
-    ofType: Dict = field(default_factory=dict) # Specific type (e.g., Keywords)
-    value: Dict = field(default_factory=dict) # Value of the token (e.g., 'int')
+    Id: int = None          # Unique identifier for the token
+    base: TokenBase = None  # Token base e.g.
+    ofType: TokenType = None # Specific type (e.g., Keywords)
+    value: str = None       # Value of the token (e.g., 'int')
+    start: int = None       # Offsets of the token in the source, in characters
+    end: int = None
 
     def __str__(self):
         if self.ofType:
@@ -83,47 +100,36 @@ class Token:
         else:
             return f'{self.Id:3} {self.base:18}{" "*18}{self.value:18}'
 
-def modify_tokens_add_ofType_data(tokens):
-
-    print('DELIMS:')
-    tokens_sublist = [x for x in tokens if x.base == TokenBase.DELIM]
-    for token in tokens_sublist:
-        if Delimiters.to_name(token.value):
-            token.ofType = Delimiters.to_name(token.value)
-            print(token)
-
-    print('KEYWORDS:')
-    tokens_sublist = [x for x in tokens if x.base == TokenBase.WORD]
-    for token in tokens_sublist:
-        if token.value in Keywords._mapping:
-            token.base = TokenBase.KEYWORD
-            token.ofType = Keywords.to_name(token.value)
-            print(token)
-
-    print('IDENTIFIERS:')
-    tokens_sublist = [x for x in tokens_sublist if x.base == TokenBase.WORD]
-    for token in tokens_sublist:
-        token.base = TokenBase.IDENTIFIER
-        print(token)
-
-    print('LITERALS:')
-    tokens_sublist = [x for x in tokens if x.base == TokenBase.LITERAL]
-    for token in tokens_sublist:
-        print(token)
-
-    print('OPERATORS:')
-    tokens_sublist = [x for x in tokens if x.base == TokenBase.OPERATOR]
-    for token in tokens_sublist:
-        if token.value in Operators._mapping:
-            token.ofType = Operators.to_name(token.value)
-            print(token)
-
-    print('UNRECOGNIZED OPERATORS:')
-    for token in tokens_sublist:
-        if token.ofType == None:
-            print(token)
-    else:
-        print('NONE!')
+class MappedToken:
+    """
+    A token that points into a mapped source buffer instead of holding a copy.
+
+    start and end are byte offsets into the buffer; value is only decoded
+    when it is read.
+    """
+    __slots__ = ('Id', 'base', 'ofType', 'start', 'end', '_buffer')
+
+    def __init__(self, Id, base, ofType, start, end, buffer):
+        self.Id = Id
+        self.base = base
+        self.ofType = ofType
+        self.start = start
+        self.end = end
+        self._buffer = buffer
+
+    @property
+    def value(self):
+        return self._buffer[self.start:self.end].decode(SOURCE_ENCODING)
+
+    __str__ = Token.__str__
+
+# Resolve (base, ofType) for a build_regex match in one dispatch on match.lastindex
+def classify_match(match, dispatch=GROUP_DISPATCH):
+    group = match.lastindex
+    lookup, default = dispatch[group]
+    if lookup is None:
+        return default
+    return lookup.get(match.group(group), default)
 
 
 # Import the c.source code, join all lines
@@ -134,22 +140,171 @@ def load_code(c_file):
     return ''.join([line for line in lines])
 
 
+def tokenize(code, backend=DEFAULT_BACKEND):
+    """
+    Tokenize a whole c source into a TokenTable.
+
+    code may be text, bytes or a mapped file from load_code_mmap. The table
+    only records offsets into code, no token objects or value copies are made.
+    backend picks the lexer, BACKEND_REGEX or BACKEND_DFA; both produce the
+    same tokens.
+    """
+    if isinstance(code, str):
+        pattern, dispatch = re.compile(build_regex(), re.DOTALL), GROUP_DISPATCH
+    else:
+        pattern, dispatch = re.compile(build_regex_bytes(), re.DOTALL), GROUP_DISPATCH_BYTES
+    table = TokenTable(code, SOURCE_ENCODING)
+    append = table.append
+
+    if backend == BACKEND_DFA:
+        for group, start, end in DfaScanner.scan(code):
+            lookup, default = dispatch[group]
+            base, ofType = default if lookup is None else lookup.get(code[start:end], default)
+            append(base, ofType, start, end)
+        return table
+    if backend != BACKEND_REGEX:
+        raise ValueError(f"Unknown lexer backend: {backend}")
+
+    # classify_match, inlined as this is the hot loop
+    for match in pattern.finditer(code):
+        group = match.lastindex
+        lookup, default = dispatch[group]
+        base, ofType = default if lookup is None else lookup.get(match.group(group), default)
+        append(base, ofType, match.start(group), match.end(group))
+
+    return table
+
+
+# Map the c.source code into memory, nothing is read or copied up front
+def load_code_mmap(c_file):
+    with open(c_file, 'rb') as file:
+        # mmap refuses empty files
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def tokenize_mapped(c_file):
+    """
+    Yield classified tokens from a memory-mapped c source.
+
+    Matching runs over the raw bytes with build_regex_bytes, and each token
+    only records its offsets into the mapping. Classification looks the raw
+    bytes up directly, so nothing is decoded until a value is read.
+    """
+    buffer = load_code_mmap(c_file)
+    pattern = re.compile(build_regex_bytes(), re.DOTALL)
+    key_gen = get_next_key()
+
+    for match in pattern.finditer(buffer):
+        base, ofType = classify_match(match, GROUP_DISPATCH_BYTES)
+        yield MappedToken(next(key_gen), base, ofType, match.start(), match.end(), buffer)
+
+
+def tokenize_stream(source, chunk_size=CHUNK_SIZE):
+    """
+    Yield classified tokens from a c source, one at a time.
+
+    source is either a file name or an open text file. The input is read
+    chunk_size characters at a time, so memory stays flat regardless of the
+    file size. Each token carries its start and end offsets in the whole
+    source. A token that could still change once more input arrives is
+    held back until the next chunk, so comments, strings and directives
+    spanning a chunk boundary come out whole. While a single token holds up
+    the whole buffer the read size doubles, which keeps rescanning a huge
+    token linear overall.
+    """
+    if isinstance(source, str):
+        with open(source, 'r') as file:
+            yield from tokenize_stream(file, chunk_size)
+        return
+
+    pattern = re.compile(build_regex(), re.DOTALL)
+    key_gen = get_next_key()
+
+    buffer = ''
+    consumed = 0    # Characters of the source dropped from the front of buffer
+    read_size = chunk_size
+    eof = False
+    while not eof:
+        chunk = source.read(read_size)
+        eof = not chunk
+        buffer += chunk
+
+        # Everything before pos has been emitted
+        pos = 0
+        for match in pattern.finditer(buffer):
+            if not eof and not _match_is_settled(buffer, pos, match):
+                break
+            pos = match.end()
+
+            base, ofType = classify_match(match)
+            yield Token(next(key_gen), base, ofType, match.group(), consumed + match.start(), consumed + pos)
+
+        read_size = read_size * 2 if pos == 0 else chunk_size
+        buffer = buffer[pos:]
+        consumed += pos
+
+
+_NON_BLANK = re.compile(r"[^ \t]")
+
+# A string or char literal up to where its closing quote would be
+_OPEN_LITERAL = {
+    '"': re.compile(r"\"[^\"\\\n]*(?:\\.[^\"\\\n]*)*", re.DOTALL),
+    "'": re.compile(r"\'[^\'\\\n]*(?:\\.[^\'\\\n]*)*", re.DOTALL)}
+
+# A match taken from a partial buffer is only final if reading further could
+# not extend it, or turn the skipped text before it into a token of its own.
+def _match_is_settled(buffer, pos, match):
+    start = match.start()
+
+    # Identifiers, numbers, operators and line comments may keep going, and
+    # a number like 0b1 needs one character past its shorter match
+    if match.end() + 1 >= len(buffer):
+        return False
+
+    # An unterminated literal cut short by the buffer, e.g. after an escaped
+    # line break, may still close
+    if match.lastindex == GROUP_UNTERMINATED and buffer[start] in _OPEN_LITERAL:
+        if _OPEN_LITERAL[buffer[start]].match(buffer, start).end() + 1 >= len(buffer):
+            return False
+
+    # A skipped '#' only followed by blanks so far may still get its directive name
+    hash_at = buffer.find('#', pos, start)
+    if hash_at != -1 and _NON_BLANK.search(buffer, hash_at + 1) is None:
+        return False
+
+    return True
+
+
 # Build a regex that captures all tokens
 def build_regex():
 
-    ml_comment = r"/\*(?:[^\*]|\*[^\/])*\*/" # multiline comment
+    # Every branch either fails within a bounded look past its first
+    # character, or runs to a delimiter it cannot backtrack over, so no input
+    # costs more than linear time. Comments, strings and char literals that
+    # never close become an unterminated token instead of failing and being
+    # rescanned from every later position.
+    ml_comment = r"/\*[^\*]*\*+(?:[^\/\*][^\*]*\*+)*/" # multiline comment, ends at the first */
     comment = r"//[^\n]*"
-    directives = r"\s*\#\s*(?:\w+)\b(?:[ \t]+(?:[^\n]*))?"
-    numeric_literal = r"(?:0b)?[\d][.\d]?[\d]*"
-    string_literal = r"\"(?:[^\"\\]|\\.)*\""
-    char_literal = r"\'(?:[^\'\\]|\\.)*\'"
+    directives = r"\#[ \t]*\w+[^\n]*"
+    float_literal = r"(?:0b)?[\d]\.[\d]*"
+    int_literal = r"(?:0b)?[\d]+"
+    string_literal = r"\"[^\"\\\n]*(?:\\.[^\"\\\n]*)*\""
+    char_literal = r"\'[^\'\\\n]*(?:\\.[^\'\\\n]*)*\'"
+    unterminated = r"/\*.*|\"[^\n]*|\'[^\n]*"
     bool_literal = r"true|false"
-    identifier = r"[a-zA-Z_]+[a-zA-Z_\d]*"
+    identifier = r"[a-zA-Z_][a-zA-Z_\d]*"
     operators = r"[\+\-\*\/\%\=\!\<\>\&\|\^\~\?\:]+"
     delimiters = r"[\{\}\(\)\[\]\,\.\;]"
-    return r"("+ml_comment+r")|("+comment+r")|("+directives+r")(\n)|(\n)|("+numeric_literal+r"|"+string_literal+r"|"+char_literal+r"|"+bool_literal+r")|("+identifier+r")|("+operators+r")|("+delimiters+r")"
+    # One group per token kind, see GROUP_DISPATCH
+    return r"("+ml_comment+r")|("+comment+r")|("+directives+r")|("+float_literal+r")|("+int_literal+r")|("+string_literal+r")|("+char_literal+r")|("+unterminated+r")|("+bool_literal+r")|("+identifier+r")|("+operators+r")|("+delimiters+r")"
+
 
 
+# Same pattern as build_regex, for matching over bytes and mapped files
+def build_regex_bytes():
+    return build_regex().encode('ascii')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,304 @@
+# Tracer.py
+# Pluggable tracing for the Parser
+# A tracer is any object with enter, exit, match, peek and lookahead hooks.
+# install() wraps the parser's methods on that one instance only, so a
+# Parser built without a tracer runs the plain class methods with nothing
+# in between.
+from collections import deque
+from dataclasses import dataclass, asdict
+import json
+import sys
+import time
+
+from TokenTable import TYPE_CODE
+
+
+# Parser methods reported through enter/exit
+TRACED_RULES = ('scan', 'parse_parameters', 'parse_expression_statement', 'parse_expression')
+
+# Every grammar rule of the Parser
+PARSE_RULES = (
+    'parse_program', 'parse_items', 'parse_item', 'parse_statement',
+    'parse_function_definition', 'parse_function_call', 'parse_function_declaration',
+    'parse_parameter', 'parse_parameters', 'parse_if_statement', 'parse_while_statement',
+    'parse_return_statement', 'parse_struct_declaration', 'parse_block_statement',
+    'parse_block_item', 'parse_expression_statement', 'parse_expression',
+    'parse_assignment', 'parse_declaration', 'parse_typedef', 'skip_body', 'parse_body', 'scan',
+)
+
+
+class Tracer:
+    """
+    Base tracer, every hook does nothing. Subclass and override what you need.
+
+    token is the parser's current token when the call was made, or None at
+    the end of the input. A match hook gets result None if the match failed.
+    A rule that raises goes to fail instead of exit, which by default calls
+    exit with result None. lookahead gets the number of tokens
+    a scan for the answer would have covered. rules are the Parser methods
+    install reports through enter and exit.
+    """
+    rules = TRACED_RULES
+
+    def enter(self, parser, rule, token):
+        pass
+
+    def exit(self, parser, rule, result):
+        pass
+
+    def fail(self, parser, rule, error):
+        self.exit(parser, rule, None)
+
+    def match(self, parser, expected_type, token, result):
+        pass
+
+    def peek(self, parser, expected_type, n, token, result):
+        pass
+
+    def lookahead(self, parser, target_low, target_high, distance, result):
+        pass
+
+
+def _describe(token):
+    if token is None:
+        return f'{"end of input":>38}'
+    # Tokens without a type of their own, such as ++ and ->, show their base
+    return f'{token.Id:>12} {token.ofType or token.base:>12} {token.value:>12}'
+
+
+class StdoutTracer(Tracer):
+    """
+    Prints every traced call, in the format of the old @debug decorators.
+    """
+    def __init__(self, file=None):
+        self.file = file
+
+    def _print(self, *args):
+        print(*args, file=self.file or sys.stdout)
+
+    def enter(self, parser, rule, token):
+        self._print(f"\nDebug:  {rule.upper()}")
+        self._print(f"Recieved: {_describe(token)}")
+
+    def exit(self, parser, rule, result):
+        self._print(f"{rule}  Returned: {result}\n\n")
+
+    def match(self, parser, expected_type, token, result):
+        self._print(f"\nDebug: MATCH")
+        self._print(f"Recieved: {_describe(token)}")
+        self._print(f"Expecting: {expected_type:>31}")
+        if result is not None:
+            self._print(f"Match!: {result}\n")
+
+    def peek(self, parser, expected_type, n, token, result):
+        self.enter(parser, 'peek', token)
+        self.exit(parser, 'peek', result)
+
+    def lookahead(self, parser, target_low, target_high, distance, result):
+        self._print(f"\nDebug: LOOKAHEAD {target_low} {target_high} over {distance} tokens: {result}")
+
+
+class RingBufferTracer(Tracer):
+    """
+    Keeps only the last size events, for a post-mortem after a parse error.
+
+    Events are tuples starting with the event name and the parser position:
+        ('enter', position, rule, token)
+        ('exit', position, rule, result)
+        ('match', position, expected_type, token, result)
+        ('peek', position, expected_type, n, token, result)
+        ('lookahead', position, target_low, target_high, distance, result)
+    """
+    def __init__(self, size=256):
+        self.events = deque(maxlen=size)
+
+    def enter(self, parser, rule, token):
+        self.events.append(('enter', parser.position, rule, token))
+
+    def exit(self, parser, rule, result):
+        self.events.append(('exit', parser.position, rule, result))
+
+    def match(self, parser, expected_type, token, result):
+        self.events.append(('match', parser.position, expected_type, token, result))
+
+    def peek(self, parser, expected_type, n, token, result):
+        self.events.append(('peek', parser.position, expected_type, n, token, result))
+
+    def lookahead(self, parser, target_low, target_high, distance, result):
+        self.events.append(('lookahead', parser.position, target_low, target_high, distance, result))
+
+    def dump(self, file=None):
+        """
+        Print the buffered events, oldest first.
+        """
+        for event in self.events:
+            print(*event, file=file or sys.stdout)
+
+
+@dataclass
+class RuleStats:
+    calls: int = 0
+    inclusive_s: float = 0.0    # Time in the rule and everything it called
+    exclusive_s: float = 0.0    # Time in the rule itself, less the traced rules it called
+    tokens: int = 0             # Tokens consumed
+    errors: int = 0             # Calls that raised
+    matches: int = 0            # match calls made directly by the rule
+    failed_matches: int = 0
+    peeks: int = 0              # peek calls made directly by the rule
+    peek_tokens: int = 0        # Tokens looked at by those peeks
+    lookaheads: int = 0         # lookahead calls made directly by the rule
+    lookahead_tokens: int = 0   # Tokens a scan for their answers would have covered
+
+
+class ProfilingTracer(Tracer):
+    """
+    Counts and times every grammar rule, for a per-rule profile of a parse.
+
+    inclusive_s and tokens of a recursive rule count its outermost call
+    only, so nested calls aren't counted twice. Matches, peeks and
+    lookaheads are put down to the innermost rule running. report() gives
+    the results as plain data, ready for json.
+    """
+    rules = PARSE_RULES
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stats = {}
+        self._stack = []    # [rule, start time, start position, time in traced callees]
+        self._active = {}   # rule -> calls of it running
+
+    def _rule_stats(self, rule):
+        stats = self.stats.get(rule)
+        if stats is None:
+            stats = self.stats[rule] = RuleStats()
+        return stats
+
+    def _current(self):
+        return self._rule_stats(self._stack[-1][0] if self._stack else '<top>')
+
+    def enter(self, parser, rule, token):
+        self._active[rule] = self._active.get(rule, 0) + 1
+        self._stack.append([rule, self.clock(), parser.position, 0.0])
+
+    def exit(self, parser, rule, result):
+        now = self.clock()
+        rule, start, position, callees = self._stack.pop()
+        elapsed = now - start
+        stats = self._rule_stats(rule)
+        stats.calls += 1
+        stats.exclusive_s += elapsed - callees
+        self._active[rule] -= 1
+        if not self._active[rule]:
+            stats.inclusive_s += elapsed
+            stats.tokens += parser.position - position
+        if self._stack:
+            self._stack[-1][3] += elapsed
+
+    def fail(self, parser, rule, error):
+        self._rule_stats(rule).errors += 1
+        self.exit(parser, rule, None)
+
+    def match(self, parser, expected_type, token, result):
+        stats = self._current()
+        stats.matches += 1
+        if result is None:
+            stats.failed_matches += 1
+
+    def peek(self, parser, expected_type, n, token, result):
+        stats = self._current()
+        stats.peeks += 1
+        stats.peek_tokens += n + 1
+
+    def lookahead(self, parser, target_low, target_high, distance, result):
+        stats = self._current()
+        stats.lookaheads += 1
+        stats.lookahead_tokens += distance
+
+    def report(self, parser=None):
+        """
+        {rule: {stat: value}}, with the parser's own counters under 'counters' if parser is given.
+        """
+        report = {'rules': {rule: asdict(stats) for rule, stats in self.stats.items()}}
+        if parser is not None:
+            report['counters'] = {name: getattr(parser, name) for name in
+                                  ('counter_main_loop', 'peek_error', 'match_error', 'error', 'unresolveable_error')}
+        return report
+
+    def dump(self, file=None, parser=None):
+        """
+        Write report() as json.
+        """
+        json.dump(self.report(parser), file or sys.stdout, indent=2)
+
+    def print_table(self, file=None):
+        """
+        Print the rules as a table, the most exclusive time first.
+        """
+        print(f"{'rule':28} {'calls':>8} {'incl s':>9} {'excl s':>9} {'tokens':>8} "
+              f"{'errors':>6} {'peeks':>7} {'lookahead tokens':>16}", file=file or sys.stdout)
+        for rule, stats in sorted(self.stats.items(), key=lambda item: -item[1].exclusive_s):
+            print(f"{rule:28} {stats.calls:8} {stats.inclusive_s:9.4f} {stats.exclusive_s:9.4f} {stats.tokens:8} "
+                  f"{stats.errors:6} {stats.peeks:7} {stats.lookahead_tokens:16}", file=file or sys.stdout)
+
+
+def _traced_rule(tracer, parser, rule, method):
+    def wrapper(*args, **kwargs):
+        tracer.enter(parser, rule, parser.current_token())
+        try:
+            result = method(*args, **kwargs)
+        except Exception as error:
+            tracer.fail(parser, rule, error)
+            raise
+        tracer.exit(parser, rule, result)
+        return result
+    return wrapper
+
+
+def _traced_match(tracer, parser, method):
+    def wrapper(expected_type):
+        token = parser.current_token()
+        try:
+            result = method(expected_type)
+        except SyntaxError:
+            tracer.match(parser, expected_type, token, None)
+            raise
+        tracer.match(parser, expected_type, token, result)
+        return result
+    return wrapper
+
+
+def _traced_peek(tracer, parser, method):
+    def wrapper(expected_type, n=0):
+        result = method(expected_type, n)
+        tracer.peek(parser, expected_type, n, parser.current_token(), result)
+        return result
+    return wrapper
+
+
+def _traced_lookahead(tracer, parser, method):
+    def wrapper(target_low, target_high, *args):
+        result = method(target_low, target_high, *args)
+        # How far a token by token scan would have gone for the same answer
+        position, jumps = parser.position, parser.jumps
+        end = jumps.end_of_item(position)
+        stop = jumps.stop if end is None else end + 1
+        found = [at for at in (jumps.find(position, TYPE_CODE[target_low], stop),
+                               jumps.find(position, TYPE_CODE[target_high], stop)) if at is not None]
+        distance = (min(found) + 1 if found else stop) - position
+        tracer.lookahead(parser, target_low, target_high, distance, result)
+        return result
+    return wrapper
+
+
+def install(parser, tracer, rules=None):
+    """
+    Route parser's match, peek, lookahead and rules through tracer.
+
+    rules defaults to tracer.rules. The wrappers are set on the instance,
+    shadowing the class methods for this parser only.
+    """
+    parser.match = _traced_match(tracer, parser, parser.match)
+    parser.peek = _traced_peek(tracer, parser, parser.peek)
+    parser.lookahead = _traced_lookahead(tracer, parser, parser.lookahead)
+    for rule in getattr(tracer, 'rules', TRACED_RULES) if rules is None else rules:
+        setattr(parser, rule, _traced_rule(tracer, parser, rule, getattr(parser, rule)))